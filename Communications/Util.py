@@ -1,4 +1,5 @@
 import struct
+import numpy as np
 
 
 def send_msg(conn, msg):
@@ -13,16 +14,110 @@ def recv_msg(conn):
     if not msg_len:
         return None
     msg_len = struct.unpack('<I', msg_len)[0]
-    # return msg
-    return recvall(conn, msg_len)
+    # return msg.  Our messages are text, so this is the one copy made (from the buffer recvall received into).
+    msg = recvall(conn, msg_len)
+    return None if msg is None else str(msg)
 
 
 def recvall(conn, n):
-    data = ''
-    # record time
-    while len(data) < n:
-        packet = conn.recv(n - len(data))
-        if not packet:
-            return None
-        data += packet
+    """
+    Receives exactly n bytes with recv_into, straight into a new bytearray (no strings are built or joined).
+    :return: bytearray of the n bytes, or None if the connection was closed first.
+    """
+    data = bytearray(n)
+    # Short messages usually arrive whole, so try a single recv_into before looping.
+    num_received = conn.recv_into(data, n)
+    if num_received < n and (num_received == 0 or not recv_into_exactly(conn, memoryview(data)[num_received:])):
+        return None
     return data
+
+
+def recv_into_exactly(conn, view):
+    """
+    Fills view (a writable memoryview) with bytes from conn using recv_into, so no intermediate strings are built.
+    :return: True if view was filled, False if the connection was closed first.
+    """
+    num_received = 0
+    n = len(view)
+    while num_received < n:
+        packet_size = conn.recv_into(view[num_received:], n - num_received)
+        if packet_size == 0:
+            return False
+        num_received += packet_size
+    return True
+
+
+def buffer_to_array(buf, dtype, count=-1, offset=0):
+    """
+    np.frombuffer that also accepts memoryviews (np.frombuffer can't take a memoryview in python 2).
+    The returned array shares memory with buf, no copy is made.
+
+    :param buf: str, bytearray or memoryview
+    :param dtype: dtype of the returned array
+    :param count: Number of items to read.  -1 means all items from offset to the end of buf.
+    :param offset: Start reading from this byte offset.
+    """
+    if not isinstance(buf, memoryview):
+        return np.frombuffer(buf, dtype=dtype, count=count, offset=offset)
+    dtype = np.dtype(dtype)
+    end = len(buf) if count < 0 else offset + count * dtype.itemsize
+    return np.asarray(buf[offset:end]).view(dtype)
+
+
+class MessageReceiver(object):
+    """
+    Receives messages from a socket into a single preallocated bytearray that is reused for every message.
+    Received bytes are handed back as memoryview slices of that buffer, so no copies are made.
+
+    Each recv_into asks for as much as fits in the buffer, not just the bytes asked for, so a message's header and
+    body (and any messages already waiting behind it) usually come in with a single system call.  Bytes received past
+    the end of a message are moved to the start of the buffer when it is next refilled, the only copy made.
+
+    Views (and np arrays made from them with buffer_to_array) are only valid until the next call to recv.  Copy
+    anything that needs to be kept longer.
+    """
+
+    def __init__(self, conn, buffer_size=2 ** 16):
+        """
+        :param conn: A connected socket
+        :param buffer_size: Initial size of our buffer in bytes.  It grows if a larger message arrives.
+        """
+        self.conn = conn
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        # Received bytes not yet handed out are self.buffer[read_index:end_index]
+        self.read_index = 0
+        self.end_index = 0
+
+    def recv(self, n):
+        """
+        Receives the next n bytes.  Raises a RuntimeError if the connection breaks.
+        :return: memoryview of the n received bytes.
+        """
+        start = self.read_index
+        if self.end_index - start < n:
+            self._fill(n)
+            start = 0
+        self.read_index = start + n
+        return self.view[start:start + n]
+
+    def _fill(self, n):
+        """
+        Moves the unread bytes to the start of our buffer (growing it if n bytes won't fit) and receives until at least
+        n bytes are unread.
+        """
+        num_unread = self.end_index - self.read_index
+        if n > len(self.buffer):
+            # Views handed out earlier stay valid, they still point at the old buffer.
+            new_buffer = bytearray(max(n, 2 * len(self.buffer)))
+            new_buffer[:num_unread] = self.view[self.read_index:self.end_index]
+            self.buffer = new_buffer
+            self.view = memoryview(self.buffer)
+        elif num_unread > 0:
+            self.view[:num_unread] = self.view[self.read_index:self.end_index].tobytes()
+        self.read_index, self.end_index = 0, num_unread
+        while self.end_index < n:
+            num_received = self.conn.recv_into(self.view[self.end_index:], len(self.buffer) - self.end_index)
+            if num_received == 0:
+                raise RuntimeError("connection broken")
+            self.end_index += num_received
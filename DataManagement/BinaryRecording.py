@@ -0,0 +1,177 @@
+"""
+A binary format for saving EEG recordings.  This is a compact, faster alternative to saving one comma separated line
+per sample (see EEGInterfaceParent.start_saving_data).  Use FileParser.load_binary_recording (or
+FileParser.load_eeg_recording, which also reads csv files) to load the saved data.
+
+File layout:
+
+    MAGIC                   8 bytes - 'CCDLEEG1'
+    header length           uint32 (little endian)
+    header                  json dictionary (padded with spaces to a multiple of 8 bytes).  Always contains
+                            'num_channels' and 'row_dtype'.  Usually also contains 'fs', 'channel_names',
+                            'resolutions' and 'notes' (a list of strings, such as the text header of the csv format).
+    rows                    one record per sample, laid out as row_dtype:
+                                index   int64    - packet (or sample) index
+                                time    float64  - time the data was collected (time.time())
+                                data    channel values, num_channels of data_dtype (float32 by default)
+
+As every row has the same size, the rows can be loaded with a single np.fromfile, or memory mapped.
+"""
+
+import json
+import struct
+import time
+import numpy as np
+
+MAGIC = 'CCDLEEG1'
+HEADER_LENGTH_FORMAT = '<I'
+DEFAULT_DATA_DTYPE = '<f4'
+
+
+def get_row_dtype(num_channels, data_dtype=DEFAULT_DATA_DTYPE):
+    """
+    Returns the structured np dtype of a single row (sample).
+    """
+    return np.dtype([('index', '<i8'), ('time', '<f8'), ('data', data_dtype, (num_channels,))])
+
+
+def is_binary_recording(file_path):
+    """
+    Returns True if the file starts with our MAGIC string.
+    """
+    with open(file_path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def read_header(f):
+    """
+    Reads the header from an open binary recording file.
+    :param f: File object opened in 'rb' mode, positioned at the start of the file.
+    :return: header dictionary, byte offset of the first row
+    """
+    if f.read(len(MAGIC)) != MAGIC:
+        raise ValueError('Not a binary recording file: %s' % getattr(f, 'name', f))
+    header_length_size = struct.calcsize(HEADER_LENGTH_FORMAT)
+    header_length = struct.unpack(HEADER_LENGTH_FORMAT, f.read(header_length_size))[0]
+    header = json.loads(f.read(header_length))
+    return header, len(MAGIC) + header_length_size + header_length
+
+
+def get_header_row_dtype(header):
+    """
+    Returns the row dtype saved in a header dictionary.
+    """
+    return np.dtype([(str(name), str(dtype)) if len(shape) == 0 else (str(name), str(dtype), tuple(shape))
+                     for name, dtype, shape in header['row_dtype']])
+
+
+def rows_to_array(rows):
+    """
+    Converts structured rows to a 2D float np array with the same columns as our csv format:
+        index, time, chan1, chan2, chan3...
+    """
+    num_channels = rows.dtype['data'].shape[0] if rows.dtype['data'].shape else 1
+    arr = np.empty((len(rows), 2 + num_channels))
+    arr[:, 0] = rows['index']
+    arr[:, 1] = rows['time']
+    arr[:, 2:] = rows['data'].reshape(len(rows), num_channels)
+    return arr
+
+
+class BinaryRecordingWriter(object):
+    """
+    Writes samples to a binary recording file.
+
+    Rows are buffered in memory and written with a single write once flush_interval seconds have passed since the last
+    write, or flush_bytes bytes are waiting, whichever comes first.  The header is written with the first samples, as
+    the number of channels may not be known before then.
+    """
+
+    def __init__(self, file_path, header_info=None, data_dtype=DEFAULT_DATA_DTYPE, flush_interval=1.0,
+                 flush_bytes=2 ** 20):
+        """
+        :param file_path: Where to save the recording.
+        :param header_info: dictionary of information to save in the header (such as fs, channel_names and
+                            resolutions).  Must be json serializable.  Can be added to until the first samples are
+                            written.  Defaults to None.
+        :param data_dtype: np dtype to save the channel values as.  Defaults to float32.
+        :param flush_interval: Max number of seconds samples are held in memory before being written to disk.
+                               If 0, samples are written immediately.  Defaults to 1.
+        :param flush_bytes: Max number of bytes held in memory before being written to disk.  Defaults to 1 MB.
+        """
+        self.f = open(file_path, 'wb')
+        self.header_info = dict(header_info) if header_info is not None else dict()
+        self.header_info.setdefault('notes', [])
+        self.data_dtype = np.dtype(data_dtype)
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self.row_dtype = None
+        self.pending_rows = []
+        self.pending_bytes = 0
+        self.last_flush_time = time.time()
+        self.num_samples_written = 0
+
+    def add_note(self, note):
+        """
+        Adds a string to the header's 'notes'.  Notes added after the header has been written are dropped (with a
+        warning).
+        """
+        if self.row_dtype is not None:
+            print "Warning: Header already written. Dropping note:", note[:80]
+            return
+        self.header_info['notes'].append(note)
+
+    def write(self, index, t, data):
+        """
+        Adds samples to the recording.
+
+        :param index: None, a single index, or a np array of shape (sample,).  None is saved as -1.
+        :param t: None, a single time, or a np array of shape (sample,).  None is saved as nan.
+        :param data: A list or 1D np array for a single sample, or a np array of shape (sample, channel).
+        """
+        data = np.asarray(data)
+        if data.ndim == 1:
+            data = data[np.newaxis, :]
+        if self.row_dtype is None:
+            self._write_header(num_channels=data.shape[1])
+        rows = np.empty(data.shape[0], dtype=self.row_dtype)
+        rows['index'] = -1 if index is None else index
+        rows['time'] = np.nan if t is None else t
+        rows['data'] = data
+        self.pending_rows.append(rows)
+        self.pending_bytes += rows.nbytes
+        if self.pending_bytes >= self.flush_bytes or time.time() - self.last_flush_time >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes all held samples to disk.
+        """
+        if self.pending_rows:
+            self.f.write(''.join([rows.tostring() for rows in self.pending_rows]))
+            self.num_samples_written += sum([len(rows) for rows in self.pending_rows])
+            self.pending_rows = []
+            self.pending_bytes = 0
+        self.f.flush()
+        self.last_flush_time = time.time()
+
+    def close(self):
+        """
+        Writes all held samples and closes the file.
+        """
+        if self.row_dtype is None:
+            # Nothing was ever recorded.  Still write a valid (empty) file.
+            self._write_header(num_channels=0)
+        self.flush()
+        self.f.close()
+
+    def _write_header(self, num_channels):
+        self.row_dtype = get_row_dtype(num_channels, self.data_dtype)
+        self.header_info['num_channels'] = num_channels
+        self.header_info['row_dtype'] = [(name, self.row_dtype[name].base.str, self.row_dtype[name].shape)
+                                         for name in self.row_dtype.names]
+        header_str = json.dumps(self.header_info)
+        # Pad so our rows start 8 byte aligned.
+        unpadded_size = len(MAGIC) + struct.calcsize(HEADER_LENGTH_FORMAT) + len(header_str)
+        header_str += ' ' * (-unpadded_size % 8)
+        self.f.write(MAGIC + struct.pack(HEADER_LENGTH_FORMAT, len(header_str)) + header_str)
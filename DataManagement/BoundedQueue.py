@@ -0,0 +1,164 @@
+"""
+A Queue.Queue with a capacity and a policy for what to do when a put finds it full.
+
+An unbounded queue with a stalled consumer (a display loop, a slow classifier) grows without limit, and the consumer
+falls further and further behind.  A BoundedQueue holds at most maxsize items, and when full either:
+
+    BLOCK        - waits for room (the Queue.Queue behaviour).
+    DROP_OLDEST  - throws away the oldest item, so the consumer always gets the most recent data.  Good for displays
+                   and live classification.
+    DROP_NEWEST  - throws away the item being put.
+    COALESCE     - joins the item onto the newest item already queued (see coalesce_blocks), so nothing is lost but
+                   the consumer gets fewer, larger blocks.  Good for data saving.
+
+Items dropped (and joined) are counted, see get_metrics.  As each consumer has its own queue, these are per consumer.
+
+A BoundedQueue is a Queue.Queue, so it can be used wherever one is (including QueueManagement.clear_queue):
+
+    live_queue = BoundedQueue(maxsize=50, policy=DROP_OLDEST)
+"""
+
+import time
+import Queue
+import numpy as np
+import CCDLUtil.DataManagement.StringParser as StringParser
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+COALESCE = 'coalesce'
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST, COALESCE)
+
+
+def coalesce_blocks(older, newer):
+    """
+    Joins two queue items into one, along the sample axis.
+
+    Items are (sample, channel) blocks (a list or 1D item is taken as a single sample), or (index, time, data) tuples
+    as put on the data_save_queue, in which case index and time (single values or one per sample) become one value per
+    sample.  Save tuples holding strings (notes, or already formatted lines) are joined if neither has an index or time.
+    Save tuples holding lists are not joined.
+
+    :param older: Item already on the queue.
+    :param newer: Item being put.
+    :return: The joined item, or None if the items cannot be joined.
+    """
+    if not isinstance(older, tuple) and not isinstance(newer, tuple):
+        return np.concatenate((np.atleast_2d(older), np.atleast_2d(newer)))
+    if not (isinstance(older, tuple) and isinstance(newer, tuple) and len(older) == len(newer)):
+        return None
+    older_data, newer_data = older[-1], newer[-1]
+    older_info, newer_info = older[:-1], newer[:-1]
+    if isinstance(older_data, str) or isinstance(newer_data, str):
+        if isinstance(older_data, str) and isinstance(newer_data, str) and \
+                all(info is None for info in older_info + newer_info):
+            return older_info + (StringParser.idempotent_append_newline(older_data) + newer_data,)
+        return None
+    if type(older_data) is list or type(newer_data) is list:
+        # Saved as written (ints stay ints).  Joining them in an array would save every value as a float.
+        return None
+    older_data, newer_data = np.atleast_2d(older_data), np.atleast_2d(newer_data)
+    joined_info = []
+    for older_column, newer_column in zip(older_info, newer_info):
+        if older_column is None and newer_column is None:
+            joined_info.append(None)
+        elif older_column is None or newer_column is None:
+            return None
+        else:
+            joined_info.append(np.concatenate((_per_sample(older_column, len(older_data)),
+                                               _per_sample(newer_column, len(newer_data)))))
+    return tuple(joined_info) + (np.concatenate((older_data, newer_data)),)
+
+
+def _per_sample(column, num_samples):
+    column = np.asarray(column)
+    return column if column.ndim == 1 else np.repeat(column.reshape(-1), num_samples)
+
+
+class BoundedQueue(Queue.Queue):
+
+    def __init__(self, maxsize=0, policy=BLOCK, coalesce_fn=coalesce_blocks, name=None):
+        """
+        :param maxsize: Most items held.  If 0 (or less), the queue is unbounded and policy is never used.  Defaults to 0.
+        :param policy: What a put does when the queue is full - BLOCK, DROP_OLDEST, DROP_NEWEST or COALESCE.
+                       Defaults to BLOCK.
+        :param coalesce_fn: COALESCE only - Function of (older item, newer item) returning the joined item.
+                            Returning None puts the item over capacity instead.  Defaults to coalesce_blocks.
+        :param name: Optional -- Name reported in get_metrics.
+        """
+        if policy not in POLICIES:
+            raise ValueError('Invalid policy %s.  Must be one of %s' % (str(policy), str(POLICIES)))
+        Queue.Queue.__init__(self, maxsize)
+        self.policy = policy
+        self.coalesce_fn = coalesce_fn
+        self.name = name
+        self.num_put = 0
+        self.num_dropped = 0
+        self.num_coalesced = 0
+        self.num_overfull = 0
+        self.max_qsize = 0
+        self.last_drop_time = None
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Puts an item on the queue.  If the queue is full, the policy decides what happens (block and timeout are only
+        used by the BLOCK policy, as in Queue.Queue.put).
+
+        :return: False if the item was dropped (DROP_NEWEST), otherwise True.
+        """
+        if self.policy == BLOCK or self.maxsize <= 0:
+            Queue.Queue.put(self, item, block, timeout)
+            with self.mutex:
+                self.num_put += 1
+                self.max_qsize = max(self.max_qsize, self._qsize())
+            return True
+        with self.mutex:
+            self.num_put += 1
+            if self._qsize() >= self.maxsize:
+                if self.policy == DROP_NEWEST:
+                    self._count_drop()
+                    return False
+                elif self.policy == DROP_OLDEST:
+                    self.queue.popleft()
+                    self._count_drop()
+                    # The dropped item will never be marked done.
+                    self.unfinished_tasks -= 1
+                else:
+                    joined = self.coalesce_fn(self.queue[-1], item) if self._qsize() > 0 else None
+                    if joined is not None:
+                        self.queue[-1] = joined
+                        self.num_coalesced += 1
+                        self.not_empty.notify()
+                        return True
+                    # Items that cannot be joined (such as a note between blocks) go over capacity, so nothing is lost.
+                    self.num_overfull += 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.max_qsize = max(self.max_qsize, self._qsize())
+            self.not_empty.notify()
+            return True
+
+    def _count_drop(self):
+        self.num_dropped += 1
+        self.last_drop_time = time.time()
+
+    def get_metrics(self):
+        """
+        :return: Dictionary with the queue's name, maxsize, policy, qsize, max_qsize (most items held at once),
+                 num_put, num_dropped, num_coalesced, num_overfull (items put over capacity because they could not be
+                 joined) and last_drop_time (time.time() of the last drop, or None).
+        """
+        with self.mutex:
+            return {'name': self.name, 'maxsize': self.maxsize, 'policy': self.policy, 'qsize': self._qsize(),
+                    'max_qsize': self.max_qsize, 'num_put': self.num_put, 'num_dropped': self.num_dropped,
+                    'num_coalesced': self.num_coalesced, 'num_overfull': self.num_overfull,
+                    'last_drop_time': self.last_drop_time}
+
+    def reset_metrics(self):
+        """
+        Zeroes the counts reported by get_metrics.
+        """
+        with self.mutex:
+            self.num_put, self.num_dropped, self.num_coalesced, self.num_overfull = 0, 0, 0, 0
+            self.max_qsize = self._qsize()
+            self.last_drop_time = None
@@ -2,123 +2,144 @@
 This file is for EEG buffers
 """
 
+import time
 import numpy as np
 import CCDLUtil.Utility.AssertVal as AV
 
 
 class MovingWindowBuffer(object):
 
-    # todo -- this fails if data passed > 2d samples passed at a time.
-    # todo -- test this method.
-
-    def __init__(self, moving_window_size, num_channels, buffer_queue, out_queue, update_interval, internal_buffer_size=None):
+    def __init__(self, moving_window_size, num_channels, buffer_queue, out_queue, update_interval, internal_buffer_size=None,
+                 run_assertions=False, include_window_info=False):
         """
-        A sample is defined as every read from the buffer_queue.
+        A sample is defined as a row of the data read from the buffer_queue.
         A channel is a dimension along the data read from the buffer queue.
 
         An understanding of the internal workings of this object are needed to use it most wisely:
             The buffer stores data in the format (sample #, channel #).
             The buffer's actual size (not visible to the client) is preallocated (and never changes) to avoid problems
                 with reallocating large portions of memory.  This size is controlled with 'internal_buffer_size'.
+            The buffer is a ring - new samples overwrite the oldest samples.  A window put on the out_queue is a view
+                into the ring (no copy is made) unless it wraps around the end of the ring, in which case it is copied.
+                **A window that is a view is overwritten once internal_buffer_size - moving_window_size more samples
+                arrive**, so consumers must use (or copy) windows before then.
 
         :param moving_window_size:  The number of samples to save to the buffer.
         :param num_channels:  Number of channels of data (ie. size of the list placed on the buffer_queue)
         :param buffer_queue:  Buffer queue is the origin of the data.
-                                Data passed to this queue should be a list or 1D np array.
-                                
+                                Data passed to this queue should be a list or 1D np array (a single sample) or a
+                                2D np array of shape (sample, channel) (a block of samples, such as the (10, channel)
+                                blocks put on the out_buffer_queue by the BrainAmpStreamer).
+
                                 If 'start' is passed to this queue, we will clear the buffer_queue, then begin putting data on the queue
                                 If 'stop' is passed to this queue, we will stop putting data on the queue and perpetually clear
                                     the buffer_queue
-                                
+
         :param out_queue:  Queue to place data on after the buffer reaches moving_window_size.
         :param update_interval: On ever update_interval samples, the pervious moving_window_size samples are placed on the out_buffer_queue
         :param internal_buffer_size: The size to make the buffer internally.  If none, will be set to 20 * moving_window_size. Defaults to None
+                                     Must be at least moving_window_size + update_interval.
+        :param run_assertions: If True, checks the shape of every block and window.  Defaults to False.
+        :param include_window_info: If True, (sample count, time, window) tuples are put on the out_queue instead of
+                                    just the window.  The sample count is the number of samples received (since the
+                                    buffer started or was restarted) up to and including the window's last sample, and
+                                    the time is when the block holding the window's last sample was read from the
+                                    buffer_queue.  Defaults to False.
         """
         if internal_buffer_size is None:
             internal_buffer_size = 20 * moving_window_size
+        if internal_buffer_size < moving_window_size + update_interval:
+            raise ValueError("internal_buffer_size must be at least moving_window_size + update_interval")
         self.moving_window_size, self.num_channels = moving_window_size, num_channels
         self.update_interval = update_interval
         self.internal_buffer_size = internal_buffer_size
         self.buffer = np.zeros((self.internal_buffer_size, self.num_channels))
         self.buffer_queue = buffer_queue
         self.out_queue = out_queue
+        self.run_assertions = run_assertions
+        self.include_window_info = include_window_info
+        # Number of samples received since we started (or were restarted).  Our newest sample is at
+        # self.buffer[(self.num_samples - 1) % self.internal_buffer_size]
+        self.num_samples = 0
 
     def start_buffer(self):
         """
          Starts the buffer, reading from buffer_queue and writing to out_buffer_queue
-         once the buffer reaches moving_window_size.  Once the buffer reaches moving_window_size and is placed on the
-         queue, the buffer is cleared.
-        """
-        # This is our lead and trailing storage indexes.  This means the data in our buffer (as seen by the client)
-            # is self.buffer[trail_buffer_storage_index:lead_buffer_storage_index, :]
-        lead_buffer_storage_index = -1  # Set to -1 so first update will make it 0. This avoids a fense-post problem.
-        trail_buffer_storage_index = lead_buffer_storage_index - self.moving_window_size
-        sample_index = 0
+         once the buffer reaches moving_window_size.  After that, the last moving_window_size samples are put on the
+         out_queue every update_interval samples.
+        """
         while True:
-            # We follow the algorithm
-                # 1. Get new sample and update indexes
-                # 2. Check if we need to adjust the buffer bounds
-                # 3. Add sample to the buffer at sample_index
-                # 4. Check if we need to put our buffer on the sample queue
-                    # The buffer should be formatted so this can be done easily
-
-            ###############################################
-            #  Step 1 - Get new sample and update indexes #
-            ###############################################
             sample_arr = self.buffer_queue.get()  # A blocking call
-            if sample_arr == 'stop':
-                # Reset our indexes.
-                lead_buffer_storage_index = -1  # Set to -1 so first update will make it 0. This avoids a fense-post problem.
-                trail_buffer_storage_index = lead_buffer_storage_index - self.moving_window_size
-                sample_index = 0
-                self.handle_stop()
-
-
-            # This one we just collected is our nth sample.
-            # Samples are zero based indexed
-            sample_index += 1
-            lead_buffer_storage_index += 1
-            trail_buffer_storage_index += 1
-
-
-            ############################################################
-            #  Step 2  - Check if we need to adjust the buffer bounds  #
-            ############################################################
-            # Check if we're going to go over the buffer limit.
-            if lead_buffer_storage_index == self.internal_buffer_size:
-                # Fix buffer by coping over data.  We use self.moving_window_size - 1 because we have not yet
-                # inserted the new data.
-                self.buffer[0:self.moving_window_size - 1, :] = self.buffer[trail_buffer_storage_index: lead_buffer_storage_index - 1]
-                # Reset our indexes.
-                lead_buffer_storage_index = self.moving_window_size
-                trail_buffer_storage_index = 0
-
-            # Run some assertions
-            AV.assert_less(lead_buffer_storage_index, self.internal_buffer_size)
-            AV.assert_equal(lead_buffer_storage_index - trail_buffer_storage_index, self.moving_window_size)
-
-            ############################################
-            #  Step 3  - Add Add sample to the buffer  #
-            ############################################
-            self.buffer[lead_buffer_storage_index, :] = sample_arr
-
-
-            #####################################################################
-            #  Step 4 - Check if we need to put our buffer on the sample queue  #
-            #####################################################################
-            # Check if we need to put the buffer on the queue.
-            if sample_index == self.update_interval:
-                sub_buffer_to_send = self.buffer[trail_buffer_storage_index:lead_buffer_storage_index, :]
-                AV.assert_equal(sub_buffer_to_send.shape[0], self.moving_window_size, message="Internal Error - buffer is incorrectly formatted")
-                # Add our buffer to the queue.
-                self.out_queue.put(sub_buffer_to_send)
-                # Reset our sample index
-                sample_index = 0
+            if isinstance(sample_arr, str):
+                if sample_arr == 'stop':
+                    self.reset()
+                    self.handle_stop()
+                continue
+            self.add_block(sample_arr, receive_time=time.time())
+
+    def reset(self):
+        """
+        Empties the buffer.  The next window is put on the out_queue once moving_window_size new samples arrive.
+        """
+        self.num_samples = 0
+
+    def add_block(self, block, receive_time=None):
+        """
+        Adds a sample or block of samples to the buffer, putting a window on the out_queue for every update_interval
+        samples passed.
+        :param block: list or 1D np array (one sample) or 2D np array of shape (sample, channel)
+        :param receive_time: Time the block was collected, passed on with the window if include_window_info is set.
+        """
+        block = np.asarray(block)
+        if block.ndim == 1:
+            block = block[np.newaxis, :]
+        if self.run_assertions:
+            AV.assert_equal(block.ndim, 2)
+            AV.assert_equal(block.shape[1], self.num_channels)
+        position = 0
+        while position < len(block):
+            # Add samples up to our next update.
+            samples_to_update = self.update_interval - self.num_samples % self.update_interval
+            chunk = block[position:position + samples_to_update]
+            self._write(chunk)
+            position += len(chunk)
+            if self.num_samples % self.update_interval == 0 and self.num_samples >= self.moving_window_size:
+                self._put_window(receive_time)
+
+    def _write(self, chunk):
+        """
+        Writes a chunk (at most update_interval samples) to the ring, wrapping around the end if needed.
+        """
+        start = self.num_samples % self.internal_buffer_size
+        end = start + len(chunk)
+        if end <= self.internal_buffer_size:
+            self.buffer[start:end] = chunk
+        else:
+            split = self.internal_buffer_size - start
+            self.buffer[start:] = chunk[:split]
+            self.buffer[:end - self.internal_buffer_size] = chunk[split:]
+        self.num_samples += len(chunk)
+
+    def _put_window(self, receive_time):
+        # One past our newest sample, in 1..internal_buffer_size
+        end = (self.num_samples - 1) % self.internal_buffer_size + 1
+        start = end - self.moving_window_size
+        if start >= 0:
+            window = self.buffer[start:end]
+        else:
+            # The window wraps around the end of the ring - copy it together.
+            window = np.concatenate((self.buffer[start:], self.buffer[:end]), axis=0)
+        if self.run_assertions:
+            AV.assert_equal(window.shape[0], self.moving_window_size)
+        if self.include_window_info:
+            self.out_queue.put((self.num_samples, receive_time, window))
+        else:
+            self.out_queue.put(window)
 
     def handle_stop(self):
         while True:
             sample_arr = self.buffer_queue.get()
-            if sample_arr == 'start':
+            if isinstance(sample_arr, str) and sample_arr == 'start':
                 return
 
 
@@ -127,39 +148,95 @@ class NonOverlappingBuffer(object):
     A NoOverlap Buffer is a buffer that reads in data.  This is a more primitive version of the MovingWindowBuffer class.
     """
 
-    def __init__(self, capacity, num_channels, buffer_queue, out_queue):
+    def __init__(self, capacity, num_channels, buffer_queue, out_queue, pool_size=0):
         """
-        A sample is defined as every read from the buffer_queue.
+        A sample is defined as a row of the data read from the buffer_queue.
         A channel is a dimension along the data read from the buffer queue.
 
-        This nonoverlapping buffer stores moving_window_size samples and, once moving_window_size is reached, it places
-        the results on the out_buffer_queue and flushes the buffer.
+        This nonoverlapping buffer stores capacity samples and, once capacity is reached, it places the full buffer
+        on the out_queue and starts filling the next buffer.
+
+        By default each buffer is a new array, which the consumer may keep.  With pool_size, buffers are preallocated
+        and reused (a pool of pool_size buffers, filled in turn), so no memory is allocated per buffer.  **Consumers
+        must then call release(buffer) once they are done with a buffer from the out_queue.**  If the buffer we are
+        about to fill has not been released, it is left to the consumer, a new buffer is allocated in its place and an
+        overrun is counted (see self.overruns).
+
         :param capacity:  The number of samples to save to the buffer.
         :param num_channels:  Number of channels of data (ie. size of the list placed on the buffer_queue)
         :param buffer_queue:  Buffer queue is the origin of the data.
-                                Data passed to this queue should be a list or 1D np array.
-        :param out_queue:  Queue to place data on after the buffer reaches moving_window_size.
+                                Data passed to this queue should be a list or 1D np array (a single sample) or a
+                                2D np array of shape (sample, channel) (a block of samples).
+        :param out_queue:  Queue to place full buffers on - np arrays of shape (capacity, num_channels).
+        :param pool_size: Number of buffers to reuse.  0 for no pool, otherwise at least 2 (2 for double buffering,
+                          3 for triple buffering).  Defaults to 0.
         """
+        if pool_size != 0 and pool_size < 2:
+            raise ValueError("pool_size must be 0 or at least 2")
         self.capacity, self.num_channels = capacity, num_channels
-        self.buffer = np.zeros((self.capacity, self.num_channels))
+        self.pooled = pool_size > 0
+        self.pool = [np.zeros((self.capacity, self.num_channels)) for _ in xrange(max(pool_size, 1))]
+        # True for buffers put on the out_queue and not yet released by the consumer.
+        self.in_use = [False] * len(self.pool)
+        self.pool_index = 0
+        self.buffer = self.pool[self.pool_index]
+        # Number of samples in self.buffer
         self.sample_index = 0
+        self.overruns = 0
         self.buffer_queue = buffer_queue
         self.out_queue = out_queue
 
     def start_buffer(self):
         """
          Starts the buffer, reading from buffer_queue and writing to out_buffer_queue
-         once the buffer reaches moving_window_size.  Once the buffer reaches moving_window_size and is placed on the
-         queue, the buffer is cleared.
+         once the buffer reaches capacity.  Once the buffer reaches capacity and is placed on the
+         queue, we start filling the next buffer.
         """
         while True:
             arr = self.buffer_queue.get()  # A blocking call
-            if self.sample_index % self.capacity == 0:  # check if we reached capcity
-                if self.sample_index != 0:  # Make sure we aren't putting on an empty buffer.
-                    self.out_queue.put(self.buffer)
-                self.buffer = np.zeros((self.capacity, self.num_channels))
-                self.buffer = arr  # Set our buffer to our new sample
-            else:
-                self.buffer = np.vstack((self.buffer, arr))
-            self.sample_index += 1
+            self.add_block(arr)
+
+    def add_block(self, block):
+        """
+        Adds a sample or block of samples, putting each buffer on the out_queue as it fills.
+        :param block: list or 1D np array (one sample) or 2D np array of shape (sample, channel)
+        """
+        block = np.asarray(block)
+        if block.ndim == 1:
+            block = block[np.newaxis, :]
+        position = 0
+        while position < len(block):
+            num_to_copy = min(self.capacity - self.sample_index, len(block) - position)
+            self.buffer[self.sample_index:self.sample_index + num_to_copy] = block[position:position + num_to_copy]
+            self.sample_index += num_to_copy
+            position += num_to_copy
+            if self.sample_index == self.capacity:  # check if we reached capacity
+                self._hand_off()
+
+    def release(self, buffer):
+        """
+        Returns a buffer taken from the out_queue to the pool (made with pool_size).  The buffer must not be used
+        after this.
+        """
+        for ii, pool_buffer in enumerate(self.pool):
+            if pool_buffer is buffer:
+                self.in_use[ii] = False
+                return
 
+    def _hand_off(self):
+        self.out_queue.put(self.buffer)
+        self.sample_index = 0
+        if not self.pooled:
+            # The consumer keeps the buffer.
+            self.buffer = self.pool[0] = np.zeros((self.capacity, self.num_channels))
+            return
+        self.in_use[self.pool_index] = True
+        self.pool_index = (self.pool_index + 1) % len(self.pool)
+        if self.in_use[self.pool_index]:
+            # The consumer still holds the buffer we would fill next.  Leave it to them.
+            self.overruns += 1
+            if self.overruns == 1 or self.overruns % 100 == 0:
+                print "Warning: NonOverlappingBuffer overrun (%d so far) - buffers are not being released fast enough" % self.overruns
+            self.pool[self.pool_index] = np.zeros((self.capacity, self.num_channels))
+            self.in_use[self.pool_index] = False
+        self.buffer = self.pool[self.pool_index]
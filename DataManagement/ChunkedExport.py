@@ -0,0 +1,181 @@
+"""
+A chunked, compressed alternative to saving our standard .mat format (FileParser.save_standard_mat_format).
+
+save_standard_mat_format needs the whole recording (and a copy made by scipy.io.savemat) in memory, and MAT v5 files
+cannot hold variables over 2 GB.  export_standard_format instead reads a Recording (see Recording.py) a chunk at a
+time and writes each chunk as it goes, so memory use is bounded by the chunk size whatever the recording length.
+
+The file is a zip archive (zip64, so there is no size limit), holding:
+
+    attributes.json             fs, channel_names, description, date_collected, eeg_system, event_markers,
+                                subject_name, and the dtype, shape and chunk lengths of each field.
+    <field>/00000000.npy        The chunks of each array field (unepoched_eeg_data, packet_indexes, time_stamps and
+    <field>/00000001.npy        aux_data), split along the first (sample) axis, each deflate compressed.
+    ...
+
+Read it back with ChunkedExportReader, which only decompresses the chunks of the fields (and samples) asked for:
+
+    export = ChunkedExportReader(export_path)
+    fs = export.attributes['fs']
+    first_second = export.get('unepoched_eeg_data', 0, fs)
+"""
+
+import io
+import json
+import zipfile
+import numpy as np
+import CCDLUtil.Utility.Constants as CCDLConstants
+
+ATTRIBUTES_NAME = 'attributes.json'
+DEFAULT_CHUNK_SAMPLES = 2 ** 16
+
+
+def export_standard_format(save_path, recording, eeg_system, event_markers, channel_names, experiment_description,
+                           date_collected, fs=None, subject_name=None, data_columns=None, aux_columns=None,
+                           chunk_samples=DEFAULT_CHUNK_SAMPLES, verbose=True):
+    """
+    Saves a recording in our standard format (see FileParser.get_standard_mat_format), chunk by chunk.
+
+    :param save_path: Where to save the export.
+    :param recording: A DataManagement.Recording.Recording (for instance from Recording.open_recording).
+    :param eeg_system: string - Must be one of CCDLUtil.Utility.Constants.EEGSystemNames.ALL_VALID_NAMES
+    :param event_markers: Our event markers that could be used for epoching our eeg.  Must be json serializable.
+    :param channel_names: The names of the channels saved as unepoched_eeg_data.
+    :param experiment_description: string - A written description of what occurred during the experiment.
+    :param date_collected: string - Denoting the date in which the data was collected.
+    :param fs: Our sampling rate in Hz.  If None, taken from the recording's header.
+    :param subject_name: String, Number, or None - The name or number of our subject.
+    :param data_columns: Channels of the recording to save as unepoched_eeg_data.  If None, all channels not in
+                         aux_columns.
+    :param aux_columns: Channels of the recording to save as aux_data.  If None, aux_data is not saved.
+    :param chunk_samples: Number of samples read and written at a time.  Defaults to 65536.
+    :param verbose: If True, prints where the export was saved.
+    """
+    if eeg_system not in CCDLConstants.EEGSystemNames.ALL_VALID_NAMES:
+        raise ValueError('The EEG System must be a valid system as shown in CCDLUtil.Utility.Constants.EEGSystemNames.ALL_VALID_NAMES')
+    aux_columns = list(aux_columns) if aux_columns is not None else []
+    if data_columns is None:
+        data_columns = [column for column in range(recording.num_channels) if column not in aux_columns]
+    data_columns = list(data_columns)
+    if len(data_columns) != len(list(channel_names)):
+        raise ValueError('There are not the same number of channel names as channels given: %d Channels, %d Channel Names' % (len(data_columns), len(channel_names)))
+    attributes = {'description': experiment_description, 'date_collected': date_collected,
+                  'channel_names': list(channel_names), 'fs': fs if fs is not None else recording.fs,
+                  'event_markers': event_markers, 'eeg_system': eeg_system}
+    if subject_name is not None:
+        attributes['subject_name'] = subject_name
+    writer = ChunkedExportWriter(save_path, attributes)
+    try:
+        for start in range(0, len(recording), chunk_samples):
+            chunk = recording[start:start + chunk_samples]
+            chunk_data = np.asarray(chunk.data)
+            writer.append('unepoched_eeg_data', chunk_data[:, data_columns])
+            writer.append('packet_indexes', chunk.indexes)
+            writer.append('time_stamps', chunk.times)
+            if aux_columns:
+                writer.append('aux_data', chunk_data[:, aux_columns])
+    except Exception:
+        # Leave an (incomplete) closed file rather than an open handle.
+        writer.zip_file.close()
+        raise
+    writer.close()
+    if verbose:
+        print 'Saved export to:', save_path
+
+
+class ChunkedExportWriter(object):
+    """
+    Writes named arrays to a chunked export a chunk at a time (see the top of this file for the layout).
+    """
+
+    def __init__(self, file_path, attributes=None):
+        """
+        :param file_path: Where to save the export.
+        :param attributes: json serializable dictionary saved with the arrays.  Defaults to None (empty).
+        """
+        self.attributes = dict(attributes) if attributes is not None else dict()
+        # The attributes are only written by close.  Check they can be before any chunks are written.
+        json.dumps(self.attributes)
+        self.zip_file = zipfile.ZipFile(file_path, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+        self.fields = dict()
+
+    def append(self, field, chunk):
+        """
+        Appends a chunk to a field.  Chunks of a field must agree in dtype and in all but their first dimension.
+        """
+        chunk = np.asarray(chunk)
+        field_info = self.fields.setdefault(field, {'dtype': chunk.dtype.str, 'shape': list(chunk.shape[1:]),
+                                                    'chunk_lengths': []})
+        if chunk.dtype.str != field_info['dtype'] or list(chunk.shape[1:]) != field_info['shape']:
+            raise ValueError('Chunk does not match the earlier chunks of %s' % field, chunk.dtype.str, chunk.shape)
+        f = io.BytesIO()
+        np.save(f, np.ascontiguousarray(chunk))
+        self.zip_file.writestr('%s/%08d.npy' % (field, len(field_info['chunk_lengths'])), f.getvalue())
+        field_info['chunk_lengths'].append(len(chunk))
+
+    def close(self):
+        """
+        Writes the attributes and closes the file.
+        """
+        attributes = dict(self.attributes)
+        attributes['fields'] = self.fields
+        self.zip_file.writestr(ATTRIBUTES_NAME, json.dumps(attributes))
+        self.zip_file.close()
+
+
+class ChunkedExportReader(object):
+    """
+    Reads a chunked export lazily.  Only the chunks holding the requested samples are decompressed.
+    """
+
+    def __init__(self, file_path):
+        self.zip_file = zipfile.ZipFile(file_path, 'r')
+        self.attributes = json.loads(self.zip_file.read(ATTRIBUTES_NAME))
+        self.fields = self.attributes.pop('fields')
+        self.chunk_starts = dict([(field, np.cumsum([0] + info['chunk_lengths']))
+                                  for field, info in self.fields.iteritems()])
+
+    def keys(self):
+        """
+        Names of the array fields.
+        """
+        return self.fields.keys()
+
+    def get_shape(self, field):
+        return (int(self.chunk_starts[field][-1]),) + tuple(self.fields[field]['shape'])
+
+    def get(self, field, start=None, stop=None):
+        """
+        Reads samples start:stop of a field.
+        :param start: If None, from the first sample.
+        :param stop: If None, to the last sample.
+        :return: np array
+        """
+        chunk_starts = self.chunk_starts[field]
+        start, stop, _ = slice(start, stop).indices(int(chunk_starts[-1]))
+        stop = max(start, stop)
+        first_chunk = max(0, np.searchsorted(chunk_starts, start, side='right') - 1)
+        result = np.empty((stop - start,) + tuple(self.fields[field]['shape']), dtype=self.fields[field]['dtype'])
+        for chunk_index in range(first_chunk, len(chunk_starts) - 1):
+            chunk_start = chunk_starts[chunk_index]
+            if chunk_start >= stop:
+                break
+            chunk = self._read_chunk(field, chunk_index)
+            lo = max(start, chunk_start)
+            hi = min(stop, chunk_starts[chunk_index + 1])
+            result[lo - start:hi - start] = chunk[lo - chunk_start:hi - chunk_start]
+        return result
+
+    def __getitem__(self, field):
+        """
+        An array field in full, or an attribute.
+        """
+        if field in self.fields:
+            return self.get(field)
+        return self.attributes[field]
+
+    def close(self):
+        self.zip_file.close()
+
+    def _read_chunk(self, field, chunk_index):
+        return np.load(io.BytesIO(self.zip_file.read('%s/%08d.npy' % (field, chunk_index))))
@@ -5,44 +5,86 @@ This file is for generic operations related to matrix and dictionary manipulatio
 import numpy as np
 import CCDLUtil.Utility.AssertVal as AV
 import CCDLUtil.DataManagement.ArrayParser as CCDLArrayParser
+import CCDLUtil.DataManagement.SortedIndex as CCDLSortedIndex
 import time
-import bisect
 import ast
 
-def epoch_data(eeg_indexes, raw_data, trial_starts, trial_stops, trim=False):
+def epoch_data(eeg_indexes, raw_data, trial_starts, trial_stops, trim=False, copy=True):
     """
     Takes raw data of shape [sample, channel] and returns epoched data of shape [epoch, sample channel].
     The epoches are taken according to the indexing of the start and stop values in the eeg indexes
 
-    :param eeg_indexes: epoch index for each sample in raw data (eeg index or time)
+    :param eeg_indexes: epoch index for each sample in raw data (eeg index or time).  Must be nondecreasing.
+                        Can be a DataManagement.SortedIndex.SortedIndex of them, to skip checking this again.
     :param raw_data: data shape [sample, channel]
     :param trial_starts: lst of trial start values (eeg index or time)
     :param trial_stops: lst of trial start values (eeg index or time)
     :param trim: if trim, we will cut the end of one axis to make the concat work.
-    :return:
+    :param copy: If False and the epochs are evenly spaced in raw_data (such as fixed length trials at a fixed
+                 interval), a read only view into raw_data is returned instead of a copy.  Otherwise a copy is made.
+                 Defaults to True.
+    :return: epoched data - shape [epoch, sample, channel]
     """
     AV.assert_equal(len(eeg_indexes), raw_data.shape[0])
     AV.assert_equal(len(trial_starts), len(trial_stops))
-    epoched_data = None
-    for start_stop_index in xrange(len(trial_starts)):
-        start_packet_index = bisect.bisect_right(eeg_indexes, trial_starts[start_stop_index])
-        end_packet_index = bisect.bisect_left(eeg_indexes, trial_stops[start_stop_index])
-        AV.assert_less(start_packet_index, end_packet_index)
-        trial_epoched_data = np.expand_dims(raw_data[start_packet_index:end_packet_index], axis=0)
-        try:
-            epoched_data = trial_epoched_data if epoched_data is None else np.concatenate((epoched_data, trial_epoched_data), axis=0)
-        except ValueError:
-            if trim:
-                min_shape = min(epoched_data.shape[1], trial_epoched_data.shape[1])
-                epoched_data = epoched_data[:, :min_shape, :]
-                trial_epoched_data = trial_epoched_data[:, :min_shape, :]
-                epoched_data = np.concatenate((epoched_data, trial_epoched_data), axis=0)
-            else:
-                raise ValueError('Epoched data shape', epoched_data.shape, 'Trial Epoched data shape', trial_epoched_data.shape)
+    start_packet_indexes, end_packet_indexes = get_epoch_bounds(eeg_indexes, trial_starts, trial_stops)
+    epoched_data = cut_epochs(raw_data, start_packet_indexes, end_packet_indexes, trim=trim, copy=copy)
     AV.assert_equal(len(trial_stops), epoched_data.shape[0])
     return epoched_data
 
 
+def get_epoch_bounds(eeg_indexes, trial_starts, trial_stops):
+    """
+    Finds where each trial starts and stops in the raw data (all trials at once).
+    The first sample of a trial is the first sample with an eeg index after the trial start value.  The last sample is
+    the last sample with an eeg index before the trial stop value.
+
+    :param eeg_indexes: epoch index for each sample in raw data (eeg index or time), or a SortedIndex of them.
+                        Must be nondecreasing (a ValueError is raised otherwise).
+    :param trial_starts: lst of trial start values (eeg index or time)
+    :param trial_stops: lst of trial start values (eeg index or time)
+    :return: np array of start sample indexes, np array of stop sample indexes (exclusive)
+    """
+    start_packet_indexes, end_packet_indexes = CCDLSortedIndex.as_sorted_index(eeg_indexes).get_ranges(
+        trial_starts, trial_stops, low_side='right', high_side='left')
+    empty_trials = np.flatnonzero(start_packet_indexes >= end_packet_indexes)
+    if len(empty_trials) > 0:
+        AV.assert_less(start_packet_indexes[empty_trials[0]], end_packet_indexes[empty_trials[0]])
+    return start_packet_indexes, end_packet_indexes
+
+
+def cut_epochs(raw_data, start_packet_indexes, end_packet_indexes, trim=False, copy=True):
+    """
+    Cuts raw data of shape [sample, channel] into epochs of shape [epoch, sample, channel].
+
+    :param raw_data: data shape [sample, channel]
+    :param start_packet_indexes: Index of the first sample of each epoch
+    :param end_packet_indexes: Index one past the last sample of each epoch
+    :param trim: If the epochs have different lengths and trim is True, all epochs are cut to the length of the shortest.
+                 If trim is False, a ValueError is raised.
+    :param copy: If False and the epochs are evenly spaced, a read only view into raw_data is returned.
+    :return: epoched data - shape [epoch, sample, channel]
+    """
+    start_packet_indexes = np.asarray(start_packet_indexes)
+    lengths = np.asarray(end_packet_indexes) - start_packet_indexes
+    num_samples = lengths.min()
+    if np.any(lengths != num_samples) and not trim:
+        raise ValueError('Epochs have different numbers of samples', lengths.min(), lengths.max())
+    steps = np.diff(start_packet_indexes)
+    if not copy and len(steps) > 0 and np.all(steps == steps[0]) and steps[0] > 0:
+        # Evenly spaced - every epoch is the previous one offset by a fixed number of samples.
+        first = raw_data[start_packet_indexes[0]:]
+        epoched_data = np.lib.stride_tricks.as_strided(
+            first, shape=(len(start_packet_indexes), num_samples) + raw_data.shape[1:],
+            strides=(steps[0] * raw_data.strides[0],) + raw_data.strides)
+        epoched_data.flags.writeable = False
+        return epoched_data
+    epoched_data = np.empty((len(start_packet_indexes), num_samples) + raw_data.shape[1:], dtype=raw_data.dtype)
+    for epoch_index, start_packet_index in enumerate(start_packet_indexes):
+        epoched_data[epoch_index] = raw_data[start_packet_index:start_packet_index + num_samples]
+    return epoched_data
+
+
 def cut_epoches_to_same_number_of_samples(epoched_data_list):
     """
     Takes a list of epoched data, (ie a list of data sets, each with the shape (epoch, num_samples, channel)) and trims each data set to have
@@ -59,7 +101,7 @@ def cut_epoches_to_same_number_of_samples(epoched_data_list):
     return epoched_data_list
 
 
-def epoch_data_from_key(eeg_data_indexes, eeg_data, trial_list, start_key_list, end_key_list):
+def epoch_data_from_key(eeg_data_indexes, eeg_data, trial_list, start_key_list, end_key_list, copy=True):
     """
     Takes the list of eeg_data_indexes, eeg_data, trial_list, start_key_list, end_key_list and returns a list
     of epoched data, epoched according to those parameters.  Note that each element of the returned epoched data has the shape
@@ -67,20 +109,35 @@ def epoch_data_from_key(eeg_data_indexes, eeg_data, trial_list, start_key_list,
     
     If you desire all elements to have the same shape, consider calling cut_epoches_to_same_number_of_samples(epoch_data_from_key(args)).
     
-    :param eeg_data_indexes: A list of nondecreasing markers for each trial, this can be either time or eeg_indexes.
+    :param eeg_data_indexes: A list of nondecreasing markers for each trial, this can be either time or eeg_indexes
+                             (or a SortedIndex of them).
     :param eeg_data: Unepoched EEG data
     :param trial_list: List of trial dictionaries, as extracted from a log file.
     :param start_key_list: List of start keys
     :param end_key_list: List of corresponding end keys. Must be same length as start_key_list
+    :param copy: If False, evenly spaced epochs are returned as read only views into eeg_data (see epoch_data).
+                 Defaults to True.
     :return: List of epoched eeg data, epoched according to the values provided in the trial_list and the start and end key_lists.
     """
 
-    epoched_data_list = []
+    AV.assert_equal(len(eeg_data_indexes), eeg_data.shape[0])
+    # Gather the trials of every key pair, so they can all be found in the eeg data at once.
+    all_start_indexes, all_end_indexes, num_trials = [], [], []
     for start_key, end_key in zip(start_key_list, end_key_list):
         start_indexes = extract_value_from_list_of_dicts(dictionary_list=trial_list, key=start_key)
         end_indexes = extract_value_from_list_of_dicts(dictionary_list=trial_list, key=end_key)
         end_indexes = convert_start_end_index_lists_to_single_duration_trials(start_trial_index=start_indexes, end_trial_index=end_indexes)
-        epoched_data_list.append(epoch_data(eeg_indexes=eeg_data_indexes, trial_starts=start_indexes, trial_stops=end_indexes, raw_data=eeg_data, trim=True))
+        all_start_indexes += list(start_indexes)
+        all_end_indexes += list(end_indexes)
+        num_trials.append(len(start_indexes))
+    start_packet_indexes, end_packet_indexes = get_epoch_bounds(eeg_data_indexes, all_start_indexes, all_end_indexes)
+
+    epoched_data_list = []
+    offset = 0
+    for key_num_trials in num_trials:
+        epoched_data_list.append(cut_epochs(eeg_data, start_packet_indexes[offset:offset + key_num_trials],
+                                            end_packet_indexes[offset:offset + key_num_trials], trim=True, copy=copy))
+        offset += key_num_trials
     return epoched_data_list
 
 
@@ -146,7 +203,8 @@ def trim_freqs(freqs, density, high=None, low=None):
     and trim freqs is called on this list with high=15 and low=10,
     the result would be [ 10.  11.  12.  13.  14.]
     
-    :param freqs: freqs (numpy array)
+    :param freqs: freqs (numpy array), or a DataManagement.SortedIndex.SortedIndex of them (to avoid checking they are
+                  sorted on every call).
     :param density: density -- Shape: (epoch, sample, channel) OR (epoch, sample)
     :param high: removes all freqs above and equal to this val . Cast to int if passed a float.
     :param low: removes all freqs below this val.  Cast to int if passed a float.
@@ -157,23 +215,12 @@ def trim_freqs(freqs, density, high=None, low=None):
     if high is None and low is None:
         raise ValueError('High or low must be an int')
 
-    if high is not None:
-        high = int(high)
-
-        index_of_high = bisect.bisect_left(a=freqs, x=high)
-        freqs = freqs[:index_of_high]
-        try:
-            density = density[:, :index_of_high, :]
-        except IndexError:
-            density = density[:, :index_of_high]
-    if low is not None:
-        low = int(low)
-        index_of_low = bisect.bisect_left(a=freqs, x=low)
-        freqs = freqs[index_of_low:]
-        try:
-            density = density[:, index_of_low:, :]
-        except IndexError:
-            density = density[:, index_of_low:]
+    freq_index = CCDLSortedIndex.as_sorted_index(freqs)
+    index_of_low, index_of_high = freq_index.get_range(None if low is None else int(low),
+                                                       None if high is None else int(high))
+    freqs = freq_index.values[index_of_low:index_of_high]
+    density = density[:, index_of_low:index_of_high]
+
     # Assure we trimmed something
     AV.assert_not_equal(original_num_samples, density.shape[1])
     # Ensure each density pos has a corresponding freq.
@@ -202,53 +249,75 @@ def convert_start_end_index_lists_to_single_duration_trials(start_trial_index, e
     return CCDLArrayParser.convert_ununiform_start_stop_lists_to_uniform_start_stop_lists(start_lst=start_trial_index, stop_lst=end_trial_index)
 
 
-def reepoch_data_with_fixed_window_size(epoched_data, labels, window_size):
+def reepoch_data_with_fixed_window_size(epoched_data, labels, window_size, hop=None):
     """
     For especially long epochs, we can make them into multiple smaller epochs - and thus have more data to play with
     This takes an np array of epoched data - shape (epoch, sample, channel) and returnes a new np array of shape
     (epoch, sample -- of len window_size, channel) where the num epochs and num samples are different than epoched_data
     Number of channels is unaffected. This transformation is determined by window size.
 
-    A new np array is returned. epoched_data is unmodified.
+    A new np array is returned. epoched_data is unmodified.  To avoid the copy (especially with overlapping windows),
+    use sliding_window_reepoch.
 
     Additionally, as we are altering the data array, we will need to change the size of the labels to accommodate.
 
     :param epoched_data: Original epoched data - shape (epoch, sample, channel)
     :param labels: np array of labels for our data - shape (epoch,)
     :param window_size: Size of desired window (samples)
-    :return: transformed epoch data of - shape (new epoch num, new num sample, channel)
+    :param hop: Number of samples between the starts of consecutive windows.  If None, window_size (no overlap).
+                Defaults to None.
+    :return: transformed epoch data of - shape (new epoch num, new num sample, channel), labels, windows_per_epoch
     """
+    windows, labels, _, _ = sliding_window_reepoch(epoched_data=epoched_data, labels=labels, window_size=window_size,
+                                                   hop=hop)
+    # windows.shape -> (num epoch, windows per epoch, window_size, channels), ie. (32, 37, 120, 31)
+    windows_per_epoch = windows.shape[1]
+    # Shape is (num new epochs, epoch samples, num channels)  ie. (1184, 120, 31).  Reshaping makes our (only) copy,
+    # except when the windows tile the epochs exactly, where it gives a read only view of epoched_data instead.
+    new_data = windows.reshape((-1,) + windows.shape[2:])
+    if not new_data.flags.writeable:
+        new_data = new_data.copy()
+
+    # Return our newly reepoched data - shape (epoch, sample, channel)
+    return new_data, labels, windows_per_epoch
 
-    # Get some initial parameters
-    original_num_epoch = epoched_data.shape[0]
-    block_dur = epoched_data.shape[1]
-    num_channels = epoched_data.shape[2]
-    # epoched_data.shape -> (num epoch, samples, channels), ie. (32, 4514, 31)
 
-    windows_per_epoch = int(block_dur / window_size)
-    # pre allocate space for our new epochs (This is to save time from multiple np concats).
-    # Shape is (num new epochs, epoch samples, num channels)  ie. (1184, 120, 31)
-    new_data = np.zeros(shape=(windows_per_epoch * original_num_epoch, window_size, num_channels))
-    for epoch_index in xrange(0, epoched_data.shape[0]):
-        for sample_offset, sample_index in enumerate(xrange(0, block_dur, window_size)):
-            # We ran off the edge of our data.  Move onto the next epoch
-            if sample_index + window_size >= block_dur: continue
+def sliding_window_reepoch(epoched_data, labels, window_size, hop=None):
+    """
+    Splits each epoch into (possibly overlapping) windows of window_size samples, hop samples apart, without copying
+    any data.  Windows that would run off the end of an epoch are dropped.
 
-            # Get the new epoch
-            new_epoch = epoched_data[epoch_index, sample_index:sample_index + window_size, :]
-            assert new_epoch.shape[0] == window_size, '%d, %d' % (new_epoch.shape[0], window_size)
+    The windows are returned as a read only view into epoched_data.  Flattening them to (window, sample, channel)
+    copies them, so to save memory index them through the provenance arrays instead:
 
-            new_data[epoch_index * windows_per_epoch + sample_offset, :, :] = new_epoch
+        windows, window_labels, window_epoch_indexes, window_start_samples = sliding_window_reepoch(data, labels, 120, 30)
+        window_number = window_start_samples // 30
+        single_window = windows[window_epoch_indexes[ii], window_number[ii]]  # shape (120, channel)
 
-    # Reshape our labels
+    :param epoched_data: Original epoched data - shape (epoch, sample, channel)
+    :param labels: np array of labels for our data - shape (epoch,).  Can be None.
+    :param window_size: Size of desired window (samples)
+    :param hop: Number of samples between the starts of consecutive windows.  If None, window_size (no overlap).
+                Defaults to None.
+    :return: windows - read only view of shape (epoch, windows per epoch, window_size, channel),
+             labels - the label of each window, shape (epoch * windows per epoch,) (None if labels is None),
+             window_epoch_indexes - the epoch each window came from, shape (epoch * windows per epoch,),
+             window_start_samples - index of each window's first sample within its epoch, shape (epoch * windows per epoch,)
+             The flat arrays are in window order within epoch order (the order of windows.reshape(-1, ...)).
+    """
+    if hop is None:
+        hop = window_size
+    num_epochs, num_samples = epoched_data.shape[:2]
+    windows_per_epoch = (num_samples - window_size) // hop + 1 if num_samples >= window_size else 0
+    windows = np.lib.stride_tricks.as_strided(
+        epoched_data, shape=(num_epochs, windows_per_epoch, window_size) + epoched_data.shape[2:],
+        strides=(epoched_data.strides[0], hop * epoched_data.strides[1]) + epoched_data.strides[1:])
+    windows.flags.writeable = False
+    window_epoch_indexes = np.repeat(np.arange(num_epochs), windows_per_epoch)
+    window_start_samples = np.tile(np.arange(windows_per_epoch) * hop, num_epochs)
     if labels is not None:
-        new_labels = []
-        for label in labels:
-            new_labels += [label] * windows_per_epoch
-        labels = np.asarray(new_labels)
-
-    # Return our newly reepoched data - shape (epoch, sample, channel)
-    return new_data, labels, windows_per_epoch
+        labels = np.repeat(np.asarray(labels), windows_per_epoch)
+    return windows, labels, window_epoch_indexes, window_start_samples
 
 
 def idempotent_add_channel_dimension(data):
@@ -3,13 +3,17 @@ import yaml
 import pickle
 import os
 import argparse
+import multiprocessing
 import numpy as np
 import CCDLUtil.Utility.AssertVal as AV
 import time
 import bisect
 import ast
+import json
 import scipy.io
 import CCDLUtil.Utility.Constants as CCDLConstants
+import CCDLUtil.DataManagement.BinaryRecording as CCDLBinaryRecording
+import CCDLUtil.DataManagement.Log as CCDLLog
 
 
 def load_yaml_file(config_file_path):
@@ -61,7 +65,7 @@ def load_matlab_file(mat_file_path):
     Loads a .mat file to a python dictionary
     :param mat_file_path: The path to the matlab file.
     """
-    return scipy.io.savemat(file_name=mat_file_path)
+    return scipy.io.loadmat(file_name=mat_file_path)
 
 
 def get_standard_mat_format(eeg_system, unepoched_eeg_data, event_markers, channel_names, experiment_description, date_collected, fs, time_stamps, packet_indexes, aux_data=None, subject_name=None):
@@ -118,6 +122,8 @@ def save_standard_mat_format(save_path, eeg_system, unepoched_eeg_data, event_ma
     :param subject_name: String, Number, or None - The name or number of our subject.
     :param save_location_path: String or None (defaults to None) - The location in which to save the mat formatted dictionary.  If None, it will not be saved.
     :return: A dictionary that fits our standard .mat formatting.
+
+    For recordings too large to hold (twice) in memory, see DataManagement.ChunkedExport.export_standard_format.
     """
     mdict = get_standard_mat_format(eeg_system, unepoched_eeg_data, event_markers, channel_names, experiment_description, date_collected, fs, time_stamps, packet_indexes, aux_data=aux_data, subject_name=subject_name)
 
@@ -126,49 +132,205 @@ def save_standard_mat_format(save_path, eeg_system, unepoched_eeg_data, event_ma
         print 'Saved mat file to:', save_path
     return mdict
 
-def iter_loadtxt(filename, delimiter=',', skiprows=0, dtype=float):
+def iter_loadtxt(filename, delimiter=',', skiprows=0, dtype=float, usecols=None, num_processes=1):
     """
     Loads a txt file to a 2D numpy array. This is effectively equivalent to np.loadtxt() - but more efficient.
+    The file is parsed in chunks (see parallel_loadtxt), in this process unless num_processes is given.
 
     Ignores incomplete rows and trailing delimiters.
     :param filename: Name of file to load
     :param delimiter: Delimiter (such as ',')
     :param skiprows: Skip rows in header.
     :param dtype: type of data.
+    :param usecols: List of column indexes to load.  If None, all columns are loaded.  Defaults to None.
+    :param num_processes: Number of processes to parse with.  If None, one per cpu.  Defaults to 1, so no processes
+                          are started (on Windows, starting them needs an if __name__ == '__main__' guard in the
+                          calling script).
     :return: np array of data.
     """
-    def iter_func():
-        line_len = None
-        with open(filename, 'r') as infile:
-            for _ in range(skiprows):
-                next(infile)
-            for line in infile:
-                line = line.strip()
-                # Remove deliminator if needed.
-                if line.endswith(delimiter):
-                    line = line[:-1] + '\n'
-                line = line.rstrip().split(delimiter)
-                line_len = len(line) if line_len is None else line_len
-                if len(line) != line_len:
-                    continue
-                for item in line:
-                    try:
-                        yield dtype(item)
-                    except ValueError:
-                        # Most likely cause of an error here is a problem with a trailing deliniator.
-                        print item, type(item)
-                        raise
-        iter_loadtxt.rowlength = line_len
-    data = np.fromiter(iter_func(), dtype=dtype)
-    try:
-        data = data.reshape((-1, iter_loadtxt.rowlength))
-    except AttributeError:
-        print "Check to ensure file is not blank"
-        time.sleep(2)
-        raise
+    data = parallel_loadtxt(filename, delimiter=delimiter, skiprows=skiprows, dtype=dtype, usecols=usecols,
+                            num_processes=num_processes)
+    iter_loadtxt.rowlength = data.shape[1]
     return data
 
 
+def parallel_loadtxt(filename, delimiter=',', skiprows=0, dtype=float, usecols=None, num_processes=None,
+                     chunk_bytes=2 ** 24):
+    """
+    Loads a delimited text file to a 2D numpy array.  The file is split into chunks of about chunk_bytes (on line
+    boundaries) and the chunks are parsed in a pool of processes.  Each chunk is parsed with a single np.fromstring.
+
+    Rows are handled as in the original iter_loadtxt: the number of columns is taken from the first row after the
+    header, rows with a different number of columns (such as a partially written last row) are skipped, and a single
+    trailing delimiter is ignored.  A value that cannot be parsed raises a ValueError.
+
+    :param filename: Name of file to load
+    :param delimiter: Delimiter (such as ',')
+    :param skiprows: Skip rows in header.
+    :param dtype: type of data.
+    :param usecols: List of column indexes to load.  Other columns are dropped as each chunk is parsed.
+                    If None, all columns are loaded.  Defaults to None.
+    :param num_processes: Number of processes to parse with.  If None, one per cpu.  If 1, the file is parsed in this
+                          process.  Defaults to None.  Pool workers (daemonic processes, which cannot start processes
+                          of their own) always parse in their own process.
+    :param chunk_bytes: Approximate size of each chunk.  Defaults to 16 MB.
+    :return: np array of data - shape (row, column)
+    """
+    data_offset, row_length = _get_delimited_file_layout(filename, delimiter=delimiter, skiprows=skiprows)
+    file_size = os.path.getsize(filename)
+    if usecols is not None:
+        usecols = list(usecols)
+    num_columns = row_length if usecols is None else len(usecols)
+
+    # Split the file into chunks that start at the beginning of a line.
+    with open(filename, 'rb') as infile:
+        chunk_starts = sorted(set([_find_line_start(infile, offset, data_offset)
+                                   for offset in xrange(data_offset, file_size, chunk_bytes)]))
+    chunk_ends = chunk_starts[1:] + [file_size]
+    chunks = [(filename, chunk_start, chunk_end, delimiter, row_length, dtype, usecols)
+              for chunk_start, chunk_end in zip(chunk_starts, chunk_ends)]
+
+    if num_processes is None:
+        num_processes = multiprocessing.cpu_count()
+    if num_processes > 1 and len(chunks) > 1 and not multiprocessing.current_process().daemon:
+        pool = multiprocessing.Pool(min(num_processes, len(chunks)))
+        try:
+            chunk_data_list = pool.map(_parse_delimited_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        chunk_data_list = map(_parse_delimited_chunk, chunks)
+
+    data = np.empty((sum([len(chunk_data) for chunk_data in chunk_data_list]), num_columns), dtype=dtype)
+    row_index = 0
+    for chunk_data in chunk_data_list:
+        data[row_index:row_index + len(chunk_data)] = chunk_data
+        row_index += len(chunk_data)
+    return data
+
+
+def _get_delimited_file_layout(filename, delimiter, skiprows):
+    """
+    :return: byte offset of the first row after the header, number of columns in that row
+    """
+    with open(filename, 'rb') as infile:
+        for _ in xrange(skiprows):
+            infile.readline()
+        data_offset = infile.tell()
+        first_line = infile.readline()
+    if first_line == '':
+        raise ValueError("Check to ensure file is not blank: %s" % filename)
+    return data_offset, len(_strip_delimited_line(first_line, delimiter).split(delimiter))
+
+
+def _find_line_start(infile, offset, data_offset):
+    """
+    Returns the offset of the first line starting at or after offset.
+    """
+    if offset <= data_offset:
+        return data_offset
+    infile.seek(offset - 1)
+    infile.readline()
+    return infile.tell()
+
+
+def _strip_delimited_line(line, delimiter):
+    line = line.strip()
+    # Remove deliminator if needed.
+    if line.endswith(delimiter):
+        line = line[:-1].rstrip()
+    return line
+
+
+def _parse_delimited_chunk(args):
+    """
+    Parses the complete lines between two byte offsets of a file.  Runs in our process pool, so it must be a top level
+    function taking a single (picklable) argument.
+    """
+    filename, chunk_start, chunk_end, delimiter, row_length, dtype, usecols = args
+    with open(filename, 'rb') as infile:
+        infile.seek(chunk_start)
+        text = infile.read(chunk_end - chunk_start)
+    lines = [_strip_delimited_line(line, delimiter) for line in text.splitlines()]
+    # Skip blank, incomplete and otherwise malformed rows.
+    lines = [line for line in lines if len(line) > 0 and line.count(delimiter) == row_length - 1]
+    if len(lines) == 0:
+        return np.zeros((0, row_length if usecols is None else len(usecols)), dtype=dtype)
+    data = np.fromstring(delimiter.join(lines), dtype=dtype, sep=delimiter)
+    if data.size != len(lines) * row_length:
+        # Something could not be parsed.  Find it, so we can say what it was.
+        for line in lines:
+            for item in line.split(delimiter):
+                try:
+                    np.dtype(dtype).type(item)
+                except ValueError:
+                    # Most likely cause of an error here is a problem with a trailing deliniator.
+                    print item, type(item)
+                    raise
+        raise ValueError("Could not parse %s between bytes %d and %d" % (filename, chunk_start, chunk_end))
+    data = data.reshape((len(lines), row_length))
+    if usecols is not None:
+        data = data[:, usecols]
+    return data
+
+
+def load_binary_recording(file_path, mmap=False):
+    """
+    Loads a recording saved in our binary format (see CCDLUtil/DataManagement/BinaryRecording.py).
+
+    :param file_path: Path to the binary recording.
+    :param mmap: If True, the rows are memory mapped (read only) rather than read into memory.
+    :return: (data, header)
+                data - 2D np array with the same columns as our csv recordings: index, time, chan1, chan2...
+                header - dictionary of meta information saved with the recording (fs, channel_names, resolutions...)
+    """
+    header, rows = load_binary_recording_rows(file_path, mmap=mmap)
+    return CCDLBinaryRecording.rows_to_array(rows), header
+
+
+def load_binary_recording_rows(file_path, mmap=False):
+    """
+    Loads the rows of a binary recording without converting them.
+
+    :param file_path: Path to the binary recording.
+    :param mmap: If True, the rows are memory mapped (read only) rather than read into memory.
+    :return: (header, rows) - rows is a structured np array with fields 'index', 'time' and 'data' (shape (sample, channel)).
+    """
+    with open(file_path, 'rb') as f:
+        header, data_offset = CCDLBinaryRecording.read_header(f)
+        row_dtype = CCDLBinaryRecording.get_header_row_dtype(header)
+        if not mmap:
+            return header, np.fromfile(f, dtype=row_dtype)
+    num_rows = (os.path.getsize(file_path) - data_offset) // row_dtype.itemsize
+    if num_rows == 0:
+        return header, np.zeros(0, dtype=row_dtype)
+    return header, np.memmap(file_path, dtype=row_dtype, mode='r', offset=data_offset, shape=(num_rows,))
+
+
+def load_eeg_recording(filename, delimiter=',', skiprows=0, dtype=float, usecols=None, num_processes=1):
+    """
+    Loads an EEG recording saved by EEGInterfaceParent.start_saving_data, whether it was saved as csv or in our binary
+    format.  Either way, the result has the columns: index, time, chan1, chan2...
+
+    :param filename: Name of file to load
+    :param delimiter: csv only - Delimiter (such as ',')
+    :param skiprows: csv only - Skip rows in header.  Binary files keep their header separately, so nothing is skipped.
+    :param dtype: type of data.
+    :param usecols: List of column indexes to load (counting index and time as columns 0 and 1).  If None, all
+                    columns are loaded.  Defaults to None.
+    :param num_processes: csv only - Number of processes to parse with (see iter_loadtxt).  Defaults to 1.
+    :return: np array of data.
+    """
+    if CCDLBinaryRecording.is_binary_recording(filename):
+        data, _ = load_binary_recording(filename)
+        if usecols is not None:
+            data = data[:, list(usecols)]
+        return data.astype(dtype, copy=False)
+    return iter_loadtxt(filename, delimiter=delimiter, skiprows=skiprows, dtype=dtype, usecols=usecols,
+                        num_processes=num_processes)
+
+
 def manage_storage(data_storage_location, take_init):
     """
     Deals with the file system to init all files
@@ -190,30 +352,95 @@ def manage_storage(data_storage_location, take_init):
 
 def load_ast_dictionary_by_trial(file_path, header_size=0, record_header=True):
     """
-    Takes an experiment log file and reads it in line by line with ast.literal eval.  See readme file for more information.
+    Takes an experiment log file and reads it in line by line.  See readme file for more information.
     Ignores blank lines.
 
-    This method does not epoch EEG data.
+    Both log formats written by DataManagement.Log are read: 'text' logs (one python dictionary per line, read with
+    ast.literal_eval) and 'jsonl' logs (one json object per line).  The format is detected from the file.
+
+    This method does not epoch EEG data.  To avoid holding every trial in memory, see iter_log_file and
+    load_log_columns.
 
     :param file_path: Path to file to be read
     :param header_size: Size of header
     :return: (trial_list, header_list).  The trial list is a list of dictionaries, each representing a trial. The header is a list of dicts
     for each line in header_size. If header_size = 0, will return header_size=[]
     """
-    header_list = []
-    trial_list = []
+    header_list = load_log_header(file_path, header_size=header_size) if record_header else []
+    trial_list = list(iter_log_file(file_path, header_size=header_size))
+    return trial_list, header_list
+
+
+def detect_log_format(file_path):
+    """
+    Returns the format of a log file: 'jsonl' if its first non blank line is json, otherwise 'text'.
+    """
     with open(file_path, 'r') as f:
-        for line_index, line in enumerate(f):
+        for line in f:
+            line = line.strip()
             if len(line) > 0:
-                if line_index < header_size:
-                    if record_header:
-                        header_list.append(ast.literal_eval(line[:-1]))  # -1 is to remove newline character.
-                else:
-                    if line.endswith('\n'):
-                        trial_list.append(ast.literal_eval(line[:-1]))
-                    else:
-                        trial_list.append(ast.literal_eval(line))
-    return trial_list, header_list
+                try:
+                    json.loads(line)
+                    return CCDLLog.JSONL_FORMAT
+                except ValueError:
+                    return CCDLLog.TEXT_FORMAT
+    return CCDLLog.TEXT_FORMAT
+
+
+def _get_log_line_parser(file_path):
+    # A python dictionary that happens to be valid json (such as {"a": 1}) parses to the same thing either way.
+    return json.loads if detect_log_format(file_path) == CCDLLog.JSONL_FORMAT else ast.literal_eval
+
+
+def _iter_log_lines(file_path):
+    # Yields (line_index, stripped line) for each line in the file.
+    with open(file_path, 'r') as f:
+        for line_index, line in enumerate(f):
+            yield line_index, line.strip()
+
+
+def load_log_header(file_path, header_size=0):
+    """
+    Returns the first header_size lines of a log file (either format), parsed.  Blank lines are skipped.
+    """
+    parse_line = _get_log_line_parser(file_path)
+    header_list = []
+    for line_index, line in _iter_log_lines(file_path):
+        if line_index >= header_size:
+            break
+        if len(line) > 0:
+            header_list.append(parse_line(line))
+    return header_list
+
+
+def iter_log_file(file_path, header_size=0):
+    """
+    Lazily reads a log file (either format), yielding one trial (dictionary) at a time.  Blank lines and the first
+    header_size lines are skipped.
+    """
+    parse_line = _get_log_line_parser(file_path)
+    for line_index, line in _iter_log_lines(file_path):
+        if line_index >= header_size and len(line) > 0:
+            yield parse_line(line)
+
+
+def load_log_columns(file_path, keys, header_size=0, dtype=float, missing=np.nan):
+    """
+    Streams a log file (either format), pulling the given keys out of each trial into np arrays.
+
+        columns = load_log_columns(log_file_path, keys=header['start_eeg_index_keys'], header_size=1)
+
+    :param keys: The keys to extract.
+    :param dtype: dtype of the returned arrays.  Defaults to float.
+    :param missing: Value used for trials without a key.  Defaults to np.nan (use something else for int dtypes).
+    :return: Dictionary mapping each key to a 1D array with an element per trial.
+    """
+    columns = dict([(key, []) for key in keys])
+    for trial in iter_log_file(file_path, header_size=header_size):
+        for key in keys:
+            value = trial.get(key)
+            columns[key].append(missing if value is None else value)
+    return dict([(key, np.asarray(values, dtype=dtype)) for key, values in columns.iteritems()])
 
 
 def gen_readme_file(readme_file_path, experiment_name, simple_subject_number, condition, tms_experiment_tracker_number, tms_subject_tracker_number):
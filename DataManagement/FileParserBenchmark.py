@@ -0,0 +1,89 @@
+"""
+Compares the original one cell at a time csv loader with FileParser.iter_loadtxt (chunked parsing, in one process or
+a pool of them) on a synthetic BrainAmp style recording - 15 header lines, then index, time and 32 channels per line.
+
+    python FileParserBenchmark.py                      # 10 minutes at 500 Hz
+    python FileParserBenchmark.py --csv recording.csv  # an existing recording (15 header lines)
+"""
+
+import argparse
+import os
+import tempfile
+import timeit
+import numpy as np
+import CCDLUtil.DataManagement.FileParser as CCDLFileParser
+from CCDLUtil.EEGInterface.EEGInterface import EEGInterfaceParent
+
+HEADER_ROWS = 15
+
+
+def legacy_iter_loadtxt(filename, delimiter=',', skiprows=0, dtype=float):
+    """
+    The loader FileParser.iter_loadtxt used to be - a generator yielding every cell to np.fromiter.
+    """
+    def iter_func():
+        line_len = None
+        with open(filename, 'r') as infile:
+            for _ in range(skiprows):
+                next(infile)
+            for line in infile:
+                line = line.strip()
+                if line.endswith(delimiter):
+                    line = line[:-1] + '\n'
+                line = line.rstrip().split(delimiter)
+                line_len = len(line) if line_len is None else line_len
+                if len(line) != line_len:
+                    continue
+                for item in line:
+                    yield dtype(item)
+        legacy_iter_loadtxt.rowlength = line_len
+    data = np.fromiter(iter_func(), dtype=dtype)
+    return data.reshape((-1, legacy_iter_loadtxt.rowlength))
+
+
+def make_synthetic_csv(file_path, seconds, fs=500, num_channels=32, seed=0):
+    """
+    Writes a recording like the ones EEGInterfaceParent.start_saving_data writes, ending with a partial line.
+    """
+    rng = np.random.RandomState(seed)
+    with open(file_path, 'w') as f:
+        f.write(''.join(['Header line %d,\t%d\n' % (ii, ii) for ii in xrange(HEADER_ROWS)]))
+        block_size = fs
+        for block_start in xrange(0, seconds * fs, block_size):
+            index = np.arange(block_start, block_start + block_size)
+            t = 1.5e9 + index / float(fs)
+            f.write(EEGInterfaceParent.convert_block_to_save_string(index, t, rng.randn(block_size, num_channels) * 50))
+        f.write('%d,1.5e9,1.0,2.0' % (seconds * fs))
+
+
+def main(csv_path, repeats):
+    print "File: %s (%.1f MB)" % (csv_path, os.path.getsize(csv_path) / 1e6)
+    legacy = legacy_iter_loadtxt(csv_path, skiprows=HEADER_ROWS)
+    new = CCDLFileParser.iter_loadtxt(csv_path, skiprows=HEADER_ROWS)
+    print "Rows - legacy: %d, new: %d.  Identical: %s" % (len(legacy), len(new), np.array_equal(legacy, new))
+    legacy_time = min(timeit.repeat(lambda: legacy_iter_loadtxt(csv_path, skiprows=HEADER_ROWS), number=1, repeat=repeats))
+    print "Legacy:                   %6.2f s" % legacy_time
+    for num_processes in (1, None):
+        new_time = min(timeit.repeat(lambda: CCDLFileParser.iter_loadtxt(csv_path, skiprows=HEADER_ROWS, num_processes=num_processes),
+                                     number=1, repeat=repeats))
+        print "Chunked, %-16s %6.2f s (%.1fx)" % ('1 process:' if num_processes == 1 else 'all processes:', new_time, legacy_time / new_time)
+    channels_time = min(timeit.repeat(lambda: CCDLFileParser.iter_loadtxt(csv_path, skiprows=HEADER_ROWS, usecols=[1, 2, 3], dtype=np.float32),
+                                      number=1, repeat=repeats))
+    print "Chunked, 3 float32 cols:  %6.2f s" % channels_time
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark csv recording loading.')
+    parser.add_argument('--csv', default=None, help='Recording to load (with %d header lines).' % HEADER_ROWS)
+    parser.add_argument('--seconds', type=int, default=600, help='Length of the synthetic recording.')
+    parser.add_argument('--repeats', type=int, default=1)
+    args = parser.parse_args()
+    if args.csv is not None:
+        main(args.csv, args.repeats)
+    else:
+        synthetic_path = os.path.join(tempfile.mkdtemp(), 'synthetic_recording.csv')
+        make_synthetic_csv(synthetic_path, args.seconds)
+        try:
+            main(synthetic_path, args.repeats)
+        finally:
+            os.remove(synthetic_path)
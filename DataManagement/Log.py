@@ -4,30 +4,88 @@ A class for generating log files.
 This takes data from a queue and writes it to disk.  This is typically event data from
 an experiment (not EEG data).
 
+Two formats are supported:
+    'text'  - Messages are strings, written one per line (typically str(dict), read back with ast.literal_eval).
+    'jsonl' - Messages are dictionaries (or anything json serializable), written as one json object per line.  These
+              are much faster to read back.
+
+Construct with batch=True to write bursts of messages together (see Log).
+
+Read either format with FileParser.load_ast_dictionary_by_trial, or FileParser.iter_log_file to stream the trials.
 """
+import json
+import os
+import time
+import threading
 import CCDLUtil.DataManagement.StringParser as StringParser
 import Queue
+import numpy as np
 from CCDLUtil.Utility.Decorators import threaded
 
+TEXT_FORMAT = 'text'
+JSONL_FORMAT = 'jsonl'
+
+
+def to_json_line(message):
+    """
+    Converts a message to a single line of json (with a trailing newline).  np scalars and arrays are converted to
+    python numbers and lists.
+    """
+    return json.dumps(message, default=_json_default) + '\n'
+
+
+def _json_default(value):
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError('%r is not JSON serializable' % (value,))
+
 
 class Log(object):
 
     """
     A log object is responsible for reading items from a queue and writing them to file.
+
+    By default every message is written and flushed as soon as it arrives.  With batch=True, the logging thread takes
+    every message waiting in the queue each time it wakes up and writes them with a single write.  The file is then
+    flushed once flush_interval seconds have passed or flush_bytes bytes have been written since the last flush, so a
+    burst of events (such as at stimulus onset) costs one write rather than one write and flush per event.
+
+    Call checkpoint to wait until everything logged so far is on disk, and close when done.
     """
 
-    def __init__(self, subject_log_file_path, verbose=False, header=None):
+    def __init__(self, subject_log_file_path, verbose=False, header=None, log_format=TEXT_FORMAT, batch=False,
+                 flush_interval=0.5, flush_bytes=2 ** 16):
         """
         Logs all items to file.  Files are taken from the log_queue and written to the file specified by
         subject_log_file_path.
         :param subject_log_file_path: String. where to save the file
-        :param log_queue: queue to read items from
-        :param header:
+        :param header: Written at the start of the file.  A string (written as is), or in the 'jsonl' format, a
+                       dictionary (written as the first line).
+        :param log_format: 'text' (messages are strings) or 'jsonl' (messages are dictionaries, saved as json).
+                           Defaults to 'text'.
+        :param batch: If True, pending messages are written together and the file is flushed by time/size (below)
+                      rather than after every message.  Defaults to False.
+        :param flush_interval: With batch, the longest (seconds) a written message waits to be flushed.  Defaults to 0.5
+        :param flush_bytes: With batch, flush once this many bytes have been written since the last flush.
+                            Defaults to 64 KB.
         """
+        if log_format not in (TEXT_FORMAT, JSONL_FORMAT):
+            raise ValueError("log_format must be '%s' or '%s'" % (TEXT_FORMAT, JSONL_FORMAT))
+        self.log_format = log_format
+        self.batch = batch
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
         self.f = file(subject_log_file_path, 'w')
         self.log_queue = Queue.Queue()
+        self.closed = threading.Event()
+        # Metrics, updated by the logging thread.  See get_metrics
+        self.num_messages = 0
+        self.num_writes = 0
+        self.max_queue_depth = 0
+        self.total_write_latency = 0.0
+        self.max_write_latency = 0.0
         if header is not None:
-            self.f.write(header)
+            self.f.write(header if type(header) is str else to_json_line(header))
         # create new thread and start logging to file
         self._start_log(verbose=verbose)
 
@@ -35,27 +93,169 @@ class Log(object):
         """
         Put message into queue for logging. Client of this class should call this method to log information
 
-        :param message: the message to be logged
+        This never blocks.  Formatting the message is left to the logging thread.
+
+        :param message: the message to be logged.  A string in the 'text' format, a dictionary in the 'jsonl' format.
+        """
+        self.log_queue.put_nowait(message)
+
+    def checkpoint(self, timeout=None):
+        """
+        Blocks until every message logged before this call has been written, flushed and fsync'd.
+        :param timeout: Seconds to wait.  If None, waits as long as needed.
+        :return: True if the checkpoint was reached, False if we timed out.
+        """
+        if self.closed.is_set():
+            return True
+        reached = threading.Event()
+        self.log_queue.put_nowait(_Checkpoint(reached))
+        # The log may have closed after the check above, in which case nothing will take our checkpoint.
+        if self.closed.is_set():
+            return True
+        return reached.wait(timeout)
+
+    def close(self, timeout=None):
+        """
+        Writes any pending messages, fsyncs and closes the file, and stops the logging thread.  Messages logged after
+        this are ignored.
+        :return: True if the log was closed, False if we timed out.
+        """
+        if not self.closed.is_set():
+            self.log_queue.put_nowait(_Checkpoint(None))
+        return self.closed.wait(timeout)
+
+    def get_metrics(self):
+        """
+        :return: Dictionary with:
+            queue_depth - Messages currently waiting to be written.
+            max_queue_depth - Most messages seen waiting at once.
+            num_messages, num_writes - Messages written, and the write calls used to write them.
+            mean_write_latency, max_write_latency - Seconds spent in each write (including the flush, if any).
         """
-        self.log_queue.put(message)
+        return {'queue_depth': self.log_queue.qsize(), 'max_queue_depth': self.max_queue_depth,
+                'num_messages': self.num_messages, 'num_writes': self.num_writes,
+                'mean_write_latency': self.total_write_latency / self.num_writes if self.num_writes > 0 else 0.0,
+                'max_write_latency': self.max_write_latency}
+
+    def format_message(self, message):
+        """
+        Converts a message to the line written to file.
+        """
+        if self.log_format == JSONL_FORMAT:
+            return to_json_line(message)
+        assert type(message) is str
+        return StringParser.idempotent_append_newline(message)
+
+    def _get_pending(self, timeout):
+        """
+        Waits (up to timeout seconds, or forever if None) for a message, then takes every other message waiting.
+        :return: List of messages (empty if we timed out).
+        """
+        try:
+            messages = [self.log_queue.get(timeout=timeout)]
+        except Queue.Empty:
+            return []
+        depth = self.log_queue.qsize() + 1
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        if self.batch:
+            while True:
+                try:
+                    messages.append(self.log_queue.get_nowait())
+                except Queue.Empty:
+                    break
+        return messages
+
+    def _get_remaining(self):
+        """
+        :return: List of every message waiting in the queue, without waiting for more.
+        """
+        messages = []
+        while True:
+            try:
+                messages.append(self.log_queue.get_nowait())
+            except Queue.Empty:
+                return messages
+
+    def _write(self, body, flush):
+        write_start = time.time()
+        self.f.write(body)
+        if flush:
+            self.f.flush()
+        write_latency = time.time() - write_start
+        self.num_writes += 1
+        self.total_write_latency += write_latency
+        if write_latency > self.max_write_latency:
+            self.max_write_latency = write_latency
+
+    def _sync(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
 
     @threaded(True)
     def _start_log(self, verbose=False):
         """
-        Starts reading items from the queue.  All items passed to the queue must be a string or it will be converted
-        (raising a warning).  If no new line is at the end of the string, one will be added.
+        Starts reading items from the queue.  In the 'text' format, all items passed to the queue must be a string.
+        If no new line is at the end of the string, one will be added.
 
-        The buffer is immediately flushed after every write.
+        Unless batching, the buffer is immediately flushed after every write.
 
         :param verbose: If verbose, will print the items to console.  Defaults to False.
-        :return: Runs forever.  Kill thread to terminate.
+        :return: Runs until close is called.
         """
-
+        unflushed_bytes = 0
+        last_flush_time = time.time()
         while True:
-            body = self.log_queue.get()
-            assert type(body) is str
-            body = StringParser.idempotent_append_newline(body)
-            if verbose:
-                print body
-            self.f.write(body)
-            self.f.flush()
+            timeout = None
+            if unflushed_bytes > 0:
+                timeout = max(0.0, last_flush_time + self.flush_interval - time.time())
+            lines = []
+            checkpoints = []
+            for message in self._get_pending(timeout):
+                if isinstance(message, _Checkpoint):
+                    checkpoints.append(message)
+                else:
+                    lines.append(self.format_message(message))
+            if len(lines) > 0:
+                body = ''.join(lines)
+                if verbose:
+                    print body
+                unflushed_bytes += len(body)
+                flush = not self.batch or unflushed_bytes >= self.flush_bytes or \
+                    time.time() - last_flush_time >= self.flush_interval
+                self._write(body, flush)
+                self.num_messages += len(lines)
+            elif unflushed_bytes > 0 and time.time() - last_flush_time >= self.flush_interval:
+                # We timed out waiting for a message, and have data to flush.
+                self.f.flush()
+                flush = True
+            else:
+                flush = False
+            if checkpoints:
+                self._sync()
+                flush = True
+            if flush:
+                unflushed_bytes = 0
+                last_flush_time = time.time()
+            for checkpoint in checkpoints:
+                if checkpoint.reached is None:
+                    # close was called.
+                    self.f.close()
+                    self.closed.set()
+                    # Release everyone waiting, including on checkpoints still in the queue (unless batching, we
+                    # only took the first message).
+                    checkpoints.extend(self._get_remaining())
+                    for waiting in checkpoints:
+                        if isinstance(waiting, _Checkpoint) and waiting.reached is not None:
+                            waiting.reached.set()
+                    return
+                checkpoint.reached.set()
+
+
+class _Checkpoint(object):
+    """
+    Queued by Log.checkpoint (reached is an Event, set once written) and Log.close (reached is None).
+    """
+
+    def __init__(self, reached):
+        self.reached = reached
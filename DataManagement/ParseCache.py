@@ -0,0 +1,227 @@
+"""
+An on disk cache of parsed files, so re-running an analysis does not re-parse the same recordings and logs.
+
+Each entry is keyed by the source file's absolute path, size and modification time, plus the options it was parsed
+with, so editing (or replacing) the source file or changing the parse options misses the cache.  np arrays are saved
+as .npy files and memory mapped when loaded.  Anything else (such as the trial dictionaries from a log file) is
+pickled.  Each entry also has a small .json file describing it.  Once the cache is bigger than max_bytes, the least
+recently used entries are removed.
+
+    cache = ParseCache()
+    eeg_data = cache.load_eeg_recording(eeg_file_path, skiprows=15)
+
+From the command line:
+
+    python ParseCache.py list
+    python ParseCache.py clear
+    python ParseCache.py evict --max-gb 2
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import time
+import numpy as np
+import CCDLUtil.DataManagement.FileParser as CCDLFileParser
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.ccdl_parse_cache')
+DEFAULT_MAX_BYTES = 4 * 2 ** 30
+
+
+class ParseCache(object):
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        :param cache_dir: Folder to keep the cache in.  Created if needed.  Defaults to ~/.ccdl_parse_cache
+        :param max_bytes: The least recently used entries are removed once the cache is bigger than this.
+                          Defaults to 4 GB.
+        """
+        self.cache_dir = CCDLFileParser.idempotent_dir_creation(cache_dir)
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def get_key(source_path, parse_options):
+        """
+        Returns the cache key for a source file parsed with the given options (a json serializable dictionary).
+        """
+        source_path = os.path.abspath(source_path)
+        stat = os.stat(source_path)
+        key_info = [source_path, stat.st_size, stat.st_mtime, parse_options]
+        return hashlib.sha1(json.dumps(key_info, sort_keys=True)).hexdigest()
+
+    def cached_call(self, source_path, parse_options, parse_function):
+        """
+        Returns parse_function() from the cache if source_path has already been parsed with parse_options.
+        Otherwise parse_function is called and its result is cached.
+
+        :param source_path: Path of the file parse_function reads.
+        :param parse_options: json serializable dictionary of everything (other than the file) that changes the result.
+        :param parse_function: Function taking no arguments that parses source_path.
+        :return: The result of parse_function.  np arrays loaded from the cache are memory mapped (read only).
+        """
+        key = self.get_key(source_path, parse_options)
+        try:
+            return self.load(key)
+        except (IOError, OSError, ValueError, EOFError, pickle.UnpicklingError):
+            # A miss (or an entry we can no longer read).
+            pass
+        result = parse_function()
+        info = self.store(key, result, {'source_path': os.path.abspath(source_path), 'parse_options': parse_options})
+        if info['nbytes'] > self.max_bytes:
+            # Bigger than the whole cache.  Not kept.
+            self.remove(key, info)
+            return result
+        self.evict(keep=key)
+        try:
+            # Return what we just cached, so hits and misses behave the same way.
+            return self.load(key)
+        except (IOError, OSError, ValueError, EOFError, pickle.UnpicklingError):
+            return result
+
+    def load(self, key):
+        """
+        Loads a cached entry.  Raises IOError if there is no entry for key.
+        """
+        info_path = self._get_path(key, '.json')
+        with open(info_path, 'r') as f:
+            info = json.load(f)
+        data_path = self._get_path(key, info['extension'])
+        if info['extension'] == '.npy':
+            result = np.load(data_path, mmap_mode='r')
+        else:
+            result = CCDLFileParser.load_pickle_file(data_path)
+        # Our info file's modification time records when we were last used.
+        os.utime(info_path, None)
+        return result
+
+    def store(self, key, value, info=None):
+        """
+        Saves value under key.  np arrays are saved as .npy, anything else is pickled.
+        :param info: json serializable dictionary saved alongside (such as where the value came from).
+        :return: The entry's info dictionary (info, plus its extension, nbytes and created time).
+        """
+        extension = '.npy' if isinstance(value, np.ndarray) else '.pickle'
+        data_path = self._get_path(key, extension)
+        # Write to a temporary file, and only move it into place when complete, so a crash cannot leave a half
+        # written entry.
+        temp_path = data_path + '.%d.tmp' % os.getpid()
+        with open(temp_path, 'wb') as f:
+            if extension == '.npy':
+                np.save(f, value)
+            else:
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        _replace_file(temp_path, data_path)
+        info = dict(info) if info is not None else dict()
+        info.update({'extension': extension, 'nbytes': os.path.getsize(data_path), 'created': time.time()})
+        with open(temp_path, 'w') as f:
+            json.dump(info, f)
+        _replace_file(temp_path, self._get_path(key, '.json'))
+        return info
+
+    def get_entries(self):
+        """
+        :return: List of (key, info dictionary, last used time), most recently used first.
+        """
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith('.json'):
+                continue
+            info_path = os.path.join(self.cache_dir, file_name)
+            try:
+                with open(info_path, 'r') as f:
+                    info = json.load(f)
+                entries.append((file_name[:-len('.json')], info, os.path.getmtime(info_path)))
+            except (IOError, OSError, ValueError):
+                continue
+        return sorted(entries, key=lambda entry: entry[2], reverse=True)
+
+    def get_size(self):
+        """
+        Total size of our cached data (bytes).
+        """
+        return sum([info['nbytes'] for _, info, _ in self.get_entries()])
+
+    def evict(self, max_bytes=None, keep=None):
+        """
+        Removes the least recently used entries until the cache is at most max_bytes.
+        :param max_bytes: If None, self.max_bytes.
+        :param keep: Optional -- Key of an entry never to remove (such as the one just stored).
+        :return: Number of entries removed.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        total_bytes = 0
+        num_removed = 0
+        for key, info, _ in self.get_entries():
+            total_bytes += info['nbytes']
+            if total_bytes > max_bytes and key != keep:
+                self.remove(key, info)
+                num_removed += 1
+        return num_removed
+
+    def remove(self, key, info=None):
+        """
+        Removes a single entry.
+        """
+        paths = [self._get_path(key, '.json')]
+        paths += [self._get_path(key, info['extension'])] if info is not None else \
+            [self._get_path(key, '.npy'), self._get_path(key, '.pickle')]
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                # Already gone, or (on windows) memory mapped by someone.  It will be tried again next time.
+                pass
+
+    def clear(self):
+        """
+        Removes every entry.
+        """
+        return self.evict(max_bytes=0)
+
+    def _get_path(self, key, extension):
+        return os.path.join(self.cache_dir, key + extension)
+
+    def load_eeg_recording(self, filename, delimiter=',', skiprows=0, dtype=float, usecols=None):
+        """
+        Cached FileParser.load_eeg_recording.  The returned array is read only.
+        """
+        parse_options = {'function': 'load_eeg_recording', 'delimiter': delimiter, 'skiprows': skiprows,
+                         'dtype': np.dtype(dtype).str, 'usecols': None if usecols is None else list(usecols)}
+        return self.cached_call(filename, parse_options, lambda: CCDLFileParser.load_eeg_recording(
+            filename, delimiter=delimiter, skiprows=skiprows, dtype=dtype, usecols=usecols))
+
+    def load_ast_dictionary_by_trial(self, file_path, header_size=0, record_header=True):
+        """
+        Cached FileParser.load_ast_dictionary_by_trial.
+        """
+        parse_options = {'function': 'load_ast_dictionary_by_trial', 'header_size': header_size,
+                         'record_header': record_header}
+        return self.cached_call(file_path, parse_options, lambda: CCDLFileParser.load_ast_dictionary_by_trial(
+            file_path, header_size=header_size, record_header=record_header))
+
+
+def _replace_file(source_path, destination_path):
+    # os.rename does not overwrite on windows.
+    if os.name == 'nt' and os.path.exists(destination_path):
+        os.remove(destination_path)
+    os.rename(source_path, destination_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect or clear the cache of parsed files.')
+    parser.add_argument('command', choices=['list', 'clear', 'evict'])
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--max-gb', type=float, default=DEFAULT_MAX_BYTES / 2.0 ** 30, help='Size to evict down to.')
+    args = parser.parse_args()
+    parse_cache = ParseCache(cache_dir=args.cache_dir, max_bytes=int(args.max_gb * 2 ** 30))
+    if args.command == 'list':
+        for entry_key, entry_info, last_used in parse_cache.get_entries():
+            print "%s  %8.1f MB  last used %s  %s %s" % (entry_key[:12], entry_info['nbytes'] / 1e6, time.ctime(last_used),
+                                                        entry_info.get('source_path'), entry_info.get('parse_options'))
+        print "Total: %.1f MB in %s" % (parse_cache.get_size() / 1e6, parse_cache.cache_dir)
+    elif args.command == 'clear':
+        print "Removed %d entries" % parse_cache.clear()
+    else:
+        print "Removed %d entries" % parse_cache.evict()
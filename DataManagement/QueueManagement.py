@@ -5,11 +5,16 @@ See https://docs.python.org/3/library/queue.html for Queue api.
 
 """
 
-import Queue
 import multiprocessing
+import numpy as np
+import CCDLUtil.DataManagement.SharedRing as CCDLSharedRing
+import CCDLUtil.DataManagement.BoundedQueue as CCDLBoundedQueue
 
 def clear_queue(q):
     """Clears a queue in a thread-safe manner"""
+    if isinstance(q, CCDLSharedRing.SharedFrameRing):
+        q.clear()
+        return
     with q.mutex:
         q.queue.clear()
 
@@ -18,19 +23,58 @@ def clear_mutiprocess_queue(q):
     while not q.empty():
         q.get()
 
-def get_queue_dict(all_queues, thread=True):
+def get_queue_dict(all_queues, thread=True, shared_memory=False, frame_shape=None, dtype=np.float64, capacity=256,
+                   maxsize=0, policy=CCDLBoundedQueue.BLOCK):
     """
     Gets a queue dictionary with keys equal to all queues names in ALL_QUEUES
     :param all_queues: A list of queue names (strings).  These will be the keys of the returned dict.
-    :param thread: If True, this will be using the Queue.Queue() class, else the multiprocessing queue will
-                    be used.
+    :param thread: If True, this will be using the Queue.Queue() class (as a DataManagement.BoundedQueue.BoundedQueue),
+                    else the multiprocessing queue will be used.
+    :param shared_memory: If True, each queue is a DataManagement.SharedRing.SharedFrameRing instead (for passing
+                          fixed size frames, such as EEG packets, between processes without pickling).  thread is
+                          ignored.  Defaults to False.
+    :param frame_shape: shared_memory only - Shape of the frames, such as (samples per packet, channels).
+    :param dtype: shared_memory only - dtype of the frames.  Defaults to float64.
+    :param capacity: shared_memory only - Number of frames each ring holds.  Defaults to 256.
+    :param maxsize: Most items each queue holds.  If 0, queues are unbounded.  Defaults to 0.
+    :param policy: thread only - What a put does when a queue is full (see DataManagement.BoundedQueue): 'block',
+                   'drop_oldest', 'drop_newest' or 'coalesce'.  Multiprocessing queues can only block.  Defaults to
+                   'block'.
     :return: Returns a queue dictionary of the the form:
      queue_dict['queue name'] -> Python Queue
     """
+    if shared_memory and frame_shape is None:
+        raise ValueError('frame_shape is needed for shared memory queues.')
+    if not thread and not shared_memory and policy != CCDLBoundedQueue.BLOCK:
+        raise ValueError('Multiprocessing queues only support the block policy.  Use shared_memory=True instead.')
     queue_dict = dict()
     for q in all_queues:
-        if thread:
-            queue_dict[q] = Queue.Queue()
+        if shared_memory:
+            queue_dict[q] = CCDLSharedRing.SharedFrameRing(frame_shape=frame_shape, dtype=dtype, capacity=capacity)
+        elif thread:
+            queue_dict[q] = CCDLBoundedQueue.BoundedQueue(maxsize=maxsize, policy=policy, name=q)
         else:
-            queue_dict[q] = multiprocessing.Queue()
+            queue_dict[q] = multiprocessing.Queue(maxsize)
     return queue_dict
+
+
+def get_queue_metrics(queue_dict):
+    """
+    Gets the overflow counts of every queue in a queue dictionary (from get_queue_dict).
+    :param queue_dict: Dictionary of queue name -> queue
+    :return: Dictionary of queue name -> metrics dictionary.  BoundedQueues give BoundedQueue.get_metrics, shared
+             memory rings give qsize and num_dropped, and other queues just qsize.
+    """
+    metrics = dict()
+    for name, q in queue_dict.items():
+        if isinstance(q, CCDLBoundedQueue.BoundedQueue):
+            metrics[name] = q.get_metrics()
+        elif isinstance(q, CCDLSharedRing.SharedFrameRing):
+            metrics[name] = {'name': name, 'qsize': q.qsize(), 'num_dropped': q.get_dropped()}
+        else:
+            try:
+                metrics[name] = {'name': name, 'qsize': q.qsize()}
+            except NotImplementedError:
+                # multiprocessing.Queue.qsize is not implemented on some platforms (Mac OS X).
+                metrics[name] = {'name': name, 'qsize': None}
+    return metrics
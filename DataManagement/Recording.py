@@ -0,0 +1,160 @@
+"""
+Lazy access to EEG recordings that may not fit in memory.
+
+A Recording memory maps a binary recording (see BinaryRecording.py) or a cached recording (a .npy file, such as those
+kept by ParseCache) and slices it by sample, by EEG index or by time without reading the whole file.  Only the pages
+holding the requested samples (plus the few touched by the binary searches of the index and time columns) are read.
+
+    recording = open_recording(eeg_file_path)
+    first_minute = recording.by_time[recording.times[0]:recording.times[0] + 60]
+    data = first_minute.data                            # shape (sample, channel), still memory mapped
+    epochs = recording.epoch_by_index(trial_starts, trial_stops)   # shape (epoch, sample, channel), in memory
+
+csv recordings cannot be memory mapped.  Pass a ParseCache to open_recording to parse them once and memory map the
+cached result afterwards.
+"""
+
+import numpy as np
+import CCDLUtil.DataManagement.BinaryRecording as CCDLBinaryRecording
+import CCDLUtil.DataManagement.DataParser as CCDLDataParser
+import CCDLUtil.DataManagement.FileParser as CCDLFileParser
+import CCDLUtil.DataManagement.SortedIndex as CCDLSortedIndex
+
+
+def open_recording(file_path, skiprows=15, parse_cache=None):
+    """
+    Opens an EEG recording saved by EEGInterfaceParent.start_saving_data (binary or csv), or saved as a .npy file with
+    the columns: index, time, chan1, chan2...
+
+    :param file_path: Path to the recording.
+    :param skiprows: csv only - Number of header rows.  Defaults to 15.
+    :param parse_cache: csv only - A DataManagement.ParseCache.ParseCache.  If given, the csv file is parsed once and
+                        the cached array is memory mapped.  If None, the csv file is loaded into memory.
+    :return: Recording
+    """
+    if CCDLBinaryRecording.is_binary_recording(file_path):
+        header, rows = CCDLFileParser.load_binary_recording_rows(file_path, mmap=True)
+        return Recording(rows['index'], rows['time'], rows['data'], header=header)
+    if file_path.endswith('.npy'):
+        return Recording.from_array(np.load(file_path, mmap_mode='r'))
+    if parse_cache is not None:
+        return Recording.from_array(parse_cache.load_eeg_recording(file_path, skiprows=skiprows))
+    return Recording.from_array(CCDLFileParser.load_eeg_recording(file_path, skiprows=skiprows))
+
+
+class Recording(object):
+
+    """
+    An EEG recording, held as three (possibly memory mapped) columns: EEG index, time and data.
+
+    Indexing with a slice (recording[start:stop]) selects by sample.  recording.by_index[start:stop] selects the
+    samples with start <= EEG index < stop, and recording.by_time[start:stop] the samples with start <= time < stop.
+    All three return a new Recording viewing the same memory, so nothing is read until the data is used.  The EEG
+    indexes and times must be nondecreasing.
+    """
+
+    def __init__(self, indexes, times, data, header=None):
+        """
+        :param indexes: EEG (packet) index of each sample - shape (sample,)
+        :param times: Time each sample was collected - shape (sample,)
+        :param data: shape (sample, channel)
+        :param header: dictionary of meta information (fs, channel_names...).  Defaults to None (empty).
+        """
+        if not len(indexes) == len(times) == len(data):
+            raise ValueError('indexes, times and data must have the same number of samples',
+                             len(indexes), len(times), len(data))
+        self.indexes = indexes
+        self.times = times
+        self.data = data
+        self.header = header if header is not None else dict()
+        self.by_index = _ColumnSlicer(self, indexes)
+        self.by_time = _ColumnSlicer(self, times)
+
+    @staticmethod
+    def from_array(arr, header=None):
+        """
+        Creates a Recording viewing a 2D array with the columns: index, time, chan1, chan2...
+        (as returned by FileParser.load_eeg_recording).
+        """
+        return Recording(arr[:, 0], arr[:, 1], arr[:, 2:], header=header)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, item):
+        """
+        Selects samples.  A slice returns a Recording, a single sample returns (index, time, data).
+        """
+        if isinstance(item, slice):
+            if item.step not in (None, 1):
+                raise ValueError('Recordings can only be sliced contiguously (no step).')
+            return Recording(self.indexes[item], self.times[item], self.data[item], header=self.header)
+        return self.indexes[item], self.times[item], self.data[item]
+
+    @property
+    def fs(self):
+        return self.header.get('fs')
+
+    @property
+    def channel_names(self):
+        return self.header.get('channel_names')
+
+    @property
+    def num_channels(self):
+        return self.data.shape[1]
+
+    def find_samples(self, column, start=None, stop=None):
+        """
+        Finds the samples where start <= column < stop, with a binary search (only a few pages of column are read).
+
+        :param column: self.indexes or self.times
+        :param start: If None, from the first sample.
+        :param stop: If None, to the last sample.
+        :return: first sample, one past the last sample
+        """
+        start_sample = 0 if start is None else int(np.searchsorted(column, start, side='left'))
+        stop_sample = len(column) if stop is None else int(np.searchsorted(column, stop, side='left'))
+        return start_sample, max(start_sample, stop_sample)
+
+    def epoch_by_index(self, trial_starts, trial_stops, trim=True):
+        """
+        Reads the data of each trial into memory.  Trials are found the same way as DataParser.epoch_data (samples
+        with an EEG index after the trial start and before the trial stop).  Pass self.times to
+        DataParser.get_epoch_bounds to epoch by time instead.
+
+        :param trial_starts: EEG index at the start of each trial
+        :param trial_stops: EEG index at the end of each trial
+        :param trim: If True (the default), all epochs are cut to the length of the shortest.  If False and the trials
+                     differ in length, a ValueError is raised.
+        :return: epoched data - shape (epoch, sample, channel)
+        """
+        # Our indexes are sorted (as find_samples assumes), so skip reading the whole column to check them.
+        start_samples, stop_samples = CCDLDataParser.get_epoch_bounds(
+            CCDLSortedIndex.SortedIndex(self.indexes, check=False), trial_starts, trial_stops)
+        return CCDLDataParser.cut_epochs(self.data, start_samples, stop_samples, trim=trim, copy=True)
+
+    def to_array(self):
+        """
+        Reads the recording into memory as a 2D array with the columns: index, time, chan1, chan2...
+        """
+        arr = np.empty((len(self), 2 + self.num_channels))
+        arr[:, 0] = self.indexes
+        arr[:, 1] = self.times
+        arr[:, 2:] = self.data
+        return arr
+
+
+class _ColumnSlicer(object):
+    """
+    Slices a Recording by the values of one of its columns (see Recording.by_index and Recording.by_time).
+    """
+
+    def __init__(self, recording, column):
+        self.recording = recording
+        self.column = column
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step is not None:
+            raise ValueError('Select a range of values, such as [start:stop].')
+        start_sample, stop_sample = self.recording.find_samples(self.column, item.start, item.stop)
+        return self.recording[start_sample:stop_sample]
@@ -0,0 +1,232 @@
+"""
+A shared memory ring buffer for passing fixed size (sample, channel) frames between processes without pickling.
+
+One process (or thread) puts frames, any number of consumers get them.  Each frame is copied once into shared memory
+by the producer and once out by each consumer - nothing is pickled or sent through a pipe.  Every frame gets a sequence
+number, and each consumer keeps its own read cursor (in shared memory), so consumers read at their own pace and all
+see every frame.  The producer never blocks: a consumer that falls more than capacity frames behind skips ahead to the
+oldest frame still held, and the frames it missed are counted (see get_dropped).
+
+Consumers waiting for a frame sleep on a doorbell (a multiprocessing.Condition) that the producer only rings when
+someone is waiting.
+
+The ring has the same put/get methods as a queue, so it can stand in for the queues of QueueManagement.get_queue_dict
+(pass shared_memory=True).  get uses the first consumer.  For more consumers, call add_consumer before starting the
+processes that use them:
+
+    ring = SharedFrameRing(frame_shape=(10, 32))
+    display_consumer = ring.add_consumer()
+    multiprocessing.Process(target=run_display, args=(display_consumer,)).start()
+    ...
+    ring.put(block)                     # producer - block has shape (10, 32)
+    block = display_consumer.get()      # in run_display
+
+Rings (and consumers) must be handed to other processes when they are created (as Process arguments), as with any
+multiprocessing shared memory.
+"""
+
+import time
+import Queue
+import ctypes
+import multiprocessing
+import numpy as np
+
+# How long (seconds) a waiting consumer sleeps before checking for frames again, in case a doorbell ring was missed.
+DOORBELL_POLL_INTERVAL = 0.05
+
+
+class SharedFrameRing(object):
+
+    def __init__(self, frame_shape, dtype=np.float64, capacity=256, max_consumers=4):
+        """
+        :param frame_shape: Shape of every frame, such as (samples per packet, channels).
+        :param dtype: np dtype of the frames.  Defaults to float64.
+        :param capacity: Number of frames held.  A consumer more than this many frames behind loses frames.
+                         Defaults to 256.
+        :param max_consumers: Most consumers that can be added (including the one used by get).  Defaults to 4.
+        """
+        self.frame_shape = tuple(np.atleast_1d(frame_shape))
+        self.dtype = np.dtype(dtype)
+        self.capacity = capacity
+        self.max_consumers = max_consumers
+        frame_nbytes = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        self._frame_buffer = multiprocessing.RawArray(ctypes.c_char, capacity * frame_nbytes)
+        # Sequence number of the frame in each slot (-1 while being written).
+        self._slot_sequences = multiprocessing.RawArray(ctypes.c_longlong, [-1] * capacity)
+        # [sequence number of the next frame to be put, number of consumers added, number of consumers waiting]
+        self._counters = multiprocessing.RawArray(ctypes.c_longlong, 3)
+        self._cursors = multiprocessing.RawArray(ctypes.c_longlong, max_consumers)
+        self._dropped = multiprocessing.RawArray(ctypes.c_longlong, max_consumers)
+        self._doorbell = multiprocessing.Condition()
+        self._make_views()
+        self._default_consumer = self.add_consumer()
+
+    def __getstate__(self):
+        # np views of shared memory cannot be pickled (they would be copied).  They are rebuilt after unpickling.
+        state = dict(self.__dict__)
+        for name in ('frames', 'slot_sequences', 'counters', 'cursors', 'dropped'):
+            del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._make_views()
+
+    def _make_views(self):
+        self.frames = np.frombuffer(self._frame_buffer, dtype=self.dtype).reshape((self.capacity,) + self.frame_shape)
+        self.slot_sequences = np.frombuffer(self._slot_sequences, dtype=np.int64)
+        self.counters = np.frombuffer(self._counters, dtype=np.int64)
+        self.cursors = np.frombuffer(self._cursors, dtype=np.int64)
+        self.dropped = np.frombuffer(self._dropped, dtype=np.int64)
+
+    def add_consumer(self):
+        """
+        Adds a consumer that starts at the next frame put.  Call before handing the ring to other processes.
+        :return: RingConsumer
+        """
+        consumer_id = int(self.counters[1])
+        if consumer_id >= self.max_consumers:
+            raise ValueError('This ring already has max_consumers (%d) consumers.' % self.max_consumers)
+        self.cursors[consumer_id] = self.counters[0]
+        self.counters[1] = consumer_id + 1
+        return RingConsumer(self, consumer_id)
+
+    def put(self, frame, block=True, timeout=None):
+        """
+        Copies a frame into the ring.  Never blocks (block and timeout are only accepted to match Queue.put).
+        :param frame: array of shape frame_shape (or anything that reshapes to it).
+        :return: The frame's sequence number.
+        """
+        frame = np.asarray(frame)
+        if frame.size != self.frames[0].size:
+            raise ValueError('Frames must have shape %s.  Got shape %s' % (str(self.frame_shape), str(frame.shape)))
+        sequence = int(self.counters[0])
+        slot = sequence % self.capacity
+        # Mark the slot as being written, so a consumer reading it at the same time knows to skip it.
+        self.slot_sequences[slot] = -1
+        self.frames[slot] = frame.reshape(self.frame_shape)
+        self.slot_sequences[slot] = sequence
+        self.counters[0] = sequence + 1
+        if self.counters[2] > 0:
+            with self._doorbell:
+                self._doorbell.notify_all()
+        return sequence
+
+    def put_nowait(self, frame):
+        return self.put(frame)
+
+    def get(self, block=True, timeout=None):
+        """
+        The next frame for the ring's first consumer (see RingConsumer.get).
+        """
+        return self._default_consumer.get(block=block, timeout=timeout)
+
+    def get_nowait(self):
+        return self._default_consumer.get(block=False)
+
+    def qsize(self):
+        return self._default_consumer.qsize()
+
+    def empty(self):
+        return self._default_consumer.empty()
+
+    def clear(self):
+        """
+        Skips the first consumer past all frames put so far.
+        """
+        self._default_consumer.clear()
+
+    def get_dropped(self):
+        """
+        Frames the first consumer missed by falling more than capacity frames behind.
+        """
+        return self._default_consumer.get_dropped()
+
+    def get_next_sequence(self):
+        """
+        Sequence number the next frame put will get (the number of frames put so far).
+        """
+        return int(self.counters[0])
+
+
+class RingConsumer(object):
+    """
+    Reads every frame put in a SharedFrameRing, in order, at its own pace.  Made by SharedFrameRing.add_consumer.
+    """
+
+    def __init__(self, ring, consumer_id):
+        self.ring = ring
+        self.consumer_id = consumer_id
+
+    def get_frame(self, block=True, timeout=None):
+        """
+        Returns the next frame and its sequence number.
+
+        :param block: If True, waits for a frame.  If False, raises Queue.Empty if there is none.
+        :param timeout: If blocking, the most seconds to wait before raising Queue.Empty.  None waits forever.
+        :return: (sequence number, frame) - frame is a copy, of shape frame_shape.
+        """
+        ring = self.ring
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            sequence = int(ring.cursors[self.consumer_id])
+            if ring.counters[0] > sequence:
+                oldest = int(ring.counters[0]) - ring.capacity
+                if sequence < oldest:
+                    # We fell behind, and these frames have been overwritten.
+                    ring.dropped[self.consumer_id] += oldest - sequence
+                    ring.cursors[self.consumer_id] = oldest
+                    continue
+                slot = sequence % ring.capacity
+                frame = ring.frames[slot].copy()
+                if ring.slot_sequences[slot] != sequence:
+                    # Overwritten while we were copying it.  Go around again, and we'll skip ahead.
+                    continue
+                ring.cursors[self.consumer_id] = sequence + 1
+                return sequence, frame
+            if not block:
+                raise Queue.Empty
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                raise Queue.Empty
+            self._wait(DOORBELL_POLL_INTERVAL if remaining is None else min(remaining, DOORBELL_POLL_INTERVAL))
+
+    def _wait(self, timeout):
+        ring = self.ring
+        with ring._doorbell:
+            ring.counters[2] += 1
+            try:
+                if ring.counters[0] <= ring.cursors[self.consumer_id]:
+                    ring._doorbell.wait(timeout)
+            finally:
+                ring.counters[2] -= 1
+
+    def get(self, block=True, timeout=None):
+        """
+        Returns the next frame (a copy, of shape frame_shape).  Same arguments as Queue.get.
+        """
+        return self.get_frame(block=block, timeout=timeout)[1]
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        """
+        Number of frames waiting to be read (at most capacity are still held).
+        """
+        return min(int(self.ring.counters[0] - self.ring.cursors[self.consumer_id]), self.ring.capacity)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def clear(self):
+        """
+        Skips past all frames put so far.
+        """
+        self.ring.cursors[self.consumer_id] = self.ring.counters[0]
+
+    def get_dropped(self):
+        """
+        Number of frames missed by falling more than capacity frames behind.
+        """
+        return int(self.ring.dropped[self.consumer_id])
@@ -0,0 +1,72 @@
+"""
+An index over a sorted (nondecreasing) column, such as EEG indexes, time stamps or the frequencies of a spectrum.
+
+The column is checked once, when the index is made.  Lookups use np.searchsorted, so many values can be looked up in a
+single call, and the sample (or bin) ranges of bands are cached, so asking for the same band again costs a dictionary
+lookup.  Functions that take a column (DataParser.epoch_data, DataParser.trim_freqs, Fourier.band_power...) also take
+a SortedIndex of it, so a caller that makes many calls on the same column only pays for the check once:
+
+    freq_index = SortedIndex(freqs)
+    alpha = Fourier.band_power(freq_index, density, (8, 12))
+    beta = Fourier.band_power(freq_index, density, (12, 20))
+"""
+
+import numpy as np
+
+
+class SortedIndex(object):
+
+    def __init__(self, values, check=True):
+        """
+        :param values: 1D, nondecreasing list or np array.
+        :param check: If True (the default), raises a ValueError if values are not nondecreasing.
+        """
+        self.values = np.asarray(values)
+        if self.values.ndim != 1:
+            raise ValueError('A SortedIndex must be made from a 1D column.  Shape: %s' % str(self.values.shape))
+        if check and len(self.values) > 1 and not np.all(self.values[1:] >= self.values[:-1]):
+            first_decrease = np.flatnonzero(self.values[1:] < self.values[:-1])[0]
+            raise ValueError('Values must be nondecreasing.  Value %d (%s) is less than value %d (%s).' % (
+                first_decrease + 1, self.values[first_decrease + 1], first_decrease, self.values[first_decrease]))
+        self._range_cache = dict()
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, item):
+        return self.values[item]
+
+    def searchsorted(self, values, side='left'):
+        """
+        np.searchsorted of one or many values.  side='left' gives the first position >= each value (bisect_left),
+        side='right' the first position > each value (bisect_right).
+        """
+        return np.searchsorted(self.values, values, side=side)
+
+    def get_range(self, low, high, inclusive_high=False):
+        """
+        Positions of the values in [low, high) (or [low, high] if inclusive_high), as (start, stop) to slice with.
+        A low (or high) of None means from the first (or to the last) value.  Results are cached, so repeated bands
+        are free.
+        """
+        key = (low, high, inclusive_high)
+        if key not in self._range_cache:
+            start = 0 if low is None else int(self.searchsorted(low, side='left'))
+            stop = len(self.values) if high is None else \
+                int(self.searchsorted(high, side='right' if inclusive_high else 'left'))
+            self._range_cache[key] = (start, stop)
+        return self._range_cache[key]
+
+    def get_ranges(self, lows, highs, low_side='left', high_side='left'):
+        """
+        Batched range lookup: np arrays of start and stop positions for every (low, high) pair, found with one
+        searchsorted call each.
+        """
+        return self.searchsorted(lows, side=low_side), self.searchsorted(highs, side=high_side)
+
+
+def as_sorted_index(values):
+    """
+    Returns values if it is already a SortedIndex, otherwise a new (checked) SortedIndex of values.
+    """
+    return values if isinstance(values, SortedIndex) else SortedIndex(values)
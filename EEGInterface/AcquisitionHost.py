@@ -0,0 +1,183 @@
+"""
+Runs an EEG interface (any EEGInterfaceParent child) in its own process.
+
+Normally start_recording runs as a thread of the experiment process, so acquisition shares the GIL with the display,
+logging and classification, and a long stretch of feature extraction delays packets (BrainAmp "OVERFLOW" lines).
+An AcquisitionHost makes the streamer in a new process, optionally pinned to CPUs and given realtime priority (see
+Utility/ProcessPriority.py), and publishes the live data into shared memory (a DataManagement.SharedRing ring).
+
+The host stands in for the streamer: out_buffer_queue, clock, data_index, start_recording and start_saving_data work
+as they do on the streamer itself.  Data is saved by the acquisition process, so file writes also stay out of the
+experiment process.
+
+    host = AcquisitionHost(BrainAmpStreamer, {'channels_for_live': ['Oz', 'O1'], 'save_data': True},
+                           num_channels=2, block_size=10, cpus=[3], realtime=True)
+    host.start_saving_data('subject_eeg.csv')
+    host.start_recording()
+    block = host.out_buffer_queue.get()                   # np array of shape (10, 2)
+    event_sample = host.clock.get_sample_index(time.time())
+    ...
+    host.stop()
+
+Items on out_buffer_queue are fixed size blocks of block_size samples (see EEGInterfaceParent.subscribe).  With
+include_info, their first two columns are the packet index and time of each sample, as in a saved recording.  Live
+data comes from the streamer's hub, so the streamer must publish its blocks (the BrainAmp and gUSBAmp streamers, and
+the OpenBCI streamer in block mode, do).
+"""
+
+import time
+import ctypes
+import traceback
+import multiprocessing
+import numpy as np
+import CCDLUtil.DataManagement.SharedRing as CCDLSharedRing
+import CCDLUtil.EEGInterface.SampleClock as CCDLSampleClock
+import CCDLUtil.EEGInterface.EEG_INDEX as CCDLEEGIndex
+import CCDLUtil.Utility.ProcessPriority as CCDLProcessPriority
+
+
+class AcquisitionHost(object):
+
+    def __init__(self, streamer_class, streamer_kwargs, num_channels, block_size=10, include_info=False,
+                 dtype=np.float64, capacity=256, cpus=None, realtime=False, nice=None):
+        """
+        :param streamer_class: An EEGInterfaceParent child, such as BrainAmpStreamer.  Made in the acquisition process.
+        :param streamer_kwargs: Dictionary of arguments for streamer_class.  Must be picklable.
+        :param num_channels: Number of channels in the streamer's channels_for_live.
+        :param block_size: Samples in each item put on out_buffer_queue.  Defaults to 10.
+        :param include_info: If True, items on out_buffer_queue have the packet index and time of each sample as
+                             their first two columns.  Defaults to False.
+        :param dtype: dtype of the items on out_buffer_queue.  Defaults to float64.
+        :param capacity: Blocks held in shared memory.  A consumer more than this many behind skips ahead (see
+                         out_buffer_queue.get_dropped).  Defaults to 256.
+        :param cpus: Optional -- List of CPUs to pin the acquisition process to.  Defaults to None.
+        :param realtime: If True, the acquisition process asks for realtime scheduling (SCHED_FIFO on Linux).
+                         Defaults to False.
+        :param nice: Optional -- Nice value for the acquisition process (Linux).  Defaults to None.
+        """
+        self.streamer_class = streamer_class
+        self.streamer_kwargs = dict(streamer_kwargs)
+        self.block_size = block_size
+        self.include_info = include_info
+        self.elevation = {'cpus': cpus, 'realtime': realtime, 'nice': nice}
+        frame_shape = (block_size, num_channels + 2 if include_info else num_channels)
+        # The ring's first consumer is the stand in for the streamer's out_buffer_queue.
+        self.ring = CCDLSharedRing.SharedFrameRing(frame_shape=frame_shape, dtype=dtype, capacity=capacity)
+        self.out_buffer_queue = self.ring
+        self.clock = CCDLSampleClock.SampleClock()
+        CCDLEEGIndex.SAMPLE_CLOCK = self.clock
+        self.shared_data_index = multiprocessing.RawValue(ctypes.c_longlong, -1)
+        # What the acquisition process managed to apply (see ProcessPriority.elevate_process), once it has started.
+        self.applied_queue = multiprocessing.Queue()
+        self.applied = None
+        self.save_args = None
+        self.process = None
+
+    @property
+    def data_index(self):
+        """
+        The streamer's data_index (updated with each packet).
+        """
+        return self.shared_data_index.value
+
+    def add_consumer(self):
+        """
+        Adds another reader of out_buffer_queue's blocks (see SharedFrameRing.add_consumer).  Call before
+        start_recording if the consumer will be handed to another process.
+        """
+        return self.ring.add_consumer()
+
+    def start_saving_data(self, save_data_file_path, header=None, timeout=15, file_format='csv', flush_interval=1.0):
+        """
+        Saves data from the acquisition process (see EEGInterfaceParent.start_saving_data).  The streamer must be made
+        with save_data=True.  Call before start_recording.
+        """
+        if self.process is not None:
+            raise RuntimeError('start_saving_data must be called before start_recording.')
+        self.save_args = (save_data_file_path, header, timeout, file_format, flush_interval)
+
+    def start_recording(self, timeout=None):
+        """
+        Starts the acquisition process, which makes the streamer and calls its start_recording.  If the streamer could
+        not be made, a RuntimeError is raised with the acquisition process's traceback.
+
+        :param timeout: Seconds to wait for the process to report its priority settings (see self.applied).  If None,
+                        waits until it does.  Defaults to None.
+        :return: Dictionary of the priority settings applied (see ProcessPriority.elevate_process).
+        """
+        self.process = multiprocessing.Process(
+            target=_run_acquisition, args=(self.streamer_class, self.streamer_kwargs, self.ring, self.clock,
+                                           self.shared_data_index, self.block_size, self.include_info, self.elevation,
+                                           self.save_args, self.applied_queue))
+        self.process.daemon = True
+        self.process.start()
+        applied = self.applied_queue.get(timeout=timeout)
+        if 'error' in applied:
+            self.process.join()
+            raise RuntimeError('Could not start the streamer in the acquisition process:\n' + applied['error'])
+        self.applied = applied
+        return self.applied
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def stop(self, timeout=5):
+        """
+        Ends the acquisition process.
+        """
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout)
+
+    def get_queue_metrics(self):
+        """
+        :return: List with the out_buffer_queue's metrics (qsize and num_dropped).
+        """
+        return [{'name': 'out_buffer_queue', 'qsize': self.ring.qsize(), 'num_dropped': self.ring.get_dropped()}]
+
+
+class _RingWriter(object):
+    """
+    A stand in queue for a hub subscription, putting blocks (or (indexes, times, data) items) on a ring.
+    """
+
+    def __init__(self, ring, include_info):
+        self.ring = ring
+        self.include_info = include_info
+
+    def put(self, item, block=True, timeout=None):
+        if self.include_info:
+            indexes, times, data = item
+            item = np.column_stack((indexes, times, data))
+        self.ring.put(item)
+
+
+def _run_acquisition(streamer_class, streamer_kwargs, ring, clock, shared_data_index, block_size, include_info,
+                     elevation, save_args, applied_queue):
+    """
+    The acquisition process.  Top level so it can be the target of a multiprocessing.Process.
+    """
+    applied = CCDLProcessPriority.elevate_process(**elevation)
+    try:
+        streamer = streamer_class(**streamer_kwargs)
+        # Use the host's shared clock and data index, so they can be read from the experiment process.
+        streamer.clock = clock
+        CCDLEEGIndex.SAMPLE_CLOCK = clock
+        streamer.shared_data_index = shared_data_index
+        # The ring replaces the streamer's own out_buffer_queue, which nothing would read in this process.
+        if streamer.out_buffer_queue is not None:
+            streamer.hub.unsubscribe(streamer.out_buffer_queue)
+        streamer.live = False
+        streamer.subscribe(channels=streamer.channels_for_live, block_size=block_size,
+                           queue=_RingWriter(ring, include_info), include_info=include_info)
+    except Exception:
+        # Raised again by AcquisitionHost.start_recording in the experiment process.
+        applied_queue.put({'error': traceback.format_exc()})
+        return
+    applied_queue.put(applied)
+    if save_args is not None:
+        streamer.start_saving_data(*save_args)
+    streamer.start_recording()
+    # start_recording may run in its own (non daemon) thread, which keeps us alive.  Stay around either way.
+    while True:
+        time.sleep(1)
@@ -0,0 +1,146 @@
+"""
+Compares packet timing of a BrainAmpStreamer run as a thread of the experiment process (the usual start_recording)
+with one run in its own process by EEGInterface.AcquisitionHost, while the experiment process is busy.
+
+RDA messages are replayed at the amplifier's pace (100 points at 5000 Hz, every 20 ms) from a separate process (see
+BrainAmpReplayServer.py), so no amplifier is needed.  Meanwhile the main thread runs a load that holds the GIL for
+tens of milliseconds at a time (sorting large lists, as in feature extraction or classifier training).  For each mode
+the lateness of every packet is reported - how much later than its schedule the streamer received it, relative to the
+earliest packet - along with the number of packets more than one message interval late.
+
+    python AcquisitionJitterBenchmark.py
+    python AcquisitionJitterBenchmark.py --blocks 1500 --cpus 3 --realtime
+"""
+
+import time
+import random
+import argparse
+import multiprocessing
+import numpy as np
+import BrainAmpReplayServer as Replay
+from CCDLUtil.EEGInterface.BrainAmp.BrainAmpInterface import BrainAmpStreamer
+import CCDLUtil.EEGInterface.AcquisitionHost as CCDLAcquisitionHost
+
+LIVE_CHANNELS = ['Oz', 'O1', 'O2', 'Pz']
+# Seconds between data messages (100 points at 5000 Hz)
+MESSAGE_INTERVAL = 0.02
+# Samples per downsampled block
+BLOCK_SIZE = 10
+
+
+def _serve_paced(messages, interval, port_queue):
+    server = Replay.RDAReplayServer(messages, interval=interval)
+    port_queue.put(server.port)
+    server.serve()
+
+
+def start_paced_server(messages, interval=MESSAGE_INTERVAL):
+    """
+    Replays messages at a fixed interval from a new process, so the replay is not slowed by our load.
+    :return: the server process, the port it listens on
+    """
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve_paced, args=(messages, interval, port_queue))
+    process.daemon = True
+    process.start()
+    return process, port_queue.get()
+
+
+def gil_load(seconds, list_size=200000):
+    """
+    Sorts shuffled lists until seconds have passed.  Each sort holds the GIL throughout.
+    :return: number of sorts done
+    """
+    values = range(list_size)
+    random.shuffle(values)
+    end_time = time.time() + seconds
+    num_sorts = 0
+    while time.time() < end_time:
+        sorted(values)
+        num_sorts += 1
+    return num_sorts
+
+
+def get_lateness(receive_times, interval=MESSAGE_INTERVAL):
+    """
+    :param receive_times: Time each message was received, in order.
+    :return: np array of how late (ms) each message was received relative to its schedule, the earliest being 0.
+    """
+    receive_times = np.asarray(receive_times)
+    lateness = receive_times - (receive_times[0] + np.arange(len(receive_times)) * interval)
+    return (lateness - lateness.min()) * 1000.0
+
+
+def run_threaded(messages, load_seconds):
+    """
+    The usual way: start_recording runs as a thread of this process.
+    :return: receive time of each data message, number of sorts done by the load
+    """
+    server_process, port = start_paced_server(messages)
+    streamer = BrainAmpStreamer(channels_for_live=LIVE_CHANNELS, live=False, save_data=False, port=port)
+    receive_queue = streamer.subscribe(channels=LIVE_CHANNELS, include_info=True)
+    streamer.start_recording()
+    num_sorts = gil_load(load_seconds)
+    server_process.join()
+    # Give the streamer a moment to handle the last message.
+    time.sleep(0.2)
+    receive_times = []
+    while not receive_queue.empty():
+        indexes, times, data = receive_queue.get()
+        receive_times.append(times[0])
+    return receive_times, num_sorts
+
+
+def run_hosted(messages, load_seconds, cpus=None, realtime=False):
+    """
+    The streamer runs in its own process (AcquisitionHost), publishing into shared memory.
+    :return: receive time of each data message, number of sorts done by the load, priority settings applied
+    """
+    server_process, port = start_paced_server(messages)
+    host = CCDLAcquisitionHost.AcquisitionHost(
+        BrainAmpStreamer, {'channels_for_live': LIVE_CHANNELS, 'live': True, 'save_data': False, 'port': port},
+        num_channels=len(LIVE_CHANNELS), block_size=BLOCK_SIZE, include_info=True, capacity=len(messages) + 16,
+        cpus=cpus, realtime=realtime)
+    applied = host.start_recording()
+    num_sorts = gil_load(load_seconds)
+    server_process.join()
+    # Give the acquisition process a moment to publish the last block.
+    time.sleep(0.2)
+    receive_times = []
+    while not host.out_buffer_queue.empty():
+        # First two columns are the packet index and time of each sample.
+        receive_times.append(host.out_buffer_queue.get()[0, 1])
+    host.stop()
+    return receive_times, num_sorts, applied
+
+
+def report(name, receive_times, num_sorts, num_messages):
+    lateness = get_lateness(receive_times)
+    print "%-10s %8d %9.2f %9.2f %9.2f %9d %8d" % (
+        name, len(receive_times), np.median(lateness), np.percentile(lateness, 99), lateness.max(),
+        np.sum(lateness > MESSAGE_INTERVAL * 1000.0), num_sorts)
+    if len(receive_times) != num_messages:
+        print "Warning: %d of %d messages were received." % (len(receive_times), num_messages)
+
+
+def main(num_blocks, cpus, realtime, load):
+    messages = Replay.make_synthetic_messages(num_blocks)
+    load_seconds = num_blocks * MESSAGE_INTERVAL + 0.5 if load else 0
+    print "%d messages, one every %.0f ms.  Load in the main thread: %s" % (
+        num_blocks, MESSAGE_INTERVAL * 1000, 'sorting lists' if load else 'none (idle)')
+    print "%-10s %8s %9s %9s %9s %9s %8s" % ('mode', 'messages', 'median ms', 'p99 ms', 'max ms', '> 20 ms', 'sorts')
+    receive_times, num_sorts = run_threaded(messages, load_seconds)
+    report('thread', receive_times, num_sorts, num_blocks)
+    receive_times, num_sorts, applied = run_hosted(messages, load_seconds, cpus=cpus, realtime=realtime)
+    report('process', receive_times, num_sorts, num_blocks)
+    print "Acquisition process settings applied: %s" % str(applied)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare acquisition jitter of threaded and process hosted streamers.')
+    parser.add_argument('--blocks', type=int, default=500, help='Data messages to replay (default 10 s).')
+    parser.add_argument('--cpus', default=None, help='Comma separated cpus to pin the acquisition process to.')
+    parser.add_argument('--realtime', action='store_true', help='Ask for realtime scheduling in the acquisition process.')
+    parser.add_argument('--no-load', dest='load', action='store_false', help='Leave the main thread idle.')
+    args = parser.parse_args()
+    main(args.blocks, None if args.cpus is None else [int(cpu) for cpu in args.cpus.split(',')], args.realtime, args.load)
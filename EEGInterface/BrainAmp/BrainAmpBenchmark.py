@@ -0,0 +1,250 @@
+"""
+Benchmarks the BrainAmp acquisition path on RDA messages replayed from a local socket (see BrainAmpReplayServer.py).
+No amplifier is needed.  Two things are measured:
+    - Receive throughput: the old string concatenation receive loops vs. Communications.Util.MessageReceiver (for
+      RDA messages) and Communications.Util.recvall (for large length prefixed messages, as sent by send_msg).
+    - Per message handling: parsing, downsampling and channel selection, for the original per value parsing, for
+      vectorized parsing keeping every 10th sample, and for what the streamer now does (vectorized parsing with the
+      anti-aliasing FIRDecimator).
+
+    python BrainAmpBenchmark.py                          # synthetic 32 channel, 5000 Hz messages
+    python BrainAmpBenchmark.py --messages captured.rda  # messages captured with BrainAmpReplayServer.capture_rda_messages
+
+Each data message (100 points x 32 channels, arriving at 50 Hz) has a 20 ms budget.
+"""
+
+import argparse
+import socket
+import struct
+import time
+import timeit
+import threading
+import numpy as np
+import BrainAmpReplayServer as Replay
+import CCDLUtil.Communications.Util as CCDLCommUtil
+from CCDLUtil.EEGInterface.BrainAmp.BrainAmpInterface import BrainAmpStreamer
+
+LIVE_CHANNELS = ['Oz', 'O1', 'O2', 'Pz']
+
+
+def receive_replayed_messages(messages):
+    """
+    Replays messages through a local RDAReplayServer and receives them with a BrainAmpStreamer.
+    :return: the connected streamer, the start message body and a list of data message bodies
+    """
+    server = Replay.RDAReplayServer(messages)
+    server.start()
+    streamer = BrainAmpStreamer(channels_for_live=LIVE_CHANNELS, live=True, save_data=False, port=server.port)
+    start_body, data_bodies = None, []
+    while True:
+        try:
+            raw_data, msgsize, msgtype = streamer.get_raw_data()
+        except RuntimeError:
+            # Captured messages may not end with a stop message.
+            break
+        # raw_data is a view of the streamer's receive buffer, which the next message overwrites.  Keep a copy.
+        if msgtype == Replay.MSG_START:
+            start_body = raw_data.tobytes()
+        elif msgtype == Replay.MSG_DATA:
+            data_bodies.append(raw_data.tobytes())
+        elif msgtype == Replay.MSG_STOP:
+            break
+    streamer.con.close()
+    return streamer, start_body, data_bodies
+
+
+def legacy_recv_data(sock, requestedSize):
+    """
+    The string concatenation receive loop the streamer used before MessageReceiver.
+    """
+    returnStream = ''
+    while len(returnStream) < requestedSize:
+        databytes = sock.recv(requestedSize - len(returnStream))
+        if databytes == '':
+            raise RuntimeError("connection broken")
+        returnStream += databytes
+    return returnStream
+
+
+def legacy_recvall(conn, n):
+    """
+    The string concatenation loop Communications.Util.recvall used before recv_into.
+    """
+    data = ''
+    while len(data) < n:
+        packet = conn.recv(n - len(data))
+        if not packet:
+            return None
+        data += packet
+    return data
+
+
+def time_receive(messages, use_message_receiver):
+    """
+    Receives all messages from a local RDAReplayServer.
+    :return: seconds taken, bytes received
+    """
+    server = Replay.RDAReplayServer(messages)
+    server.start()
+    sock = socket.create_connection((server.host, server.port))
+    receiver = CCDLCommUtil.MessageReceiver(sock)
+    num_bytes = 0
+    start_time = time.time()
+    while True:
+        if use_message_receiver:
+            header = receiver.recv(Replay.HEADER_SIZE)
+            msgsize, msgtype = struct.unpack_from(Replay.HEADER_FORMAT, header)[4:]
+            receiver.recv(msgsize - Replay.HEADER_SIZE)
+        else:
+            header = legacy_recv_data(sock, Replay.HEADER_SIZE)
+            msgsize, msgtype = struct.unpack(Replay.HEADER_FORMAT, header)[4:]
+            legacy_recv_data(sock, msgsize - Replay.HEADER_SIZE)
+        num_bytes += msgsize
+        if msgtype == Replay.MSG_STOP:
+            break
+    elapsed = time.time() - start_time
+    sock.close()
+    return elapsed, num_bytes
+
+
+def time_large_receive(message_size, num_messages, use_recv_into):
+    """
+    Sends num_messages messages of message_size bytes with Communications.Util.send_msg (from a thread) over a local
+    socket pair, and receives them.
+    :return: seconds taken, bytes received
+    """
+    send_sock, receive_sock = socket.socketpair()
+    message = '\0' * message_size
+    sender = threading.Thread(target=lambda: [CCDLCommUtil.send_msg(send_sock, message) for _ in xrange(num_messages)])
+    sender.daemon = True
+    recvall = CCDLCommUtil.recvall if use_recv_into else legacy_recvall
+    start_time = time.time()
+    sender.start()
+    for _ in xrange(num_messages):
+        msg_len = struct.unpack('<I', buffer(recvall(receive_sock, 4)))[0]
+        recvall(receive_sock, msg_len)
+    elapsed = time.time() - start_time
+    sender.join()
+    send_sock.close()
+    receive_sock.close()
+    return elapsed, message_size * num_messages
+
+
+def benchmark_receive(messages, repeats, large_message_size=2 ** 20, num_large_messages=100):
+    print "RDA messages (%d):" % len(messages)
+    for name, use_message_receiver in (('Concatenation', False), ('MessageReceiver', True)):
+        elapsed, num_bytes = min([time_receive(messages, use_message_receiver) for _ in xrange(repeats)])
+        print "%-16s %8.1f MB/s  (%.1f us/message)" % (name + ':', num_bytes / elapsed / 1e6, 1e6 * elapsed / len(messages))
+    # Large messages arrive in many pieces, which the concatenation loop copies again on every join.
+    print "%d KB messages (%d):" % (large_message_size // 1024, num_large_messages)
+    for name, use_recv_into in (('Concatenation', False), ('recvall', True)):
+        elapsed, num_bytes = min([time_large_receive(large_message_size, num_large_messages, use_recv_into)
+                                  for _ in xrange(repeats)])
+        print "%-16s %8.1f MB/s  (%.1f us/message)" % (name + ':', num_bytes / elapsed / 1e6,
+                                                       1e6 * elapsed / num_large_messages)
+
+
+def legacy_handle_block(rawdata, num_channels, resolutions, live_indexes):
+    """
+    The per value parsing and per channel downsampling the streamer used to do on every data message.
+    """
+    (block, points, markerCount) = struct.unpack('<LLL', rawdata[:12])
+    data = []
+    for i in range(points * num_channels):
+        index = 12 + 4 * i
+        value = struct.unpack('<f', rawdata[index:index + 4])
+        data.append(value[0])
+    indexes_needed = range(0, 100, 10)
+    save_channels = np.zeros((len(indexes_needed), len(resolutions)))
+    for ii, resolution in enumerate(resolutions):
+        save_channels[:, ii] = np.asarray([data[index * num_channels + ii] * resolution for index in indexes_needed])
+    live_channels = np.zeros((len(indexes_needed), len(live_indexes)))
+    for ii, channel_index in enumerate(live_indexes):
+        live_channels[:, ii] = np.asarray([data[index * num_channels + channel_index] * resolutions[channel_index]
+                                           for index in indexes_needed])
+    return save_channels, live_channels
+
+
+def vectorized_handle_block(streamer, rawdata, num_channels, resolutions, live_selector):
+    """
+    Vectorized parsing, keeping every 10th sample (no anti-aliasing filter).  Gives the same output as
+    legacy_handle_block.
+    """
+    block, points, marker_count, data, markers = streamer.get_data(rawdata, num_channels)
+    downsampled_matrix = data[::streamer.downsample_factor] * resolutions
+    return downsampled_matrix, downsampled_matrix[:, live_selector]
+
+
+def filtered_handle_block(streamer, rawdata, num_channels, resolutions, live_selector):
+    """
+    What BrainAmpStreamer.start_recording now does with every data message.
+    """
+    block, points, marker_count, data, markers = streamer.get_data(rawdata, num_channels)
+    downsampled_matrix = streamer.downsample_all_channels(data, resolutions)
+    return downsampled_matrix, downsampled_matrix[:, live_selector]
+
+
+def measure_aliasing(streamer, num_blocks=100, tone_hz=2400.0, fs=5000.0):
+    """
+    Downsamples a 2400 Hz tone (which aliases to 100 Hz at 500 Hz) both ways.
+    :return: RMS of the output keeping every 10th sample, RMS of the filtered output (both relative to the input RMS)
+    """
+    streamer.decimator.reset()
+    samples = np.arange(num_blocks * 100)
+    tone = np.sin(2 * np.pi * tone_hz / fs * samples)[:, np.newaxis]
+    sliced = tone[::streamer.downsample_factor]
+    filtered = np.concatenate([streamer.decimator.process(tone[ii:ii + 100]) for ii in xrange(0, len(tone), 100)])
+    input_rms = np.sqrt(np.mean(tone ** 2))
+    # Skip the filter's start up.
+    return np.sqrt(np.mean(sliced ** 2)) / input_rms, np.sqrt(np.mean(filtered[len(filtered) // 2:] ** 2)) / input_rms
+
+
+def main(messages, repeats):
+    print "Receive throughput over loopback"
+    benchmark_receive(messages, repeats)
+
+    streamer, start_body, data_bodies = receive_replayed_messages(messages)
+    channel_count, sampling_interval, resolutions, channel_names, channel_dict, _ = streamer.first_message_actions(start_body)
+    resolutions_arr = np.asarray(resolutions)
+    live_indexes = [channel_dict[ch] for ch in LIVE_CHANNELS]
+    # What the hub's live subscription selects from each block.
+    live_selector = BrainAmpStreamer.channel_index_selector(live_indexes)
+    print "\nPer message handling"
+    print "Replayed %d data messages (%d channels, %.0f Hz)" % (len(data_bodies), channel_count, 1e6 / sampling_interval)
+
+    legacy = [legacy_handle_block(body, channel_count, resolutions, live_indexes) for body in data_bodies]
+    vectorized = [vectorized_handle_block(streamer, body, channel_count, resolutions_arr, live_selector) for body in data_bodies]
+    print "Max abs difference - save: %g, live: %g" % (
+        max([np.max(np.abs(old[0] - new[0])) for old, new in zip(legacy, vectorized)]),
+        max([np.max(np.abs(old[1] - new[1])) for old, new in zip(legacy, vectorized)]))
+
+    legacy_time = min(timeit.repeat(lambda: [legacy_handle_block(body, channel_count, resolutions, live_indexes)
+                                             for body in data_bodies], number=1, repeat=repeats))
+    vectorized_time = min(timeit.repeat(lambda: [vectorized_handle_block(streamer, body, channel_count, resolutions_arr,
+                                                                         live_selector)
+                                                 for body in data_bodies], number=1, repeat=repeats))
+    filtered_time = min(timeit.repeat(lambda: [filtered_handle_block(streamer, body, channel_count, resolutions_arr,
+                                                                       live_selector)
+                                               for body in data_bodies], number=1, repeat=repeats))
+    print "Legacy:     %8.1f us/block" % (1e6 * legacy_time / len(data_bodies))
+    print "Vectorized: %8.1f us/block" % (1e6 * vectorized_time / len(data_bodies))
+    print "Speed up:   %8.1fx  (block budget: 20000 us)" % (legacy_time / vectorized_time)
+    print "Vectorized + %d tap anti-aliasing filter: %.1f us/block (%.2f%% of the block budget)" % (
+        streamer.decimator.numtaps, 1e6 * filtered_time / len(data_bodies), 100 * filtered_time / len(data_bodies) / 0.02)
+
+    sliced_rms, filtered_rms = measure_aliasing(streamer)
+    print "\nA 2400 Hz tone aliases to 100 Hz.  Relative amplitude after downsampling:"
+    print "Every 10th sample: %.3f, filtered: %.5f" % (sliced_rms, filtered_rms)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the BrainAmp acquisition path.')
+    parser.add_argument('--messages', default=None, help='File of captured RDA messages.')
+    parser.add_argument('--blocks', type=int, default=500, help='Synthetic data messages to generate (default 10 s).')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    if args.messages is not None:
+        rda_messages = Replay.load_rda_messages(args.messages)
+    else:
+        rda_messages = Replay.make_synthetic_messages(args.blocks)
+    main(rda_messages, args.repeats)
@@ -24,13 +24,11 @@ import socket
 import struct
 import time
 import Queue
-import CCDLUtil.EEGInterface.DataSaver
 import numpy as np
-import CCDLUtil.EEGInterface.EEG_INDEX
 import CCDLUtil.EEGInterface.EEGInterface
+import CCDLUtil.Communications.Util as CCDLCommUtil
+import CCDLUtil.SignalProcessing.Filters as CCDLFilters
 from CCDLUtil.Utility.Decorators import threaded
-from CCDLUtil.EEGInterface.DataSaver import start_saving_data
-import csv
 
 
 class Marker:
@@ -50,15 +48,16 @@ class BrainAmpStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
     """
 
     def __init__(self, channels_for_live, live=True, save_data=True, subject_name=None, subject_tracking_number=None,
-                 experiment_number=None):
+                 experiment_number=None, host='localhost', port=51244, downsample_factor=10,
+                 downsample_numtaps=None, live_queue_maxsize=0, save_queue_maxsize=0):
         """
         A data collection object for the EEG interface.  This provides option for live data streaming and saving data to file.
 
         For live data streaming, use with a threading or multiprocessing queue (ie. Queue.queue()
            Data will be put on the queue, which can be read by another thread.)
 
-        Modifies the EEG_INDEX and EEG_INDEX_2 in CCDLUtil/EEGInterface/EEG_INDEX.py when each packet arrives.  These variables can be read from any thread.
-            Use this to time mark events in your other programs.
+        Modifies the CURR_EEG_INDEX and CURR_EEG_INDEX_2 in CCDLUtil/EEGInterface/EEG_INDEX.py when each packet arrives.  These variables can be read from any thread.
+            To time mark events in your other programs, use self.clock (see SampleClock.py).
 
         :param channels_for_live: List - a list of channel names (or indexes) to put on the out_buffer_queue. If [], no channels will be put on the out_buffer_queue.
                                   If 'All', all channels will be placed on the out_buffer_queue.  Channels for live **cannot** be just an int. It must be a list or 'All'.
@@ -66,42 +65,61 @@ class BrainAmpStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
         :param out_buffer_queue: The channel listed in the channels_for_live parameter will be placed on this queue. This is intended for live data analysis.
                                  If None, no data will be put on the queue.
                                  Items put on the out buffer queue will be a numpy array (though this can be either a 2D or a 1D numpy array).
-                                 Data put on this queue is downsampled to 500 Hz.  **Data put on this queue is of the shape (sample, channel)**.
+                                 Data put on this queue is low pass filtered and downsampled to 500 Hz.  **Data put on this queue is of the shape (sample, channel)**.
 
                                  10 Samples are put on this queue at a time.  Thus the actual shape will be (10, channel)
 
         :param subject_name: Optional -- Name of the subject. Defaults to 'None'
         :param subject_tracking_number: Optional -- Subject Tracking Number (AKA TMS group experiment number tracker). Defaults to 'None'
         :param experiment_number: Optional -- Experimental number. Defaults to 'None'
+        :param host: Host running the BrainVision Recorder RDA server. Defaults to 'localhost'
+        :param port: RDA port. Defaults to 51244 (32 Bit RDA-port)
+        :param downsample_factor: We keep every downsample_factor-th sample (5000 Hz -> 500 Hz by default), after an
+                                  anti-aliasing low pass filter. Defaults to 10.
+        :param downsample_numtaps: Length of the anti-aliasing filter (see SignalProcessing.Filters.FIRDecimator).
+                                   Defaults to None (30 * downsample_factor + 1).
+        :param live_queue_maxsize: Most items the out_buffer_queue holds.  When full, the oldest item is dropped.
+                                   If 0, it is unbounded.  Defaults to 0.
+        :param save_queue_maxsize: Most items the data_save_queue holds.  When full, blocks are joined onto the newest
+                                   item (nothing is lost).  If 0, it is unbounded.  Defaults to 0.
         """
         # Call our EEGInterfaceParent init method.
         super(BrainAmpStreamer, self).__init__(
             channels_for_live=channels_for_live, live=live, save_data=save_data, subject_name=subject_name,
-            subject_tracking_number=subject_tracking_number, experiment_number=experiment_number)
+            subject_tracking_number=subject_tracking_number, experiment_number=experiment_number,
+            live_queue_maxsize=live_queue_maxsize, save_queue_maxsize=save_queue_maxsize)
         # Create a tcpip socket
         self.con = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         # Connect to recorder host via 32Bit RDA-port
         # adapt to your host, if recorder is not running on local machine
         # change port to 51234 to connect to 16Bit RDA-port
 
+        self.downsample_factor = downsample_factor
+        self.downsample_numtaps = downsample_numtaps
+        # Filters and downsamples every data block, keeping filter state across blocks.  Reset with each start message.
+        self.decimator = None
+        # The out_buffer_queue and data_save_queue are fed by our hub, like any other subscriber.
+        if self.live:
+            # Live consumers get writable blocks, as before (such as for OnlineFilterBank.process(in_place=True)).
+            self.subscribe(channels=self.channels_for_live, queue=self.out_buffer_queue, copy=True)
+        if self.data_save_queue is not None:
+            self.subscribe(queue=self.data_save_queue, include_info=True)
         try:
-            self.con.connect(("localhost", 51244))
+            self.con.connect((host, port))
         except:
             print "--Ensure that the BrainVision software is on and the dongle is plugged in and functioning."
             print "See CCDLUtil Documentation for instructions on how to run the BrainVision EEG system --"
             time.sleep(1)
             raise
+        # Every message is received into the same reusable buffer.
+        self.receiver = CCDLCommUtil.MessageReceiver(self.con)
 
     @staticmethod
     def recv_data(socket, requestedSize):
         # Helper function for receiving whole message
-        returnStream = ''
-        while len(returnStream) < requestedSize:
-            databytes = socket.recv(requestedSize - len(returnStream))
-            if databytes == '':
-                raise RuntimeError("connection broken")
-            returnStream += databytes
-
+        returnStream = CCDLCommUtil.recvall(socket, requestedSize)
+        if returnStream is None:
+            raise RuntimeError("connection broken")
         return returnStream
 
     @staticmethod
@@ -110,6 +128,8 @@ class BrainAmpStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
           Helper function for splitting a raw array of
           zero terminated strings (C) into an array of python strings
         """
+        if isinstance(raw, memoryview):
+            raw = raw.tobytes()
         stringlist = []
         s = ""
         for i in range(len(raw)):
@@ -127,13 +147,9 @@ class BrainAmpStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
         Helper function for extracting eeg properties from a raw data array
         """
         # Extract numerical data
-        (channelCount, samplingInterval) = struct.unpack('<Ld', rawdata[:12])
+        (channelCount, samplingInterval) = struct.unpack_from('<Ld', rawdata)
         # Extract resolutions
-        resolutions = []
-        for c in range(channelCount):
-            index = 12 + c * 8
-            restuple = struct.unpack('<d', rawdata[index:index+8])
-            resolutions.append(restuple[0])
+        resolutions = list(struct.unpack_from('<%dd' % channelCount, rawdata, 12))
 
         # Extract channel names
         channelNames = BrainAmpStreamer.split_string(rawdata[12 + 8 * channelCount:])
@@ -143,27 +159,29 @@ class BrainAmpStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
     def get_data(self, rawdata, num_channels):
         """
         Helper function for extracting eeg and marker data from a raw data array
+
+        :param rawdata: The message body - a str or a memoryview (from our MessageReceiver).
+        :param num_channels: Number of channels
+        :return: block, points, markerCount, data, markers
+                data is an np array of shape (points, channels) that shares memory with rawdata.  When rawdata comes
+                from our MessageReceiver, data is overwritten by the next message and must be copied to be kept.
         """
         # read from tcpip socket
 
         # Extract numerical data
-        (block, points, markerCount) = struct.unpack('<LLL', rawdata[:12])
+        (block, points, markerCount) = struct.unpack_from('<LLL', rawdata)
 
-        # Extract eeg data as array of floats
-        data = []
-        for i in range(points * num_channels):
-            index = 12 + 4 * i
-            value = struct.unpack('<f', rawdata[index:index+4])
-            data.append(value[0])
+        # Extract eeg data as an array of floats - shape (points, channels)
+        data = CCDLCommUtil.buffer_to_array(rawdata, dtype='<f4', count=points * num_channels, offset=12).reshape(points, num_channels)
 
         # Extract markers
         markers = []
         index = 12 + 4 * points * num_channels
         for m in range(markerCount):
-            markersize = struct.unpack('<L', rawdata[index:index+4])
+            markersize = struct.unpack_from('<L', rawdata, index)
 
             ma = Marker()
-            (ma.position, ma.points, ma.channel) = struct.unpack('<LLl', rawdata[index+4:index+16])
+            (ma.position, ma.points, ma.channel) = struct.unpack_from('<LLl', rawdata, index + 4)
             typedesc = BrainAmpStreamer.split_string(rawdata[index + 16:index + markersize[0]])
             ma.type = typedesc[0]
             ma.description = typedesc[1]
@@ -184,18 +202,15 @@ class BrainAmpStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
             # Perform action dependent on the message type
             if msgtype == 1:
                 channel_count, sampling_interval, resolutions, channel_names, channel_dict, meta_info_str = self.first_message_actions(raw_data)
+                resolutions = np.asarray(resolutions)
             elif msgtype == 4:
                 # Data message, extract data and markers
                 (block, points, marker_count, data, markers) = self.get_data(raw_data, channel_count)
-                # data is a list of length 3200
-                assert len(data) == 3200
+                # data is shape (points, channels), usually (100, 32)
                 # Get the time we collected the sample
                 data_recieve_time = time.time()
                 self.data_index += 1  # Increase our sample counter
 
-                CCDLUtil.EEGInterface.EEG_INDEX.EEG_INDEX = self.data_index
-                CCDLUtil.EEGInterface.EEG_INDEX.EEG_INDEX_2 = self.data_index
-
                 ######################
                 # Check for overflow #
                 ######################
@@ -210,88 +225,31 @@ class BrainAmpStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
                 ###################
                 # Handle the Data #
                 ###################
-                # Save the Data - We put data on the queue to be saved - format for queue (index, time, data)
-                if self.data_save_queue is not None:
-                    downsampled_matrix = self.downsample_all_channels(data=data, resolutions=resolutions)
-                    save_string = self.convert_downsample_matrix_to_save_string(data_index=self.data_index,
-                                                                                data_recieve_time=data_recieve_time, downsampled_matrix=downsampled_matrix)
-                    self.data_save_queue.put((None, None, save_string))
-
-                # The data put on the out buffer queue is downsamled to 500 Hz.
-                if self.live:
-                    self.handle_out_buffer_queue(data, resolutions, channel_count, channel_dict)
+                # Shape (samples, channels), usually (10, 32).  Downsampled to 500 Hz.
+                downsampled_matrix = self.downsample_all_channels(data=data, resolutions=resolutions)
+                # Hand the block to every subscriber - the data_save_queue (as (index, time, data)), the
+                # out_buffer_queue (our channels_for_live) and any others.
+                self.publish(self.data_index, data_recieve_time, downsampled_matrix)
+                self.mark_samples(downsampled_matrix.shape[0], data_recieve_time)
 
             elif msgtype == 3:
                 self.con.close()  # Stop message, terminate program; Close tcpip connection
                 break
 
-    def convert_downsample_matrix_to_save_string(self, data_index, data_recieve_time, downsampled_matrix):
-        """
-        converts a downsample matrix of shape(samples, channels) to a string that can be used to save to a file
-        """
-        ret_str = ''
-        data_index_str = str(data_index)
-        data_recieve_time_str = str(data_recieve_time)
-        for ii in xrange(downsampled_matrix.shape[0]):
-            ret_str += ','.join([data_index_str, data_recieve_time_str] + map(str, list(downsampled_matrix[ii, :]))) + '\n'
-        return ret_str
-
     def downsample_all_channels(self, data, resolutions):
         """
         Downsamples our data from 5000 Hz to 500 Hz for all channels
-        :param data: One data packet for 32 channels.
-        :param resolutions: Our resolutions
+        :param data: One data packet - np array of shape (points, channels)
+        :param resolutions: np array of our resolutions, one per channel
         :return: A matrix of shape 10 by 32.  That is 10 samples for 32 channels.
         """
         # We sample at 5000 Hz.  We want to down sample to 500 hz.  We collect data in packets of 100 samples
         # at 50 Hz. 100 * 50 = 5000
         # If we took a single sample from each packet, we would be sampling at 50 Hz.
         # Because we want to sample at 500 Hz, we need to take 10x as many samples, so for every packet,
-        # we need to collect 10 data points out of the 100 (aka, we need to collect every 10th data point)
-
-        indexes_needed = range(0, 100, 10)
-        # Shape is (Samples, Channels)
-        channels = np.zeros((len(indexes_needed), len(resolutions)))
-        for ii, resolution in enumerate(resolutions):
-            # TODO: document this change
-            channel_data = [data[index * 32 + ii] * resolution for index in indexes_needed]
-            channels[:, ii] = np.asarray(channel_data)
-        return channels
-
-    def handle_out_buffer_queue(self, data, resolutions, channel_count, channel_dict):
-        """
-        Puts every 10th sample on the out_buffer_queue (downsampling to 500 Hz)
-        Number of channels: 32
-        Sampling Rate [Hz]: 5000
-        Sampling Interval [micro seconds]: 200  (0.0002 seconds; 5000 Hz)
-
-        Packet size = 100 samples
-        Packet arrival = 50 Hz
-        """
-        # We sample at 5000 Hz.  We want to down sample to 500 hz.  We collect data in packets of 100 samples
-        # at 50 Hz. 100 * 50 = 5000
-        # If we took a single sample from each packet, we would be sampling at 50 Hz.
-        # Because we want to sample at 500 Hz, we need to take 10x as many samples, so for every packet,
-        # we need to collect 10 data points out of the 100 (aka, we need to collect every 10th data point)
-
-        # 100 is the number of samples we get once
-        indexes_needed = range(0, 100, 10)
-        # Shape is (Samples, Channels)
-        # size is correct: 10 x 1
-        channels = np.zeros((len(indexes_needed), len(self.channels_for_live)))
-        for ii, ch in enumerate(self.channels_for_live):
-            # Get the channel index
-            if type(ch) is str:
-                channel_index = channel_dict[ch]
-            else:
-                channel_index = ch
-            # Get our resolution for this channel (0.5)
-            resolution = resolutions[channel_index]
-            # TODO: doucment this change -- fixed the indexing of channel data
-            channel_data = [data[index * 32 + channel_index] * resolution for index in indexes_needed]
-            channels[:, ii] = np.asarray(channel_data)
-        # Put our numpy array of channels on the queue.  Channels shape -> [samples (10), channel]
-        self.out_buffer_queue.put(channels)
+        # we need to collect 10 data points out of the 100 (aka, we need to collect every 10th data point).
+        # Anything above 250 Hz would alias into our band, so we low pass filter first (the decimator does both).
+        return self.decimator.process(data) * resolutions
 
     @staticmethod
     def print_marker_count(markers, marker_count):
@@ -327,6 +285,8 @@ class BrainAmpStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
         # reset block counter
         self.last_block = -1
 
+        self.decimator = CCDLFilters.FIRDecimator(factor=self.downsample_factor, numtaps=self.downsample_numtaps)
+
         sampling_interval_seconds = sampling_interval * 10.0 ** -6
         meta_info_str = "Subject Name,\t" + str(self.subject_name) + \
                         "\nSubject Tracking Number,\t" + str(self.subject_number) + \
@@ -334,7 +294,8 @@ class BrainAmpStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
                         "\nNumber of channels,\t" + str(channel_count) + \
                         "\nSampling interval,\t" + str(sampling_interval) + ' microseconds (' + str(sampling_interval_seconds) + ' seconds)' + \
                         '\nOriginal Sampling Frequency,\t' + str(1.0 / sampling_interval_seconds) + ' Hz' + \
-                        '\nDownsampled Sampling Frequency,\t' + str(500) + ' Hz' + \
+                        '\nDownsampled Sampling Frequency,\t' + str(1.0 / sampling_interval_seconds / self.downsample_factor) + ' Hz' + \
+                        '\nAnti-aliasing filter,\t' + str(self.decimator.numtaps) + ' tap FIR (delay ' + str(self.decimator.delay) + ' samples at the original rate)' + \
                         "\nResolutions,\t,\t" + str(resolutions) + \
                         "\nChannel Names,\t,\t" + str(channel_names)
         if self.data_save_queue is not None:
@@ -343,17 +304,23 @@ class BrainAmpStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
             print meta_info_str
 
         channel_dict = dict(zip(channel_names, range(channel_count)))
+        self.recording_info.update({'fs': 1.0 / sampling_interval_seconds / self.downsample_factor,
+                                    'channel_names': channel_names, 'resolutions': resolutions})
         return channel_count, sampling_interval, resolutions, channel_names, channel_dict, meta_info_str
 
     def get_raw_data(self):
+        """
+        Receives the next message.  The header and body are received into our reusable buffer, so the returned raw_data
+        (a memoryview) is only valid until the next call.
+        """
         # Get message header as raw array of chars
-        raw_hdr = BrainAmpStreamer.recv_data(self.con, 24)
+        raw_hdr = self.receiver.recv(24)
 
         # Split array into usefull information id1 to id4 are constants
-        (id1, id2, id3, id4, msgsize, msgtype) = struct.unpack('<llllLL', raw_hdr)
+        (id1, id2, id3, id4, msgsize, msgtype) = struct.unpack_from('<llllLL', raw_hdr)
 
         # Get data part of message, which is of variable size
-        raw_data = BrainAmpStreamer.recv_data(self.con, msgsize - 24)
+        raw_data = self.receiver.recv(msgsize - 24)
         return raw_data, msgsize, msgtype
 
 
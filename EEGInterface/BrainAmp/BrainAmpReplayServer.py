@@ -0,0 +1,178 @@
+"""
+A stand in for the BrainVision Recorder RDA server.  It serves RDA messages (either captured from a real recorder or
+synthesized) over a local socket, so the BrainAmpStreamer can be run and benchmarked without the amplifier.
+
+RDA messages all start with a 24 byte header:
+    id1, id2, id3, id4 (the RDA GUID), msgsize (including the header), msgtype
+
+Message types used here:
+    1 - Start.  channelCount (uint32), samplingInterval (double, microseconds), resolutions (double per channel),
+        channel names (zero terminated strings)
+    4 - Data.   block (uint32), points (uint32), markerCount (uint32), data (float32, points x channels),
+        markers
+    3 - Stop.
+
+Capturing messages from a real recorder (to replay later):
+
+    messages = capture_rda_messages(num_messages=500)
+    save_rda_messages('captured.rda', messages)
+"""
+
+import time
+import socket
+import struct
+import threading
+import numpy as np
+
+RDA_GUID = (0x8e45584c, 0x4a35e926, 0x9dad3d87, 0x8ac7c86d)
+HEADER_FORMAT = '<llllLL'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MSG_START, MSG_STOP, MSG_DATA = 1, 3, 4
+
+# The channels we typically record (taken from signal tester)
+DEFAULT_CHANNEL_NAMES = ['Fp1', 'Fp2', 'F3', 'F4', 'C3', 'C4', 'P3', 'P4', 'O1', 'O2', 'F7', 'F8', 'T7', 'T8', 'P7',
+                         'P8', 'Fz', 'Cz', 'Pz', 'Oz', 'FC1', 'FC2', 'CP1', 'CP2', 'FC5', 'FC6', 'CP5', 'CP6', 'TP9',
+                         'TP10', 'POz', 'ECG']
+
+
+def make_message(msgtype, body):
+    """
+    Adds an RDA header to a message body.
+    """
+    guid = [struct.unpack('<l', struct.pack('<L', xx))[0] for xx in RDA_GUID]
+    return struct.pack(HEADER_FORMAT, guid[0], guid[1], guid[2], guid[3], HEADER_SIZE + len(body), msgtype) + body
+
+
+def make_start_message(channel_names=DEFAULT_CHANNEL_NAMES, sampling_interval=200.0, resolutions=None):
+    """
+    :param channel_names: List of channel names
+    :param sampling_interval: Microseconds between samples.  Defaults to 200 (5000 Hz)
+    :param resolutions: uV per unit, one per channel.  Defaults to 0.1 for all channels.
+    """
+    if resolutions is None:
+        resolutions = [0.1] * len(channel_names)
+    body = struct.pack('<Ld', len(channel_names), sampling_interval)
+    body += struct.pack('<%dd' % len(resolutions), *resolutions)
+    body += ''.join([name + '\x00' for name in channel_names])
+    return make_message(MSG_START, body)
+
+
+def make_data_message(block, data):
+    """
+    :param block: Block counter
+    :param data: np array of shape (points, channels)
+    """
+    body = struct.pack('<LLL', block, data.shape[0], 0) + np.ascontiguousarray(data, dtype='<f4').tostring()
+    return make_message(MSG_DATA, body)
+
+
+def make_stop_message():
+    return make_message(MSG_STOP, '')
+
+
+def make_synthetic_messages(num_blocks, channel_names=DEFAULT_CHANNEL_NAMES, points=100, seed=0):
+    """
+    A start message, num_blocks data messages of random data and a stop message.
+    """
+    rng = np.random.RandomState(seed)
+    messages = [make_start_message(channel_names)]
+    for block in xrange(num_blocks):
+        messages.append(make_data_message(block, rng.randn(points, len(channel_names)) * 100))
+    messages.append(make_stop_message())
+    return messages
+
+
+def split_rda_messages(stream):
+    """
+    Splits a string of back to back RDA messages into a list of messages.
+    """
+    messages = []
+    index = 0
+    while index + HEADER_SIZE <= len(stream):
+        msgsize = struct.unpack_from(HEADER_FORMAT, stream, index)[4]
+        messages.append(stream[index:index + msgsize])
+        index += msgsize
+    return messages
+
+
+def save_rda_messages(file_path, messages):
+    with open(file_path, 'wb') as f:
+        f.write(''.join(messages))
+
+
+def load_rda_messages(file_path):
+    with open(file_path, 'rb') as f:
+        return split_rda_messages(f.read())
+
+
+def capture_rda_messages(num_messages, host='localhost', port=51244):
+    """
+    Records num_messages raw messages from a running BrainVision Recorder.
+    """
+    con = socket.create_connection((host, port))
+    messages = []
+    try:
+        while len(messages) < num_messages:
+            header = _recv_exactly(con, HEADER_SIZE)
+            msgsize = struct.unpack(HEADER_FORMAT, header)[4]
+            messages.append(header + _recv_exactly(con, msgsize - HEADER_SIZE))
+    finally:
+        con.close()
+    return messages
+
+
+def _recv_exactly(con, n):
+    chunks = []
+    remaining = n
+    while remaining > 0:
+        chunk = con.recv(remaining)
+        if chunk == '':
+            raise RuntimeError("connection broken")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return ''.join(chunks)
+
+
+class RDAReplayServer(object):
+    """
+    Listens on a local port and sends the given messages to the first client that connects.
+    """
+
+    def __init__(self, messages, host='localhost', port=0, interval=None):
+        """
+        :param messages: List of raw RDA messages (header included) to send, in order.
+        :param port: Port to listen on.  If 0, a free port is picked (see self.port).
+        :param interval: Optional -- Seconds between messages, to replay at the amplifier's pace (0.02 for 100 point
+                         messages at 5000 Hz).  If None, messages are sent as fast as possible.  Defaults to None.
+        """
+        self.messages = messages
+        self.interval = interval
+        self.server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_sock.bind((host, port))
+        self.server_sock.listen(1)
+        self.host, self.port = self.server_sock.getsockname()
+
+    def start(self):
+        """
+        Serves our messages in a new (daemon) thread.  Returns immediately.
+        """
+        t = threading.Thread(target=self.serve)
+        t.daemon = True
+        t.start()
+        return t
+
+    def serve(self):
+        conn, _ = self.server_sock.accept()
+        try:
+            start_time = time.time()
+            for message_index, message in enumerate(self.messages):
+                if self.interval is not None:
+                    # Send on a fixed schedule, so a late message does not delay the rest.
+                    delay = start_time + message_index * self.interval - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                conn.sendall(message)
+        finally:
+            conn.close()
+            self.server_sock.close()
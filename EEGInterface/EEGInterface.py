@@ -7,8 +7,13 @@ threading.Thread(target=lambda: EEGDataSaver.start_eeg_data_saving(subject_data_
 import sys
 import time
 import Queue
+import numpy as np
 from CCDLUtil.Utility.Decorators import threaded
 import CCDLUtil.DataManagement.StringParser as StringParser
+import CCDLUtil.DataManagement.BinaryRecording as BinaryRecording
+import CCDLUtil.DataManagement.BoundedQueue as CCDLBoundedQueue
+import CCDLUtil.EEGInterface.EEG_INDEX as CCDLEEGIndex
+import CCDLUtil.EEGInterface.SampleClock as CCDLSampleClock
 
 
 class EEGInterfaceParent(object):
@@ -18,13 +23,16 @@ class EEGInterfaceParent(object):
     """
 
     def __init__(self, channels_for_live='All', live=True, save_data=True, subject_name=None,
-                 subject_tracking_number=None, experiment_number=None):
+                 subject_tracking_number=None, experiment_number=None, live_queue_maxsize=0,
+                 live_queue_policy=CCDLBoundedQueue.DROP_OLDEST, save_queue_maxsize=0,
+                 save_queue_policy=CCDLBoundedQueue.COALESCE):
         """
         A data collection object for the EEG interface.
         This provides option for live data streaming and saving data to file.
 
-        Modifies the EEG_INDEX and EEG_INDEX_2 in CCDLUtil/EEGInterface/EEG_INDEX.py when each packet arrives.
-        These variables can be read from any thread. Use this to time mark events in your other programs.
+        Modifies the CURR_EEG_INDEX and CURR_EEG_INDEX_2 in CCDLUtil/EEGInterface/EEG_INDEX.py when each packet arrives.
+        These variables can be read from any thread.  To time mark events in your other programs, prefer self.clock (a
+        SampleClock, also set as EEG_INDEX.SAMPLE_CLOCK), which gives the sample index of any time.
 
         :param channels_for_live: List of channel names (or indexes) to put on the out_buffer_queue. If [], no channels
                     will be put on the out_buffer_queue. If 'All' (case is ignored), all channels will be placed on the
@@ -34,6 +42,12 @@ class EEGInterfaceParent(object):
         :param subject_name: Optional -- Name of the subject. Defaults to 'None'
         :param subject_tracking_number: Optional -- Subject Tracking Number (AKA TMS group experiment number tracker). Defaults to 'None'
         :param experiment_number: Optional -- Experimental number. Defaults to 'None'
+        :param live_queue_maxsize: Most items the out_buffer_queue holds.  If 0, it is unbounded.  Defaults to 0.
+        :param live_queue_policy: What happens when the out_buffer_queue is full (see DataManagement.BoundedQueue).
+                                  Defaults to 'drop_oldest', so a slow consumer gets the most recent data.
+        :param save_queue_maxsize: Most items the data_save_queue holds.  If 0, it is unbounded.  Defaults to 0.
+        :param save_queue_policy: What happens when the data_save_queue is full.  Defaults to 'coalesce', so no data is
+                                  lost, but the saver gets fewer, larger blocks.
         """
 
         self.subject_name = str(subject_name) if subject_name is not None else "None"
@@ -45,7 +59,8 @@ class EEGInterfaceParent(object):
         self.live = live
         self.save_data = save_data
         # A separate queue (other than the one for storing data) that puts the channels_for_live data points on
-        self.out_buffer_queue = Queue.Queue() if live else None
+        self.out_buffer_queue = CCDLBoundedQueue.BoundedQueue(
+            live_queue_maxsize, live_queue_policy, name='out_buffer_queue') if live else None
         # block counter to check overflows of tcpip buffer
         self.last_block = -1
         self.channels_for_live = channels_for_live
@@ -54,7 +69,74 @@ class EEGInterfaceParent(object):
             if self.channels_for_live != 'all':
                 raise ValueError('Invalid channels_for_live parameter')
         # create data save queue
-        self.data_save_queue = Queue.Queue() if save_data else None
+        self.data_save_queue = CCDLBoundedQueue.BoundedQueue(
+            save_queue_maxsize, save_queue_policy, name='data_save_queue') if save_data else None
+        # Information about the recording (such as fs, channel_names and resolutions), filled in by the child.  This is
+        # saved in the header of binary recordings.
+        self.recording_info = dict()
+        # Every block the child publishes is handed to each subscriber (see subscribe).
+        self.hub = AcquisitionHub(get_channel_names=lambda: self.recording_info.get('channel_names'))
+        # Maps host time to sample index.  Told of every block by mark_samples.
+        self.clock = CCDLSampleClock.SampleClock()
+        CCDLEEGIndex.SAMPLE_CLOCK = self.clock
+        # Optional -- A multiprocessing.RawValue that mark_samples keeps equal to data_index (see AcquisitionHost).
+        self.shared_data_index = None
+
+    def subscribe(self, channels='All', block_size=None, queue=None, include_info=False, maxsize=0,
+                  policy=CCDLBoundedQueue.DROP_OLDEST, copy=False):
+        """
+        Registers a consumer (display, saver, classifier, marker logger...) of the data published by this device.
+        See AcquisitionHub.subscribe.
+
+        :return: The queue the subscriber's blocks are put on.
+        """
+        return self.hub.subscribe(channels=channels, block_size=block_size, queue=queue, include_info=include_info,
+                                  maxsize=maxsize, policy=policy, copy=copy)
+
+    def unsubscribe(self, queue):
+        """
+        Stops putting blocks on a queue returned by subscribe.
+        """
+        self.hub.unsubscribe(queue)
+
+    def publish(self, index, t, block):
+        """
+        Called by the child with every block of samples acquired.  See AcquisitionHub.publish.
+        """
+        self.hub.publish(index, t, block)
+
+    def mark_samples(self, num_samples, host_time=None, id_val=None):
+        """
+        Called by the child each time samples arrive.  Tells our clock, and sets the EEG_INDEX globals to data_index.
+
+        :param num_samples: Number of samples (rows of the recording) that arrived.
+        :param host_time: time.time() they arrived.  Defaults to now.
+        :param id_val: Optional -- Packet id of the last sample, saved as EEG_INDEX.EEG_ID_VAL.
+        """
+        if self.clock.fs is None:
+            self.clock.fs = self.recording_info.get('fs')
+        self.clock.add_block(num_samples, host_time)
+        CCDLEEGIndex.CURR_EEG_INDEX = self.data_index
+        CCDLEEGIndex.CURR_EEG_INDEX_2 = self.data_index
+        if self.shared_data_index is not None:
+            self.shared_data_index.value = self.data_index
+        if id_val is not None:
+            CCDLEEGIndex.EEG_ID_VAL = id_val
+
+    def get_queue_metrics(self):
+        """
+        Overflow counts of the out_buffer_queue, data_save_queue and every other subscriber's queue (see
+        BoundedQueue.get_metrics).
+
+        :return: List of metrics dictionaries, one per bounded queue.
+        """
+        queues = [self.out_buffer_queue, self.data_save_queue] + [subscription.queue for subscription in self.hub.subscriptions]
+        metrics, seen = [], set()
+        for queue in queues:
+            if isinstance(queue, CCDLBoundedQueue.BoundedQueue) and id(queue) not in seen:
+                seen.add(id(queue))
+                metrics.append(queue.get_metrics())
+        return metrics
 
     @staticmethod
     def trim_channels_with_channel_index_list(data, channel_index_list):
@@ -71,6 +153,35 @@ class EEGInterfaceParent(object):
         """
         return [data[xx] for xx in channel_index_list]
 
+    @staticmethod
+    def channel_index_selector(channel_index_list):
+        """
+        Builds an index for trimming the channel axis of a (sample, channel) np array.  This is the block
+        equivalent of trim_channels_with_channel_index_list.
+        For example:
+            data = np.array([[500, 400, 350, 450]])
+            data[:, channel_index_selector([0, 2])] -> np.array([[500, 350]])
+
+        When channel_index_list is 'All' or runs of evenly spaced increasing (non negative) indexes, a slice is returned
+        so trimming gives a view of the block without copying.  Otherwise an index array is returned for fancy indexing.
+
+        :param channel_index_list: A list of channel indexes that we want to keep, or 'All'.
+        :return: A slice or np array of channel indexes
+        """
+        if type(channel_index_list) is str and channel_index_list.lower() == 'all':
+            return slice(None)
+        index_arr = np.asarray(channel_index_list, dtype=np.intp)
+        if np.any(index_arr < 0):
+            # Negative indexes count from the end, which a slice's stop can't express (such as [-1] or [-2, -1]).
+            return index_arr
+        if len(index_arr) == 1:
+            return slice(index_arr[0], index_arr[0] + 1)
+        if len(index_arr) > 1:
+            step = index_arr[1] - index_arr[0]
+            if step > 0 and np.all(np.diff(index_arr) == step):
+                return slice(index_arr[0], index_arr[-1] + 1, step)
+        return index_arr
+
     def start_recording(self):
         """
         To be overridden by child
@@ -78,7 +189,7 @@ class EEGInterfaceParent(object):
         pass
 
     @threaded(False)
-    def start_saving_data(self, save_data_file_path, header=None, timeout=15):
+    def start_saving_data(self, save_data_file_path, header=None, timeout=15, file_format='csv', flush_interval=1.0):
         """
         A function to be called in a new thread whose sole purpose is to save eeg data to disk.
         :param save_data_file_path: A string - The full file name to save the data (for example './data/subjectX.csv').
@@ -94,6 +205,8 @@ class EEGInterfaceParent(object):
                     - Data
                         A list of data points in the form [chan 1, chan 2...], where chan X is a number.
                         If data is a list, it will be comma separated.  If data is a string, we'll write it to file as it was provided to us.
+                        If data is a np array of shape (sample, channel), one line is written per sample.  In this case
+                        index and time may be np arrays of shape (sample,) or single values shared by every sample.
 
                 Data save format.
                     Data will be saved in the comma separated format:
@@ -101,9 +214,20 @@ class EEGInterfaceParent(object):
 
         :param header: Header for the file.  If no header is wanted, pass None.  Defaults to None.
         :param timeout: If we don't collect any data after timeout seconds, we'll quit all processes.  If none, there won't be a timeout.
+        :param file_format: 'csv' or 'binary'.  If 'binary', data is saved with CCDLUtil.DataManagement.BinaryRecording
+                            (index and time must then be numbers or None.  String data that is an
+                            'index,time,chan1,chan2...' line of numbers is saved as a sample, other strings as a note
+                            in the header).  Load either format with FileParser.load_eeg_recording.  Defaults to 'csv'.
+        :param flush_interval: Max number of seconds data is buffered before being flushed to disk.  If 0, the buffer is
+                               flushed after every item.  Defaults to 1.
 
         :return: Runs infinitely.  Kill by terminating the thread.
         """
+        if file_format == 'binary':
+            self._save_binary_data(save_data_file_path, header=header, timeout=timeout, flush_interval=flush_interval)
+            return
+        if file_format != 'csv':
+            raise ValueError('Invalid file_format: %s' % str(file_format))
         f = file(save_data_file_path, 'w')
         # Write our header with only one newline character
         if header is not None:
@@ -113,6 +237,7 @@ class EEGInterfaceParent(object):
                 f.write(header)
                 f.write('\n')
             f.flush()
+        last_flush_time = time.time()
         while True:
             # get our components
             try:
@@ -122,22 +247,287 @@ class EEGInterfaceParent(object):
                     index, t, data = self.data_save_queue.get(timeout)
             except Queue.Empty:
                 print "Data is not being collected."
+                f.close()
                 time.sleep(2)
                 # quit system
                 sys.exit(1)
-            index = '' if index is None else str(index) + ','
-            t = '' if t is None else str(t) + ','
-            if type(data) is list:
-                # convert our data items to strings
-                data = map(str, data)
-                # convert our data to a comma separated string
-                data = ','.join(data)
+            if isinstance(data, np.ndarray):
+                # A block of samples.  Written with a single call.
+                f.write(EEGInterfaceParent.convert_block_to_save_string(index, t, data))
             else:
-                if type(data) is not str:
-                    raise TypeError("Invalid data type -- data must be either string or ")
-            # add a newline if needed.  Commas are already accounted for
-            data_str = str(index) + str(t) + StringParser.idempotent_append_newline(data)
-            # Write our index and timestamp
-            f.write(data_str)
+                index = '' if index is None else str(index) + ','
+                t = '' if t is None else str(t) + ','
+                if type(data) is list:
+                    # convert our data items to strings
+                    data = map(str, data)
+                    # convert our data to a comma separated string
+                    data = ','.join(data)
+                else:
+                    if type(data) is not str:
+                        raise TypeError("Invalid data type -- data must be either string or ")
+                # add a newline if needed.  Commas are already accounted for
+                data_str = str(index) + str(t) + StringParser.idempotent_append_newline(data)
+                # Write our index and timestamp
+                f.write(data_str)
             # Flush our buffer
-            f.flush()
+            if time.time() - last_flush_time >= flush_interval:
+                f.flush()
+                last_flush_time = time.time()
+
+    def _save_binary_data(self, save_data_file_path, header=None, timeout=15, flush_interval=1.0):
+        """
+        The binary file_format version of start_saving_data.  Runs in the thread started by start_saving_data.
+        """
+        header_info = {'subject_name': self.subject_name, 'subject_tracking_number': self.subject_number,
+                       'experiment_number': self.experiment_number}
+        writer = BinaryRecording.BinaryRecordingWriter(save_data_file_path, header_info=header_info,
+                                                       flush_interval=flush_interval)
+        if header is not None:
+            writer.add_note(header)
+        while True:
+            try:
+                index, t, data = self.data_save_queue.get(timeout=timeout)
+            except Queue.Empty:
+                print "Data is not being collected."
+                writer.close()
+                time.sleep(2)
+                # quit system
+                sys.exit(1)
+            if type(data) is str:
+                # Per sample streamers (such as OpenBCI) put whole 'index,time,chan1,chan2...' lines.  Anything else
+                # (such as BrainAmp's meta info) is kept as a note.
+                row = EEGInterfaceParent._parse_save_line(data) if index is None and t is None else None
+                if row is None:
+                    writer.add_note(data)
+                    continue
+                index, t, data = row
+            if writer.row_dtype is None:
+                # Our child has had its chance to fill in recording_info by the time the first data arrives.
+                writer.header_info.update(self.recording_info)
+            writer.write(index, t, data)
+
+    @staticmethod
+    def _parse_save_line(line):
+        """
+        Parses a comma separated 'index,time,chan1,chan2...' line, as put on the data save queue by per sample
+        streamers.
+
+        :param line: String line, with or without a trailing newline.
+        :return: index, time, list of channel values.  None if line is not such a line of numbers.
+        """
+        fields = line.strip().split(',')
+        if len(fields) < 3:
+            return None
+        try:
+            values = [float(field) for field in fields]
+        except ValueError:
+            return None
+        return values[0], values[1], values[2:]
+
+    @staticmethod
+    def convert_block_to_save_string(index, t, data):
+        """
+        Converts a block of data of shape (sample, channel) to the same comma separated lines that saving each sample
+        individually would produce:
+            index,time,chan1,chan2,chan3...\n
+
+        :param index: None, a single index, or a np array of shape (sample,)
+        :param t: None, a single time, or a np array of shape (sample,)
+        :param data: np array of shape (sample, channel).  A 1D array is treated as a single sample.
+        :return: String with one line per sample.
+        """
+        rows = np.atleast_2d(data).tolist()
+        num_samples = len(rows)
+        prefixes = [''] * num_samples
+        for column in (index, t):
+            if column is None:
+                continue
+            if isinstance(column, np.ndarray):
+                column_strs = map(str, column.tolist())
+            else:
+                column_strs = [str(column)] * num_samples
+            prefixes = [prefix + column_str + ',' for prefix, column_str in zip(prefixes, column_strs)]
+        return ''.join([prefix + ','.join(map(str, row)) + '\n' for prefix, row in zip(prefixes, rows)])
+
+
+class AcquisitionHub(object):
+
+    """
+    Fans acquired data out to any number of subscribers, each wanting its own channels and block size.
+
+    Published blocks are copied once, into a shared acquisition buffer.  Each subscriber is handed read only views of
+    that buffer (restricted to its channels), so the raw samples are not copied for each subscriber.  The buffer is
+    allocated in pages of page_samples samples.  Pages are never reused - a page is freed once every view of it has
+    been dropped - so subscribers may keep what they are given for as long as they like.
+
+    A subscriber's block is only copied when it straddles two pages, or when its channels cannot be selected with a
+    slice (such as [3, 0, 7]), in which case numpy copies the selected channels.  Subscribers that asked for copy=True
+    are given their own writable copies instead.
+    """
+
+    def __init__(self, get_channel_names=None, page_samples=2 ** 14):
+        """
+        :param get_channel_names: Function returning the device's channel names (or None if not yet known).  Used to
+                                  look up subscribers' channels given by name.  Defaults to None (channels must be
+                                  given as indexes).
+        :param page_samples: Samples per page of the acquisition buffer.  Rounded up to a multiple of the first block
+                             published, so blocks never straddle pages.  Defaults to 16384.
+        """
+        self.get_channel_names = get_channel_names
+        self.page_samples = page_samples
+        self.subscriptions = []
+        self.page = None
+        self.page_indexes = None
+        self.page_times = None
+        self.page_position = 0
+
+    def subscribe(self, channels='All', block_size=None, queue=None, include_info=False, maxsize=0,
+                  policy=CCDLBoundedQueue.DROP_OLDEST, copy=False):
+        """
+        Registers a subscriber.
+
+        :param channels: 'All', or a list of channel names or indexes.  Defaults to 'All'.
+        :param block_size: Number of samples in each item put on the queue.  If None, each published block is put on
+                           the queue as it arrives.  Defaults to None.
+        :param queue: Queue to put the data on (anything with a put method).  If None, a new BoundedQueue is made.
+        :param include_info: If True, items put on the queue are (indexes, times, data), with a packet index and time
+                             per sample (as the data_save_queue expects).  Otherwise items are just the data.
+                             Data is an np array of shape (sample, channel).  Defaults to False.
+        :param maxsize: If a new queue is made - most items it holds.  If 0, it is unbounded.  Defaults to 0.
+        :param policy: If a new queue is made - what happens when it is full (see DataManagement.BoundedQueue).
+                       Defaults to 'drop_oldest'.
+        :param copy: If True, the subscriber gets its own (writable) copy of each block.  Otherwise it gets a read only
+                     view of the acquisition buffer.  Defaults to False.
+        :return: The queue.
+        """
+        queue = CCDLBoundedQueue.BoundedQueue(maxsize, policy) if queue is None else queue
+        self.subscriptions.append(_Subscription(channels, block_size, queue, include_info, copy))
+        return queue
+
+    def unsubscribe(self, queue):
+        """
+        Stops putting data on queue.
+        """
+        self.subscriptions = [subscription for subscription in self.subscriptions if subscription.queue is not queue]
+
+    def publish(self, index, t, block):
+        """
+        Copies a block into the acquisition buffer and hands it to every subscriber.
+
+        :param index: Packet index - a single value (shared by every sample in the block) or an array of shape (sample,)
+        :param t: Time the block was collected - a single value, or an array of shape (sample,)
+        :param block: np array of shape (sample, channel)
+        """
+        if not self.subscriptions:
+            return
+        block = np.asarray(block)
+        num_samples = block.shape[0]
+        if self.page is None or self.page_position + num_samples > len(self.page) or \
+                self.page.shape[1:] != block.shape[1:] or self.page.dtype != block.dtype:
+            self._new_page(block)
+        start, stop = self.page_position, self.page_position + num_samples
+        self.page[start:stop] = block
+        self.page_indexes[start:stop] = index
+        self.page_times[start:stop] = t
+        self.page_position = stop
+        for subscription in self.subscriptions:
+            if subscription.selector is None:
+                subscription.selector = EEGInterfaceParent.channel_index_selector(
+                    subscription.get_channel_indexes(self.get_channel_names))
+            subscription.add(self.page, self.page_indexes, self.page_times, start, stop)
+
+    def _new_page(self, block):
+        num_samples = block.shape[0]
+        # A whole number of blocks per page, so (equal sized) blocks never straddle two pages.
+        page_samples = max(num_samples, -(-self.page_samples // num_samples) * num_samples)
+        self.page = np.empty((page_samples,) + block.shape[1:], dtype=block.dtype)
+        self.page_indexes = np.empty(page_samples, dtype=np.int64)
+        self.page_times = np.empty(page_samples, dtype=np.float64)
+        self.page_position = 0
+
+
+class _Subscription(object):
+    """
+    One AcquisitionHub subscriber.  Keeps the (page, start, stop) runs of samples not yet handed out.
+    """
+
+    def __init__(self, channels, block_size, queue, include_info, copy=False):
+        self.channels = channels
+        self.block_size = block_size
+        self.queue = queue
+        self.include_info = include_info
+        self.copy = copy
+        # Set from channels with the first published block (when channel names are known).
+        self.selector = None
+        self.pending = []
+        self.num_pending = 0
+
+    def get_channel_indexes(self, get_channel_names):
+        if type(self.channels) is str:
+            if self.channels.lower() != 'all':
+                raise ValueError('Invalid channels: %s' % self.channels)
+            return 'all'
+        channel_names = get_channel_names() if get_channel_names is not None else None
+        if any([type(channel) is str for channel in self.channels]) and channel_names is None:
+            raise ValueError('Channels can only be given by name once the device knows its channel names.')
+        return [list(channel_names).index(channel) if type(channel) is str else channel for channel in self.channels]
+
+    def add(self, page, page_indexes, page_times, start, stop):
+        if self.block_size is None:
+            self._put(page, page_indexes, page_times, start, stop)
+            return
+        if self.pending and self.pending[-1][0] is page and self.pending[-1][2] == start:
+            # Continues the last run.
+            self.pending[-1] = (page, self.pending[-1][1], stop, page_indexes, page_times)
+        else:
+            self.pending.append((page, start, stop, page_indexes, page_times))
+        self.num_pending += stop - start
+        while self.num_pending >= self.block_size:
+            self._put_pending_block()
+
+    def _put_pending_block(self):
+        first_page, first_start, first_stop, first_indexes, first_times = self.pending[0]
+        if first_stop - first_start >= self.block_size:
+            # Held in a single page - hand out a view.
+            self._put(first_page, first_indexes, first_times, first_start, first_start + self.block_size)
+            self._consume(self.block_size)
+            return
+        # Straddles pages.  Gather a copy.
+        pieces = []
+        needed = self.block_size
+        for page, start, stop, page_indexes, page_times in self.pending:
+            take = min(needed, stop - start)
+            pieces.append((page[start:start + take, self.selector], page_indexes[start:start + take],
+                           page_times[start:start + take]))
+            needed -= take
+            if needed == 0:
+                break
+        self._put_arrays(np.concatenate([piece[0] for piece in pieces]),
+                         np.concatenate([piece[1] for piece in pieces]),
+                         np.concatenate([piece[2] for piece in pieces]))
+        self._consume(self.block_size)
+
+    def _consume(self, num_samples):
+        self.num_pending -= num_samples
+        while num_samples > 0:
+            page, start, stop, page_indexes, page_times = self.pending[0]
+            if stop - start > num_samples:
+                self.pending[0] = (page, start + num_samples, stop, page_indexes, page_times)
+                return
+            num_samples -= stop - start
+            self.pending.pop(0)
+
+    def _put(self, page, page_indexes, page_times, start, stop):
+        self._put_arrays(page[start:stop, self.selector], page_indexes[start:stop], page_times[start:stop])
+
+    def _put_arrays(self, data, indexes, times):
+        if self.copy:
+            data, indexes, times = data.copy(), indexes.copy(), times.copy()
+        else:
+            data.flags.writeable = False
+            indexes.flags.writeable = False
+            times.flags.writeable = False
+        if self.include_info:
+            self.queue.put((indexes, times, data))
+        else:
+            self.queue.put(data)
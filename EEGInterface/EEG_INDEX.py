@@ -7,3 +7,6 @@ been an issue for me (in a lot of data collection).
 CURR_EEG_INDEX = 0
 CURR_EEG_INDEX_2 = 0
 EEG_ID_VAL = 0
+# The SampleClock (see SampleClock.py) of the running EEG interface.  Gives the (fractional) sample index of any time,
+# rather than the index of the last packet.
+SAMPLE_CLOCK = None
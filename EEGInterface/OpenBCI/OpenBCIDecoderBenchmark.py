@@ -0,0 +1,124 @@
+"""
+Compares the per byte OpenBCI parser (OpenBCIBoard._read_serial_binary) with the bulk numpy decoder
+(OpenBCIBoard._read_serial_bulk) on the same recorded byte stream.  No board is needed.
+
+To benchmark against a real recording, dump the raw serial bytes to a file and pass it in:
+
+    python OpenBCIDecoderBenchmark.py --stream recorded_stream.bin
+
+Without --stream, a synthetic stream of 250 Hz packets (with a few corrupted bytes sprinkled in) is generated.
+Use --save-stream to keep the generated stream for later runs.
+"""
+
+import argparse
+import struct
+import timeit
+import numpy as np
+import OpenBCIHardwareInterface as BciHwInter
+
+
+class RecordedSerial(object):
+    """
+    Stands in for serial.Serial, handing out a recorded byte stream.  inWaiting reports at most chunk_size bytes,
+    which is roughly how much the port buffer holds between reads on a live board.
+    """
+
+    def __init__(self, stream, chunk_size=330):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.position = 0
+
+    def inWaiting(self):
+        return min(self.chunk_size, len(self.stream) - self.position)
+
+    def read(self, n=1):
+        b = self.stream[self.position:self.position + n]
+        self.position += len(b)
+        return b
+
+
+def make_synthetic_stream(num_packets, corrupt_every=1000, seed=0):
+    """
+    Builds a byte stream of num_packets packets with random channel and aux values.  Every corrupt_every packets
+    a few garbage bytes are inserted so the resync logic gets exercised.
+    """
+    rng = np.random.RandomState(seed)
+    packets = []
+    for packet_index in xrange(num_packets):
+        channels = rng.randint(-2 ** 20, 2 ** 20, size=8)
+        aux = rng.randint(-2 ** 15, 2 ** 15, size=3)
+        packet = struct.pack('BB', BciHwInter.START_BYTE, packet_index % 256)
+        packet += ''.join([struct.pack('>i', int(c))[1:] for c in channels])
+        packet += struct.pack('>3h', *aux)
+        packet += struct.pack('B', BciHwInter.END_BYTE)
+        if corrupt_every and packet_index % corrupt_every == corrupt_every - 1:
+            packet = '\x13\x37' + packet
+        packets.append(packet)
+    return ''.join(packets)
+
+
+def make_offline_board(stream, scaled_output=True):
+    """
+    Creates an OpenBCIBoard without opening a serial port, reading from the recorded stream instead.
+    """
+    board = BciHwInter.OpenBCIBoard.__new__(BciHwInter.OpenBCIBoard)
+    board.ser = RecordedSerial(stream)
+    board.log = False
+    board.read_state = 0
+    board.scaling_output = scaled_output
+    board.eeg_channels_per_sample = 8
+    board.aux_channels_per_sample = 3
+    board.packets_dropped = 0
+    board.packet_decoder = BciHwInter.OpenBCIPacketDecoder(scaled_output=scaled_output)
+    board.warn = lambda text: None
+    return board
+
+
+def run_per_byte(stream):
+    board = make_offline_board(stream)
+    samples = []
+    while board.ser.position < len(stream):
+        sample = board._read_serial_binary()
+        if sample is not None:
+            samples.append(sample)
+    return np.asarray([s.channel_data for s in samples])
+
+
+def run_bulk(stream):
+    board = make_offline_board(stream)
+    blocks = []
+    while board.ser.position < len(stream):
+        packet_ids, channel_data, aux_data = board._read_serial_bulk()
+        blocks.append(channel_data)
+    return np.concatenate(blocks, axis=0)
+
+
+def main(stream, repeats):
+    print "Stream:", len(stream), "bytes (~%d packets)" % (len(stream) // BciHwInter.PACKET_SIZE)
+    per_byte, bulk = run_per_byte(stream), run_bulk(stream)
+    print "Decoded packets - per byte: %d, bulk: %d" % (len(per_byte), len(bulk))
+    if per_byte.shape == bulk.shape:
+        print "Max abs difference (uV):", np.max(np.abs(per_byte - bulk))
+    per_byte_time = min(timeit.repeat(lambda: run_per_byte(stream), number=1, repeat=repeats))
+    bulk_time = min(timeit.repeat(lambda: run_bulk(stream), number=1, repeat=repeats))
+    print "Per byte: %.4f s (%.1f us/packet)" % (per_byte_time, 1e6 * per_byte_time / max(len(per_byte), 1))
+    print "Bulk:     %.4f s (%.1f us/packet)" % (bulk_time, 1e6 * bulk_time / max(len(bulk), 1))
+    print "Speed up: %.1fx" % (per_byte_time / bulk_time)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the OpenBCI packet decoders.')
+    parser.add_argument('--stream', default=None, help='File of raw bytes recorded from the board.')
+    parser.add_argument('--save-stream', default=None, help='Save the synthetic stream to this file.')
+    parser.add_argument('--packets', type=int, default=250 * 60, help='Packets to synthesize (default one minute).')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    if args.stream is not None:
+        with open(args.stream, 'rb') as f:
+            recorded_stream = f.read()
+    else:
+        recorded_stream = make_synthetic_stream(args.packets)
+        if args.save_stream is not None:
+            with open(args.save_stream, 'wb') as f:
+                f.write(recorded_stream)
+    main(recorded_stream, args.repeats)
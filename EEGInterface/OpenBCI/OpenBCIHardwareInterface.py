@@ -49,6 +49,7 @@ ADS1299_Vref = 4.5  # reference voltage for ADC in ADS1299.  set by its hardware
 ADS1299_gain = 24.0  # assumed gain setting for ADS1299.  set by its Arduino code
 scale_fac_uVolts_per_count = ADS1299_Vref / float((pow(2, 23) - 1)) / ADS1299_gain * 1000000.
 scale_fac_accel_G_per_count = 0.002 / (pow(2, 4))  # assume set to +/4G, so 2 mG
+PACKET_SIZE = 33  # Start Byte(1)|Sample ID(1)|Channel Data(24)|Aux Data(6)|End Byte(1)
 '''
 #Commands provided in the SDK http://docs.openbci.com/software/01-Open BCI_SDK:
 
@@ -133,11 +134,16 @@ class OpenBCIBoard(object):
         self.read_state = 0
         self.daisy = daisy
         self.last_odd_sample = OpenBCISample(-1, [], [])  # used for daisy
+        self.last_odd_block = None  # used for daisy in block mode
         self.log_packet_count = 0
         self.attempt_reconnect = False
         self.last_reconnect = 0
         self.reconnect_freq = 5
         self.packets_dropped = 0
+        # Used by _read_serial_bulk. Holds any partial packet between reads.
+        self.packet_decoder = OpenBCIPacketDecoder(eeg_channels_per_sample=self.eeg_channels_per_sample,
+                                                   aux_channels_per_sample=self.aux_channels_per_sample,
+                                                   scaled_output=self.scaling_output)
 
         # Disconnects from board when terminated
         atexit.register(self.disconnect)
@@ -157,7 +163,7 @@ class OpenBCIBoard(object):
     def get_Nb_AUX_channels(self):
         return self.aux_channels_per_sample
 
-    def start_streaming(self, callback, lapse=-1):
+    def start_streaming(self, callback, lapse=-1, block_mode=False):
         """
         Start handling streaming data from the board. Call a provided callback
         for every single sample that is processed (every two samples with daisy module).
@@ -165,6 +171,8 @@ class OpenBCIBoard(object):
         Args:
          callback: A callback function -- or a list of functions -- that will receive a single argument of the
           OpenBCISample object captured.
+         block_mode: If True, the serial port is read in bulk and each callback receives a single OpenBCISampleBlock
+          holding every sample decoded from that read, instead of one OpenBCISample per sample.
         """
         if not self.streaming:
             self.ser.write(b'b')
@@ -181,30 +189,82 @@ class OpenBCIBoard(object):
 
         while self.streaming:
 
-            # read current sample
-            sample = self._read_serial_binary()
-
-            # if a daisy module is attached, wait to concatenate two samples (main board + daisy) before passing it to callback
-            if self.daisy:
-                # odd sample: daisy sample, save for later
-                if ~sample.id % 2:
-                    self.last_odd_sample = sample
-                # even sample: concatenate and send if last sample was the fist part, otherwise drop the packet
-                elif sample.id - 1 == self.last_odd_sample.id:
-                    # the aux data will be the average between the two samples, as the channel samples themselves have been averaged by the board
-                    avg_aux_data = list((np.array(sample.aux_data) + np.array(self.last_odd_sample.aux_data)) / 2)
-                    whole_sample = OpenBCISample(sample.id, sample.channel_data + self.last_odd_sample.channel_data,
-                                                 avg_aux_data)
-                    for call in callback:
-                        call(whole_sample)
+            if block_mode:
+                self._stream_block(callback)
             else:
-                for call in callback:
-                    call(sample)
+                self._stream_sample(callback)
 
             if (lapse > 0 and timeit.default_timer() - start_time > lapse):
                 self.stop()
-            if self.log:
-                self.log_packet_count = self.log_packet_count + 1
+
+    def _stream_sample(self, callback):
+        """
+        Reads a single sample and passes it to each callback.
+        """
+        # read current sample
+        sample = self._read_serial_binary()
+
+        # if a daisy module is attached, wait to concatenate two samples (main board + daisy) before passing it to callback
+        if self.daisy:
+            # odd sample: daisy sample, save for later
+            if ~sample.id % 2:
+                self.last_odd_sample = sample
+            # even sample: concatenate and send if last sample was the fist part, otherwise drop the packet
+            elif sample.id - 1 == self.last_odd_sample.id:
+                # the aux data will be the average between the two samples, as the channel samples themselves have been averaged by the board
+                avg_aux_data = list((np.array(sample.aux_data) + np.array(self.last_odd_sample.aux_data)) / 2)
+                whole_sample = OpenBCISample(sample.id, sample.channel_data + self.last_odd_sample.channel_data,
+                                             avg_aux_data)
+                for call in callback:
+                    call(whole_sample)
+        else:
+            for call in callback:
+                call(sample)
+        if self.log:
+            self.log_packet_count = self.log_packet_count + 1
+
+    def _stream_block(self, callback):
+        """
+        Reads everything waiting on the serial port and passes it to each callback as one OpenBCISampleBlock.
+        Callbacks are not called if the read didn't complete a sample.
+        """
+        packet_ids, channel_data, aux_data = self._read_serial_bulk()
+        # All samples in a read arrived together, so they share the host receive time.
+        timestamps = np.empty(len(packet_ids))
+        timestamps.fill(time.time())
+        block = OpenBCISampleBlock(packet_ids, timestamps, channel_data, aux_data)
+        if self.daisy:
+            block = self._merge_daisy_block(block)
+        if len(block.packet_ids) == 0:
+            return
+        for call in callback:
+            call(block)
+        if self.log:
+            self.log_packet_count = self.log_packet_count + len(block.packet_ids)
+
+    def _merge_daisy_block(self, block):
+        """
+        Block version of the daisy handling in _stream_sample.  Even packet ids hold the daisy half of a sample and
+        are paired with the odd packet id that follows them.  Unpaired packets are dropped, and a trailing even
+        packet is held over until the next block.
+        """
+        if self.last_odd_block is not None:
+            block = OpenBCISampleBlock(np.concatenate((self.last_odd_block.packet_ids, block.packet_ids)),
+                                       np.concatenate((self.last_odd_block.timestamps, block.timestamps)),
+                                       np.concatenate((self.last_odd_block.channel_data, block.channel_data)),
+                                       np.concatenate((self.last_odd_block.aux_data, block.aux_data)))
+            self.last_odd_block = None
+        if len(block.packet_ids) == 0:
+            return block
+        ids = block.packet_ids
+        # Index of the odd (second) packet of every complete pair.
+        pairs = np.flatnonzero((ids[1:] % 2 == 1) & (ids[1:] - 1 == ids[:-1])) + 1
+        if ids[-1] % 2 == 0:
+            self.last_odd_block = OpenBCISampleBlock(ids[-1:], block.timestamps[-1:], block.channel_data[-1:],
+                                                     block.aux_data[-1:])
+        return OpenBCISampleBlock(ids[pairs], block.timestamps[pairs],
+                                  np.hstack((block.channel_data[pairs], block.channel_data[pairs - 1])),
+                                  (block.aux_data[pairs] + block.aux_data[pairs - 1]) / 2)
 
     """
     PARSER:
@@ -301,6 +361,27 @@ class OpenBCIBoard(object):
                     logging.debug(log_bytes_in)
                     self.packets_dropped = self.packets_dropped + 1
 
+    def _read_serial_bulk(self):
+        """
+        Bulk alternative to _read_serial_binary.  Reads everything currently waiting in the serial port buffer
+        (blocking for at least one byte) and decodes all complete packets at once with the packet_decoder.
+        Partial packets are held by the decoder and completed on the next read.
+
+        :return: (packet_ids, channel_data, aux_data) as numpy arrays of shape (n,), (n, eeg channels)
+                 and (n, aux channels).  n may be 0 if no complete packet has arrived yet.
+        """
+        b = self.ser.read(max(self.ser.inWaiting(), 1))
+        if not b:
+            self.warn('Device appears to be stalled. Quitting...')
+            raise Exception('Device Stalled')
+        packet_ids, channel_data, aux_data = self.packet_decoder.decode(b)
+        if self.packet_decoder.bytes_skipped:
+            self.warn('Skipped %d bytes before start found' % self.packet_decoder.bytes_skipped)
+            self.packets_dropped += self.packet_decoder.bytes_skipped // PACKET_SIZE + 1
+        elif len(packet_ids) > 0:
+            self.packets_dropped = 0
+        return packet_ids, channel_data, aux_data
+
     """
 
     Clean Up (atexit)
@@ -569,6 +650,115 @@ class OpenBCISample(object):
         self.aux_data = aux_data
 
 
+class OpenBCISampleBlock(object):
+    """
+    Object encapsulating every sample decoded from a single read of the OpenBCI board (see block_mode in
+    OpenBCIBoard.start_streaming).
+    """
+
+    def __init__(self, packet_ids, timestamps, channel_data, aux_data):
+        """
+        :param packet_ids: np array of shape (sample,) - packet ids (0-255)
+        :param timestamps: np array of shape (sample,) - host time (time.time()) the samples were read
+        :param channel_data: np array of shape (sample, channel)
+        :param aux_data: np array of shape (sample, aux channel)
+        """
+        self.packet_ids = packet_ids
+        self.timestamps = timestamps
+        self.channel_data = channel_data
+        self.aux_data = aux_data
+
+
+class OpenBCIPacketDecoder(object):
+    """
+    Decodes a raw OpenBCI byte stream into numpy arrays, many packets at a time.
+
+    Packets are found by their framing (a START_BYTE followed PACKET_SIZE - 1 bytes later by an END_BYTE), so the
+    decoder resyncs by itself after dropped or corrupt bytes.  Bytes that can't be part of a packet are counted in
+    bytes_skipped.  Any trailing partial packet is kept and prepended to the next call to decode.
+    """
+
+    def __init__(self, eeg_channels_per_sample=8, aux_channels_per_sample=3, scaled_output=True):
+        """
+        :param eeg_channels_per_sample: Number of 3 byte channel values in each packet (8 for the V3 board).
+        :param aux_channels_per_sample: Number of 2 byte aux values in each packet (3 for the V3 board).
+        :param scaled_output: If True, channel data is returned in uV and aux data in G (float64).  Otherwise the raw
+                              counts are returned (int32).
+        """
+        if 2 + 3 * eeg_channels_per_sample + 2 * aux_channels_per_sample + 1 != PACKET_SIZE:
+            raise ValueError('Channel counts do not fit in a %d byte packet' % PACKET_SIZE)
+        self.eeg_channels_per_sample = eeg_channels_per_sample
+        self.aux_channels_per_sample = aux_channels_per_sample
+        self.scaled_output = scaled_output
+        self.remainder = b''
+        # Bytes thrown away during the last call to decode.
+        self.bytes_skipped = 0
+        self._packet_offsets = np.arange(PACKET_SIZE)
+
+    def decode(self, raw):
+        """
+        Decodes all complete packets in the remainder of the last call plus raw.
+
+        :param raw: str of bytes read from the board.
+        :return: (packet_ids, channel_data, aux_data) - numpy arrays of shape (n,), (n, eeg channels) and (n, aux channels)
+        """
+        buf = np.frombuffer(self.remainder + raw, dtype=np.uint8)
+        num_bytes = len(buf)
+        starts = np.empty(0, dtype=np.intp)
+        if num_bytes >= PACKET_SIZE:
+            starts = np.flatnonzero((buf[:num_bytes - PACKET_SIZE + 1] == START_BYTE) &
+                                    (buf[PACKET_SIZE - 1:] == END_BYTE))
+            if len(starts) > 1 and np.any(np.diff(starts) < PACKET_SIZE):
+                starts = self._remove_overlapping_starts(starts)
+        # Everything up to the end of the last packet has been used.  Of the rest, keep at most one partial packet.
+        consumed = starts[-1] + PACKET_SIZE if len(starts) > 0 else 0
+        keep_from = max(consumed, num_bytes - PACKET_SIZE + 1)
+        self.bytes_skipped = keep_from - len(starts) * PACKET_SIZE
+        self.remainder = buf[keep_from:].tostring()
+
+        packets = buf[starts[:, np.newaxis] + self._packet_offsets]
+        packet_ids = packets[:, 1].astype(np.int32)
+        return packet_ids, self._decode_channel_data(packets), self._decode_aux_data(packets)
+
+    @staticmethod
+    def _remove_overlapping_starts(starts):
+        """
+        Only reached after corrupt bytes happen to frame a fake packet.  Greedily keeps the first start and every
+        start that doesn't overlap the previously kept packet, the same way the byte by byte parser would.
+        """
+        kept = []
+        next_free = -1
+        for start in starts:
+            if start >= next_free:
+                kept.append(start)
+                next_free = start + PACKET_SIZE
+        return np.asarray(kept, dtype=np.intp)
+
+    def _decode_channel_data(self, packets):
+        """
+        24 bit big endian two's complement channel values -> int32 counts (or uV if scaled_output)
+        """
+        num_channel_bytes = 3 * self.eeg_channels_per_sample
+        channel_bytes = packets[:, 2:2 + num_channel_bytes].reshape(-1, self.eeg_channels_per_sample, 3).astype(np.int32)
+        counts = (channel_bytes[:, :, 0] << 16) | (channel_bytes[:, :, 1] << 8) | channel_bytes[:, :, 2]
+        # Sign extend from 24 bits.
+        counts = (counts ^ 0x800000) - 0x800000
+        if self.scaled_output:
+            return counts * scale_fac_uVolts_per_count
+        return counts
+
+    def _decode_aux_data(self, packets):
+        """
+        16 bit big endian signed aux values -> int32 counts (or G if scaled_output)
+        """
+        aux_start = 2 + 3 * self.eeg_channels_per_sample
+        aux_bytes = np.ascontiguousarray(packets[:, aux_start:aux_start + 2 * self.aux_channels_per_sample])
+        counts = aux_bytes.view('>i2').astype(np.int32)
+        if self.scaled_output:
+            return counts * scale_fac_accel_G_per_count
+        return counts
+
+
 def print_data(sample):
     """
     Prints the sample's (an OpenBCI Sample object) channel data to console
@@ -1,15 +1,16 @@
 import OpenBCIHardwareInterface as BciHwInter
-import CCDLUtil.EEGInterface.EEG_INDEX
 import CCDLUtil.EEGInterface.EEGInterface
 from CCDLUtil.Utility.Decorators import threaded
 import time
+import numpy as np
 
 
 class OpenBCIStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
 
     def __init__(self, channels_for_live='All', channels_for_save='All', live=True, save_data=True,
                  include_aux_in_save_file=True, subject_name=None, subject_tracking_number=None, experiment_number=None,
-                 channel_names=None, port=None, baud=115200):
+                 channel_names=None, port=None, baud=115200, block_mode=False, live_queue_maxsize=0,
+                 save_queue_maxsize=0):
         """
         Inherits from CCDLUtil.EEGInterface.EEGInterfaceParent.EEGInterfaceParent
 
@@ -27,11 +28,20 @@ class OpenBCIStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
         :param subject_name: Optional -- Name of the subject. Defaults to 'None'
         :param subject_tracking_number: Optional -- Subject Tracking Number (AKA TMS group experiment number tracker). Defaults to 'None'
         :param experiment_number: Optional -- Experimental number. Defaults to 'None'
+        :param block_mode: If True, the board is read in bulk and each read is handled as one block (see callback_fn_block).
+                           Items put on the out_buffer_queue are then np arrays of shape (sample, channel) and items
+                           put on the data_save_queue are (packet id array, timestamp array, data array).
+                           Defaults to False.
+        :param live_queue_maxsize: Most items the out_buffer_queue holds.  When full, the oldest item is dropped.
+                                   If 0, it is unbounded.  Defaults to 0.
+        :param save_queue_maxsize: Most items the data_save_queue holds.  When full, blocks are joined onto the newest
+                                   item (nothing is lost).  If 0, it is unbounded.  Defaults to 0.
         """
 
         super(OpenBCIStreamer, self).__init__(
             channels_for_live=channels_for_live, live=live, save_data=save_data, subject_name=subject_name,
-            subject_tracking_number=subject_tracking_number, experiment_number=experiment_number)
+            subject_tracking_number=subject_tracking_number, experiment_number=experiment_number,
+            live_queue_maxsize=live_queue_maxsize, save_queue_maxsize=save_queue_maxsize)
         # in super, self.data_index is set to 0
         self.channel_names = str(channel_names)
         self.channels_for_save = channels_for_save
@@ -42,6 +52,22 @@ class OpenBCIStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
             raise ValueError("port cannot be None!")
         self.port = port
         self.baud = baud
+        self.block_mode = block_mode
+        self.recording_info.update({'fs': BciHwInter.SAMPLE_RATE, 'channel_names': channel_names})
+        # Channel indexes for trimming blocks.  None means the channels aren't used.
+        self.live_channel_selector = self.get_block_channel_selector(self.channels_for_live)
+        self.save_channel_selector = self.get_block_channel_selector(self.channels_for_save)
+
+    @staticmethod
+    def get_block_channel_selector(channels):
+        """
+        Validates channels_for_live or channels_for_save and converts it to an index for the channel axis of a block.
+        """
+        if channels is None:
+            return None
+        if type(channels) is str and channels.lower() == 'all' or type(channels) is list:
+            return OpenBCIStreamer.channel_index_selector(channels)
+        raise ValueError('Invalid channel list: %s' % str(channels))
 
     def callback_fn(self, data_packet):
         """
@@ -99,10 +125,35 @@ class OpenBCIStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
                 # Data put on the data save queue is a len three tuple.
                 self.data_save_queue.put((None, None, data_str + '\n'))
 
-        # Set our two EEG INDEX parameters.
-        CCDLUtil.EEGInterface.EEG_INDEX.CURR_EEG_INDEX = self.data_index
-        CCDLUtil.EEGInterface.EEG_INDEX.CURR_EEG_INDEX_2 = self.data_index
-        CCDLUtil.EEGInterface.EEG_INDEX.EEG_ID_VAL = id_val
+        # Set our two EEG INDEX parameters and tell our clock.
+        self.mark_samples(1, id_val=id_val)
+
+    def callback_fn_block(self, block):
+        """
+        Block mode callback from our OpenBCI board.  Handles every sample in the block at once, putting a single item
+        on each queue.
+
+        :param block: An OpenBCISampleBlock.
+        """
+        # Our data is always indexed >= 0, so the samples in this block get data_index + 1 ... data_index + n.
+        self.data_index += len(block.packet_ids)
+
+        # Put on Out Buffer for live data analysis.  Shape (sample, channel).
+        if self.live and self.live_channel_selector is not None:
+            self.out_buffer_queue.put(block.channel_data[:, self.live_channel_selector])
+
+        # Save data
+        if self.save_data and self.save_channel_selector is not None:
+            data_to_put_on_queue = block.channel_data[:, self.save_channel_selector]
+            if self.include_aux_in_save_file:
+                data_to_put_on_queue = np.hstack((data_to_put_on_queue, block.aux_data))
+            self.data_save_queue.put((block.packet_ids, block.timestamps, data_to_put_on_queue))
+
+        # Hand the block to anyone else subscribed (see EEGInterfaceParent.subscribe).
+        self.publish(block.packet_ids, block.timestamps, block.channel_data)
+
+        # Set our two EEG INDEX parameters and tell our clock.
+        self.mark_samples(len(block.packet_ids), block.timestamps[-1], id_val=block.packet_ids[-1])
 
     @threaded(False)
     def start_recording(self):
@@ -112,7 +163,10 @@ class OpenBCIStreamer(CCDLUtil.EEGInterface.EEGInterface.EEGInterfaceParent):
 
         board = BciHwInter.OpenBCIBoard(port=self.port, baud=self.baud, scaled_output=False, log=True)
         print 'start recording'
-        board.start_streaming(self.callback_fn)
+        if self.block_mode:
+            board.start_streaming(self.callback_fn_block, block_mode=True)
+        else:
+            board.start_streaming(self.callback_fn)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,157 @@
+"""
+Maps between host time (time.time()) and the sample index of a recording, for marking events.
+
+The EEG_INDEX globals (and eeg.data_index) only move when a packet arrives (every 10 samples for the BrainAmp), and
+the time a packet arrives jitters with the network and the operating system.  A SampleClock is told the host time
+each block of samples arrives (see EEGInterfaceParent.mark_samples) and fits a line of sample index against host time,
+with older blocks forgotten over time_constant seconds.  The fit averages out arrival jitter and follows drift between
+the amplifier's and the computer's clocks, and gives a fractional sample index for any time, not just packet times:
+
+    event_sample = eeg.clock.get_sample_index()           # the sample being acquired now
+    event_sample = eeg.clock.get_sample_index(event_time)
+    event_time = eeg.clock.get_time(sample_index)
+
+Sample indexes count the samples (rows) published by the interface from 0, so they index the saved recording.
+
+The fit is kept in shared memory and read without locks (a writer bumps a version number before and after each
+update, and readers retry if it changed), so any thread, or any process the clock is passed to (as a Process
+argument), can read it in constant time while the acquisition thread keeps writing.
+"""
+
+import math
+import time
+import ctypes
+import multiprocessing
+
+# Positions in the shared parameter array.
+_VERSION, _T_REF, _N_REF, _SLOPE, _LATEST_N, _LATEST_T, _NUM_BLOCKS = range(7)
+_NUM_PARAMS = 7
+
+
+class SampleClock(object):
+
+    def __init__(self, fs=None, time_constant=30.0, latency=0.0, min_fit_seconds=1.0):
+        """
+        :param fs: Optional -- Nominal sampling rate of the published samples.  Used until min_fit_seconds of blocks
+                   have arrived.  If None, the clock can only give the latest index until then.  Defaults to None.
+        :param time_constant: Seconds over which old blocks are forgotten.  Longer averages out more jitter, shorter
+                              follows clock drift faster.  Defaults to 30.
+        :param latency: Seconds between a sample being acquired and its block arriving (if known).  Times given to and
+                        returned by the clock are acquisition times.  Defaults to 0.
+        :param min_fit_seconds: Seconds of blocks needed before the fitted rate is used.  Defaults to 1.
+        """
+        self.fs = fs
+        self.time_constant = time_constant
+        self.latency = latency
+        self.min_fit_seconds = min_fit_seconds
+        self._params = multiprocessing.RawArray(ctypes.c_double, _NUM_PARAMS)
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets all blocks.  Only the writing thread should call this.
+        """
+        # Writer only state (not shared).
+        self.num_samples = 0
+        self.first_time = None
+        self.weight_sum = 0.0
+        self.mean_t, self.mean_n, self.var_t, self.cov_tn = 0.0, 0.0, 0.0, 0.0
+        self.last_time = None
+        self._publish(0.0, -1.0, 0.0 if self.fs is None else float(self.fs), -1.0, 0.0, 0)
+
+    def add_block(self, num_samples, host_time=None):
+        """
+        Records the arrival of a block of samples.  Called by the acquisition thread only.
+
+        :param num_samples: Number of samples in the block.
+        :param host_time: time.time() the block arrived.  Defaults to now.
+        :return: Sample index of the last sample in the block.
+        """
+        host_time = time.time() if host_time is None else host_time
+        self.num_samples += num_samples
+        last_n = float(self.num_samples - 1)
+        # The last sample of the block was acquired latency seconds before the block arrived.
+        t = host_time - self.latency
+        if self.first_time is None:
+            self.first_time = t
+        # Exponentially weighted means and (co)variance of (time, index).  Time is kept relative to the first block so
+        # squares stay small.
+        t_rel = t - self.first_time
+        decay = 1.0 if self.last_time is None else math.exp(-max(t - self.last_time, 0.0) / self.time_constant)
+        self.last_time = t
+        self.weight_sum = decay * self.weight_sum + 1.0
+        a = 1.0 / self.weight_sum
+        dt, dn = t_rel - self.mean_t, last_n - self.mean_n
+        self.mean_t += a * dt
+        self.mean_n += a * dn
+        self.var_t = (1.0 - a) * (self.var_t + a * dt * dt)
+        self.cov_tn = (1.0 - a) * (self.cov_tn + a * dt * dn)
+
+        if t - self.first_time >= self.min_fit_seconds and self.var_t > 0 and self.cov_tn > 0:
+            slope = self.cov_tn / self.var_t
+            self._publish(self.first_time + self.mean_t, self.mean_n, slope, last_n, t, self._params[_NUM_BLOCKS] + 1)
+        elif self.fs is not None:
+            # Not enough blocks to fit yet.  Go from the latest block at the nominal rate.
+            self._publish(t, last_n, float(self.fs), last_n, t, self._params[_NUM_BLOCKS] + 1)
+        else:
+            self._publish(t, last_n, 0.0, last_n, t, self._params[_NUM_BLOCKS] + 1)
+        return int(last_n)
+
+    def _publish(self, t_ref, n_ref, slope, latest_n, latest_t, num_blocks):
+        params = self._params
+        version = params[_VERSION]
+        # An odd version tells readers an update is under way.
+        params[_VERSION] = version + 1
+        params[_T_REF], params[_N_REF], params[_SLOPE] = t_ref, n_ref, slope
+        params[_LATEST_N], params[_LATEST_T], params[_NUM_BLOCKS] = latest_n, latest_t, num_blocks
+        params[_VERSION] = version + 2
+
+    def _read(self):
+        params = self._params
+        while True:
+            values = params[:]
+            if values[_VERSION] % 2 == 0 and params[_VERSION] == values[_VERSION]:
+                return values
+
+    def get_sample_index(self, t=None):
+        """
+        Sample index acquired at host time t, from the fit.  Fractional, and t may be between (or after) blocks.
+
+        :param t: time.time() value.  Defaults to now.
+        :return: float sample index, or -1 if no samples have arrived.
+        """
+        values = self._read()
+        if values[_NUM_BLOCKS] == 0:
+            return -1.0
+        if values[_SLOPE] == 0:
+            return values[_LATEST_N]
+        t = time.time() if t is None else t
+        return values[_N_REF] + values[_SLOPE] * (t - values[_T_REF])
+
+    def get_time(self, n):
+        """
+        Host time (time.time()) sample n was acquired, from the fit.
+
+        :param n: Sample index (may be fractional).
+        :return: float time, or None if the rate is not yet known.
+        """
+        values = self._read()
+        if values[_NUM_BLOCKS] == 0 or values[_SLOPE] == 0:
+            return None
+        return values[_T_REF] + (n - values[_N_REF]) / values[_SLOPE]
+
+    def get_fs(self):
+        """
+        Sampling rate (samples per host second) from the fit, or the nominal fs before there is one.  None if unknown.
+        """
+        slope = self._read()[_SLOPE]
+        return slope if slope > 0 else None
+
+    def get_latest(self):
+        """
+        :return: (index of the last sample received, time its block arrived less latency), or (-1, None) if none have.
+        """
+        values = self._read()
+        if values[_NUM_BLOCKS] == 0:
+            return -1, None
+        return int(values[_LATEST_N]), values[_LATEST_T]
@@ -6,9 +6,7 @@ import Queue
 import threading
 import CCDLUtil.EEGInterface.DataSaver
 import numpy as np
-import CCDLUtil.EEGInterface.EEG_INDEX
 import CCDLUtil.EEGInterface.EEGInterface as CCDLEEGParent
-import CCDLUtil.DataManagement.DataParser as CCDLDataParser
 import pylsl
 
 
@@ -23,8 +21,8 @@ class GUSBAmpStreamer(CCDLEEGParent.EEGInterfaceParent):
         For live data streaming, use with a threading or multiprocessing queue (ie. Queue.queue()
            Data will be put on the queue, which can be read by another thread.)
 
-        Modifies the EEG_INDEX and EEG_INDEX_2 in CCDLUtil/EEGInterface/EEG_INDEX.py when each packet arrives.  These variables can be read from any thread.
-            Use this to time mark events in your other programs.
+        Modifies the CURR_EEG_INDEX and CURR_EEG_INDEX_2 in CCDLUtil/EEGInterface/EEG_INDEX.py when each packet arrives.  These variables can be read from any thread.
+            To time mark events in your other programs, use self.clock (see SampleClock.py).
 
         :param channels_for_live: List of channel names (or indexes) to put on the out_buffer_queue. If [] or None, no channels will be put on the out_buffer_queue.
                                   If 'All', all channels will be placed on the out_buffer_queue.
@@ -47,8 +45,11 @@ class GUSBAmpStreamer(CCDLEEGParent.EEGInterfaceParent):
         elif misc_queue_list is not None and len(misc_queue_list) != len(misc_queue_list_channels):
             raise ValueError('Misc_queue_list and misc_queue_list_channels must be the same length')
         self.misc_queue_list, self.misc_queue_list_channels = misc_queue_list, misc_queue_list_channels
-        self.zipped_misc_queue_and_channel_list = zip(self.misc_queue_list, self.misc_queue_list_channels)
         self.samples_to_save = samples_to_save
+        # Each misc queue is a subscriber, getting blocks of samples_to_save samples of its channels.
+        if misc_queue_list is not None:
+            for misc_queue, wanted_misc_channels in zip(misc_queue_list, misc_queue_list_channels):
+                self.subscribe(channels=wanted_misc_channels, block_size=samples_to_save, queue=misc_queue)
 
         # first resolve an EEG stream on the lab network
         print "looking for an EEG stream..."
@@ -66,26 +67,18 @@ class GUSBAmpStreamer(CCDLEEGParent.EEGInterfaceParent):
         """
         print "Starting recording..."
 
-        # samples to save counter
-        counter = 0
-
-        misc_queue_buffer = None
-
         # ##### Main Loop #### #
         while True:
             sample, timestamp = self.inlet.pull_sample()
+            # LSL timestamps are on the LSL clock.  Our clock works in time.time().
+            receive_time = time.time()
             if self.current_index == 0:
                 print "Receiving Data:", sample
 
 
             # Get the time we collected the sample
             self.data_index += 1  # Increase our sample counter
-
-            CCDLUtil.EEGInterface.EEG_INDEX.EEG_INDEX = self.data_index
-            CCDLUtil.EEGInterface.EEG_INDEX.EEG_INDEX_2 = self.data_index
             self.current_index = self.data_index
-            counter += 1
-            # print self.data_index, CCDLUtil.EEGInterface.EEG_INDEX.EEG_INDEX
             ###################
             # Handle the Data #
             ###################
@@ -103,21 +96,9 @@ class GUSBAmpStreamer(CCDLEEGParent.EEGInterfaceParent):
                 self.out_buffer_queue.put(trimmed_data_for_out_queue)
 
 
-            ''' Take care of putting data on our misc queues. '''
-            for misc_queue, wanted_misc_channels in self.zipped_misc_queue_and_channel_list:
-                if wanted_misc_channels.lower().strip() == 'all':
-                    trimmed_data_for_out_queue = np.asarray(sample)
-                else:
-                    trimmed_data_for_out_queue = np.asarray([sample[index] for index in wanted_misc_channels])
-
-                trimmed_data_for_out_queue = np.expand_dims(trimmed_data_for_out_queue, axis=0)
-                assert len(trimmed_data_for_out_queue.shape) == 2
-                misc_queue_buffer = CCDLDataParser.stack_epochs(existing=misc_queue_buffer, new_trial=trimmed_data_for_out_queue, axis=0)
-                # when we save up enough samples, send them to out queue
-                if counter >= self.samples_to_save:
-                    print 'misc shape', misc_queue_buffer.shape
-                    misc_queue.put(misc_queue_buffer)
-                    counter = 0
+            # Hand the sample to our subscribers (the misc queues).
+            self.publish(self.data_index, timestamp, np.asarray(sample)[np.newaxis, :])
+            self.mark_samples(1, receive_time)
 
 
 if __name__ == '__main__':
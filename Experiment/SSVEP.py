@@ -15,6 +15,9 @@ ROTATE = 'rotate'
 DONT_ROTATE = 'dont_rotate'
 EEG_COLLECT_TIME_SECONDS = 30
 WINDOW_SIZE_SECONDS = 2
+# Spectral estimators for trial_logic
+WELCH_ESTIMATOR = 'welch'
+BIN_POWER_ESTIMATOR = 'bin_power'
 EEG = Constants.EEGSystemNames.BRAIN_AMP
 
 
@@ -45,7 +48,7 @@ def initialize_graphics(width=1920, height=1080):
 
 
 def trial_logic(eeg_system, out_buffer_queue, cursor_task, fs, high_freq, low_freq, prompt, window_width,
-                sleep_time_if_not_ran=2):
+                sleep_time_if_not_ran=2, decision_interval_packets=None, estimator=WELCH_ESTIMATOR):
     """Run a full trial of SSVEP experiment.
 
     :param eeg_system: Used EEG system (or None)
@@ -57,6 +60,21 @@ def trial_logic(eeg_system, out_buffer_queue, cursor_task, fs, high_freq, low_fr
     :param prompt: the prompt sentence to show on SSVEP screen
     :param window_width: the pixel width of the window
     :param sleep_time_if_not_ran: time to sleep if eeg_system == None
+    :param decision_interval_packets: Number of packets between decisions (cursor moves), once the first window has
+                                      been collected.  The power at each frequency is always taken over the last
+                                      WINDOW_SIZE_SECONDS, and the cursor is moved in proportion to the interval, so it
+                                      travels at the same speed whatever the interval.  If 1, a decision is made with
+                                      every packet.  Defaults to None (one decision per window).
+    :param estimator: How the power at each frequency is estimated over the window.
+                      'welch' - Welch's method (nperseg=fs, noverlap=fs // 2, so 1 Hz bins) with
+                                Fourier.IncrementalWelch, which only computes the FFT of each new segment.  The
+                                estimate is updated every half second, so decisions between segment boundaries use
+                                the window ending at the last one.
+                      'bin_power' - A single hann windowed periodogram of the whole window at just our two
+                                    frequencies (Fourier.SlidingBinPower), updated with every packet.  Cheaper, and
+                                    current with every packet, but with more variance (and narrower bins) than Welch,
+                                    so decisions will differ.
+                      Defaults to 'welch' (the same decisions as computing the Welch spectrum of each window).
     :return: the answer, stop early or late
     """
     # start graphics
@@ -115,33 +133,40 @@ def trial_logic(eeg_system, out_buffer_queue, cursor_task, fs, high_freq, low_fr
         window_size_samples = WINDOW_SIZE_SECONDS * fs
         window_size_packets = window_size_samples / samples_per_packet
 
-        # b is the np array to hold all data in single trial
-        b = np.zeros(shape=(single_trial_duration_samples,))
+        if decision_interval_packets is None:
+            decision_interval_packets = window_size_packets
+        step = max(1, int(round(STEP * decision_interval_packets / float(window_size_packets))))
+
+        # Power at our two frequencies over the last window, updated as packets arrive (rather than recomputing the
+        # spectrum of the whole window each time we decide).
+        if estimator == WELCH_ESTIMATOR:
+            spectrum = Fourier.IncrementalWelch(fs=fs, nperseg=fs, noverlap=fs // 2, window_size=window_size_samples)
+            freq_bins = [int(round(freq * spectrum.nperseg / float(fs))) for freq in (high_freq, low_freq)]
+        elif estimator == BIN_POWER_ESTIMATOR:
+            spectrum = Fourier.SlidingBinPower(fs=fs, freqs=[high_freq, low_freq], window_size=window_size_samples)
+        else:
+            raise ValueError('Invalid estimator: %s' % str(estimator))
         packet_index = 0
         while packet_index < single_trial_duration_packets:
             # insert the visualizer here
             packet = out_buffer_queue.get()  # Gives us a (10, 1) matrix.
             # print "received packet: ", packet
-            # get the sample
-            samples = np.squeeze(packet)      # Gives us a (10,) array
-            sample_index = packet_index * samples_per_packet
-            b[sample_index: sample_index + samples_per_packet] = samples
+            # We only use the first channel.
+            spectrum.add(np.reshape(packet, (samples_per_packet, -1))[:, :1])
             packet_index += 1
-            # if we have enough samples, perform FFT on a single window
-            if packet_index != 0 and packet_index % window_size_packets == 0:
-                # print "packet index: ", packet_index, ", do FFT"
-                window = b[packet_index * samples_per_packet - window_size_samples:packet_index * samples_per_packet]
-                # perform FFT
-                freq, density = Fourier.get_fft_all_channels(data=np.expand_dims(np.expand_dims(window, axis=0), axis=2),
-                                                             fs=fs, noverlap=fs // 2, nperseg=fs)
+            # once we have a full window, decide every decision_interval_packets packets
+            if spectrum.is_ready() and packet_index % decision_interval_packets == 0:
+                if estimator == WELCH_ESTIMATOR:
+                    high_power, low_power = spectrum.get_density()[1][freq_bins, 0]
+                else:
+                    high_power, low_power = spectrum.get_power()[:, 0]
                 # compare densities of 17Hz and 15Hz frequencies
-                # print density.shape
-                if density[0][high_freq][0] <= density[0][low_freq][0]:
-                    cursor_x += STEP
-                    cursor_task.move_cursor_delta_x(STEP)
+                if high_power <= low_power:
+                    cursor_x += step
+                    cursor_task.move_cursor_delta_x(step)
                 else:
-                    cursor_x -= STEP
-                    cursor_task.move_cursor_delta_x(-STEP)
+                    cursor_x -= step
+                    cursor_task.move_cursor_delta_x(-step)
                 # if we reach left boundary
                 if cursor_x - CURSOR_RADIUS <= boundary_left:
                     cursor_task.collide_left()
@@ -0,0 +1,118 @@
+"""
+Runs StaticClassification.main over many sessions at once, in a pool of processes.
+
+Sessions are the subject folders created by FileParser.manage_storage (Subject<id>__timestamp_<time>/), each holding
+a Subject<id>_log.txt and a Subject<id>_eeg recording (csv or binary).  Each worker is only sent the paths of its
+session and sends back a small row of results, so the recordings themselves are never pickled between processes.
+With the parse cache on (the default), workers memory map the parsed recordings from the cache (see ParseCache.py),
+so re-runs skip the parsing and sessions do not each hold a private copy of their recording.
+
+A session that raises is recorded as failed (with its traceback) and the rest carry on.  Workers are replaced after
+every session, so memory from one session is never held while running the next.
+
+    rows = run_batch(data_storage_location, channel_list=..., channel_dict=..., labels=..., relevant_indexes=...,
+                     feature_type=...)
+    save_summary(rows, 'summary.csv')
+"""
+
+import os
+import csv
+import time
+import traceback
+import multiprocessing
+import CCDLUtil.Experiment.Static.StaticClassification as CCDLStaticClassification
+
+SUMMARY_COLUMNS = ['session', 'status', 'cv_score', 'num_epochs', 'seconds', 'extract_seconds', 'epoch_seconds',
+                   'feature_seconds', 'cv_seconds', 'log_file_path', 'eeg_file_path', 'error']
+
+
+def find_sessions(data_storage_location):
+    """
+    Finds the session folders (those holding a *_log.txt file and a *_eeg.* recording) in data_storage_location.
+
+    :param data_storage_location: The data folder passed to FileParser.manage_storage.
+    :return: List of (session folder name, log file path, eeg file path), sorted by folder name.
+    """
+    sessions = []
+    for session_name in sorted(os.listdir(data_storage_location)):
+        session_path = os.path.join(data_storage_location, session_name)
+        if not os.path.isdir(session_path):
+            continue
+        file_names = sorted(os.listdir(session_path))
+        log_file_names = [file_name for file_name in file_names if file_name.endswith('_log.txt')]
+        eeg_file_names = [file_name for file_name in file_names if '_eeg.' in file_name]
+        if log_file_names and eeg_file_names:
+            sessions.append((session_name, os.path.join(session_path, log_file_names[0]),
+                             os.path.join(session_path, eeg_file_names[0])))
+    return sessions
+
+
+def run_batch(data_storage_location, num_processes=None, verbose=True, **main_kwargs):
+    """
+    Runs StaticClassification.main on every session in data_storage_location.
+
+    :param data_storage_location: The data folder passed to FileParser.manage_storage.
+    :param num_processes: Number of sessions to run at once.  If None, one per cpu.  If 1, sessions are run one after
+                          another in this process.  Defaults to None.
+    :param verbose: If True, prints each session's result as it completes.
+    :param main_kwargs: Passed to StaticClassification.main for every session (eeg_type, channel_list, channel_dict,
+                        labels, relevant_indexes, feature_type...).
+    :return: List of summary rows (dictionaries with the keys in SUMMARY_COLUMNS), in session order.
+    """
+    jobs = [(session, main_kwargs) for session in find_sessions(data_storage_location)]
+    if num_processes is None:
+        num_processes = multiprocessing.cpu_count()
+    if num_processes > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(num_processes, len(jobs)), maxtasksperchild=1)
+        try:
+            results = pool.imap_unordered(run_session, jobs)
+            rows = [_report(row, verbose) for row in results]
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        rows = [_report(run_session(job), verbose) for job in jobs]
+    session_order = dict([(job[0][0], job_index) for job_index, job in enumerate(jobs)])
+    return sorted(rows, key=lambda row: session_order[row['session']])
+
+
+def run_session(job):
+    """
+    Runs StaticClassification.main on one session, catching any error.  Top level so it can be sent to a pool.
+
+    :param job: ((session name, log file path, eeg file path), main_kwargs)
+    :return: Summary row (see SUMMARY_COLUMNS).
+    """
+    (session_name, log_file_path, eeg_file_path), main_kwargs = job
+    row = dict([(column, None) for column in SUMMARY_COLUMNS])
+    row.update({'session': session_name, 'log_file_path': log_file_path, 'eeg_file_path': eeg_file_path})
+    start_time = time.time()
+    try:
+        result = CCDLStaticClassification.main(log_file_path=log_file_path, eeg_file_path=eeg_file_path, **main_kwargs)
+        result.pop('classifier', None)
+        row.update(result)
+        row['status'] = 'ok'
+    except Exception:
+        row['status'] = 'failed'
+        row['error'] = traceback.format_exc()
+    row['seconds'] = time.time() - start_time
+    return row
+
+
+def save_summary(rows, summary_file_path):
+    """
+    Saves summary rows (from run_batch) as a csv file, one line per session.
+    """
+    with open(summary_file_path, 'wb') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def _report(row, verbose):
+    if verbose:
+        if row['status'] == 'ok':
+            print "%s\tcv score %.3f\t%.1f s" % (row['session'], row['cv_score'], row['seconds'])
+        else:
+            print "%s\tFAILED after %.1f s: %s" % (row['session'], row['seconds'], row['error'].strip().split('\n')[-1])
+    return row
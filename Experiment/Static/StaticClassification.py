@@ -1,3 +1,4 @@
+import time
 import numpy as np
 import CCDLUtil.ML.CrossValidation as CCDLCV
 import CCDLUtil.DataManagement.Log as CCDLLog
@@ -7,6 +8,8 @@ import CCDLUtil.Graphics.PyCrosshair as CCDLPyCross
 import CCDLUtil.SignalProcessing.Fourier as CCDLFourier
 import CCDLUtil.DataManagement.DataParser as CCDLDataParser
 import CCDLUtil.DataManagement.FileParser as CCDLFileParser
+import CCDLUtil.DataManagement.ParseCache as CCDLParseCache
+import CCDLUtil.DataManagement.SortedIndex as CCDLSortedIndex
 import CCDLUtil.EEGInterface.DataSaver as CCDLEEGDatasaver
 import CCDLUtil.EEGInterface.gUSBAmp.GUSBAmpInterface as CCDLGusb
 import CCDLUtil.Experiment.Static.Static_ML_Util as CCDL_Static_ML
@@ -56,8 +59,13 @@ def extract_bci_data_by_type(eeg_data, eeg_type, eeg_col_index=0, clock_col_inde
     return eeg_indexes, clock_times, trim_data, aux_data
 
 
-def extract_csv(log_file_path, eeg_file_path, header_size=1):
-    trial_list, header_list = CCDLFileParser.load_ast_dictionary_by_trial(file_path=log_file_path, header_size=header_size)
+def extract_csv(log_file_path, eeg_file_path, header_size=1, parse_cache=None):
+    """
+    :param parse_cache: A DataManagement.ParseCache.ParseCache to load previously parsed log and eeg files from.
+                        If None, the files are parsed every time.  Defaults to None.
+    """
+    file_parser = CCDLFileParser if parse_cache is None else parse_cache
+    trial_list, header_list = file_parser.load_ast_dictionary_by_trial(file_path=log_file_path, header_size=header_size)
     start_eeg_index_keys = header_list[0]['start_eeg_index_keys']
     start_time_list_keys = header_list[0]['start_time_list_keys']
     end_eeg_index_keys = header_list[0]['end_eeg_index_keys']
@@ -68,7 +76,7 @@ def extract_csv(log_file_path, eeg_file_path, header_size=1):
     date_collected = header_list[0]['date_collected']
     eeg_type = header_list[0]['EEG_SYSTEM']
     task_description = header_list[0]['task_description']
-    eeg_indexes, clock_times, eeg_data, aux_data = extract_bci_data_by_type(eeg_data=CCDLFileParser.iter_loadtxt(filename=eeg_file_path, skiprows=15),
+    eeg_indexes, clock_times, eeg_data, aux_data = extract_bci_data_by_type(eeg_data=file_parser.load_eeg_recording(filename=eeg_file_path, skiprows=15),
                                                                             eeg_type=eeg_type)
     return start_eeg_index_keys, start_time_list_keys, end_eeg_index_keys, end_time_list_keys, tasks, eeg_type, task_description, eeg_indexes, clock_times, eeg_data, fs, date_collected, subject_name, aux_data, trial_list, header_list
 
@@ -113,19 +121,36 @@ def save_classifier(log_file_path, classifier, verbose=True):
         print "Classifier saved to:", new_path
 
 
-def main(log_file_path, eeg_file_path, eeg_type, channel_list, channel_dict, labels, relevant_indexes, feature_type, left_ssvep=11, right_ssvep=13, extract_by='indexes'):
+def main(log_file_path, eeg_file_path, eeg_type, channel_list, channel_dict, labels, relevant_indexes, feature_type, left_ssvep=11, right_ssvep=13, extract_by='indexes',
+         use_parse_cache=True, save_results=True):
+    """
+    Runs our pipeline on a single session: extract -> epoch -> Welch -> features -> leave one out cross validation,
+    then fits an LDA to all the data.  See StaticBatch.py to run it over many sessions.
+
+    :param use_parse_cache: If True (the default), parsed log and eeg files are cached on disk (see ParseCache).
+    :param save_results: If True (the default), saves the session as a .mat file and the fitted classifier next to
+                         the log file.
+    :return: Dictionary with the cross validation score ('cv_score'), the number of (windowed) epochs ('num_epochs'),
+             the fitted classifier ('classifier') and the seconds spent in each step ('extract_seconds',
+             'epoch_seconds', 'feature_seconds', 'cv_seconds').
+    """
+    step_start = time.time()
     start_eeg_index_keys, start_time_list_keys, end_eeg_index_keys, end_time_list_keys, tasks, eeg_type, task_description, eeg_indexes, clock_times, \
-        eeg_data, fs, date_collected, subject_name, aux_data, trial_list, header_list = extract_csv(log_file_path, eeg_file_path)
-
-    mat_save_path = log_file_path.replace('_log.txt', '.mat')
-
-    CCDLFileParser.save_standard_mat_format(save_path=mat_save_path, channel_names=channel_list, date_collected=date_collected, eeg_system=eeg_type,
-                                            event_markers={'start_eeg_index_keys': start_eeg_index_keys,
-                                                           'start_time_list_keys': start_time_list_keys,
-                                                           'end_eeg_index_keys': end_eeg_index_keys,
-                                                           'end_time_list_keys': end_time_list_keys},
-                                            experiment_description=task_description, fs=fs, packet_indexes=eeg_indexes, time_stamps=clock_times, unepoched_eeg_data=eeg_data,
-                                            aux_data=aux_data, subject_name=subject_name)
+        eeg_data, fs, date_collected, subject_name, aux_data, trial_list, header_list = extract_csv(
+            log_file_path, eeg_file_path, parse_cache=CCDLParseCache.ParseCache() if use_parse_cache else None)
+
+    if save_results:
+        mat_save_path = log_file_path.replace('_log.txt', '.mat')
+
+        CCDLFileParser.save_standard_mat_format(save_path=mat_save_path, channel_names=channel_list, date_collected=date_collected, eeg_system=eeg_type,
+                                                event_markers={'start_eeg_index_keys': start_eeg_index_keys,
+                                                               'start_time_list_keys': start_time_list_keys,
+                                                               'end_eeg_index_keys': end_eeg_index_keys,
+                                                               'end_time_list_keys': end_time_list_keys},
+                                                experiment_description=task_description, fs=fs, packet_indexes=eeg_indexes, time_stamps=clock_times, unepoched_eeg_data=eeg_data,
+                                                aux_data=aux_data, subject_name=subject_name)
+    timings = {'extract_seconds': time.time() - step_start}
+    step_start = time.time()
     nperseg = fs
     noverlap = int(fs // 2)
     """ Epoch the data """
@@ -150,9 +175,13 @@ def main(log_file_path, eeg_file_path, eeg_type, channel_list, channel_dict, lab
     rewindowed_epoched_data, labels, windows_per_epoch = CCDLDataParser.reepoch_data_with_fixed_window_size(epoched_data=epoched_data, labels=labels, window_size=CLASSIFICATION_WINDOW_SIZE_SECONDS * fs)
     # rewindowed_epoched_data -> shape (epoch, sample, channel)
     rewindowed_epoched_data = CCDLDataParser.idempotent_add_channel_dimension(rewindowed_epoched_data[:, :, relevant_indexes])
+    timings['epoch_seconds'] = time.time() - step_start
+    step_start = time.time()
 
     """ Extract our Features """
     freqs, density = CCDLFourier.get_fft_all_channels(data=rewindowed_epoched_data, fs=fs, nperseg=nperseg, noverlap=noverlap)
+    # welch frequencies are sorted by construction.  Every band lookup below shares this index (and its range cache).
+    freqs = CCDLSortedIndex.SortedIndex(freqs, check=False)
 
     # Todo fix this so it can do more than just alpha.
     if feature_type == CCDLStaticConstants.ALPHA:
@@ -164,9 +193,17 @@ def main(log_file_path, eeg_file_path, eeg_type, channel_list, channel_dict, lab
     else:
         raise
     features = features.squeeze()
+    timings['feature_seconds'] = time.time() - step_start
+    step_start = time.time()
 
     """ Fit Our Classifier """
-    print "Cross Validation Score:", np.average(CCDLCV.run_leave_one_out_cv(features=features, labels=labels))
+    cv_score = np.average(CCDLCV.run_leave_one_out_cv(features=features, labels=labels))
+    print "Cross Validation Score:", cv_score
     lda = LinearDiscriminantAnalysis()
     lda.fit(X=features, y=labels)
-    save_classifier(log_file_path=log_file_path, classifier=lda)
\ No newline at end of file
+    if save_results:
+        save_classifier(log_file_path=log_file_path, classifier=lda)
+    timings['cv_seconds'] = time.time() - step_start
+    result = {'cv_score': cv_score, 'num_epochs': len(labels), 'classifier': lda}
+    result.update(timings)
+    return result
\ No newline at end of file
@@ -199,11 +199,14 @@ def main_logic(logger_queue, eeg, eeg_system_type, task_description, crosshair_m
             # Get start time
             save_dict[start_time_key] = time.time()
             save_dict[start_eeg_index_key] = eeg.data_index
+            # The (fractional) sample of the recording acquired at the start time.  data_index is the last packet's.
+            save_dict[start_eeg_index_key + '_sample'] = eeg.clock.get_sample_index(save_dict[start_time_key])
             # Do task_description
             time.sleep(duration)
             # Get end task_description time
             save_dict[end_time_key] = time.time()
             save_dict[end_eeg_index_key] = eeg.data_index
+            save_dict[end_eeg_index_key + '_sample'] = eeg.clock.get_sample_index(save_dict[end_time_key])
             round_index += 1
         # Save all the stuff.
         logger_queue.put(str(save_dict) + '\n')
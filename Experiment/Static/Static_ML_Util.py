@@ -1,5 +1,6 @@
 import CCDLUtil.DataManagement.DataParser as CCDLDataParser
 import CCDLUtil.DataManagement.FileParser as CCDLFileParser
+import CCDLUtil.DataManagement.SortedIndex as CCDLSortedIndex
 import CCDLUtil.SignalProcessing.Fourier as CCDLFourier
 import numpy as np
 
@@ -7,7 +8,7 @@ import numpy as np
 def extract_ssvep_features(freqs, density_from_only_relevant_channels, freq_left, freq_right):
     """
 
-    :param freqs = list of freqs
+    :param freqs = list of freqs (or a DataManagement.SortedIndex.SortedIndex of them)
     :param density_from_only_relevant_channels = density shape (epoch, density, channel) OR (epoch, density)
     :param freq_left: int - frequency of the left light
     :param freq_right: int - frequency of the right light
@@ -16,6 +17,8 @@ def extract_ssvep_features(freqs, density_from_only_relevant_channels, freq_left
     :return: feature_names, features
         features is a np array of shape [epoch, feature]
     """
+    # Check freqs are sorted once, for both lookups.
+    freqs = CCDLSortedIndex.as_sorted_index(freqs)
     freqs_left, density_left = CCDLDataParser.trim_freqs(density=density_from_only_relevant_channels, freqs=freqs, low=freq_left, high=freq_left + 1)
     freqs_right, density_right = CCDLDataParser.trim_freqs(density=density_from_only_relevant_channels, freqs=freqs, low=freq_right, high=freq_right + 1)
     features = np.concatenate((density_left, density_right), axis=1)
@@ -25,7 +28,7 @@ def extract_ssvep_features(freqs, density_from_only_relevant_channels, freq_left
 
 def extract_single_ssvep_features(freqs, density_from_only_relevant_channels, freq_left, freq_right):
     """
-    :param freqs = list of freqs
+    :param freqs = list of freqs (or a DataManagement.SortedIndex.SortedIndex of them)
     :param density_from_only_relevant_channels = density shape (epoch, density, channel) OR (epoch, density)
     :param freq_left: int - frequency of the left light
     :param freq_right: int - frequency of the right light
@@ -42,7 +45,7 @@ def extract_single_ssvep_features(freqs, density_from_only_relevant_channels, fr
 
 def extact_alpha_features_single_channel(freqs, density_from_only_relevant_channels, inclusive_exclusive_alpha_band):
     """
-    :param freqs = list of freqs
+    :param freqs = list of freqs (or a DataManagement.SortedIndex.SortedIndex of them)
     :param density_from_only_relevant_channels = density shape (epoch, density, channel) OR (epoch, density)
     :param freq_left: int - frequency of the left light
     :param freq_right: int - frequency of the right light
@@ -2,6 +2,7 @@
 For filters related to EEG data processing.
 """
 
+import numpy as np
 import scipy.signal as scisig
 
 def butter_bandpass(low, high, fs, order=5):
@@ -28,4 +29,185 @@ def butter_bandpass_filter(data, low, high, fs, order=5):
     :return: filtered data (and modifies original data).
     """
     b, a = butter_bandpass(low, high, fs, order=order)
-    return scisig.lfilter(b, a, data)
\ No newline at end of file
+    return scisig.lfilter(b, a, data)
+
+class FIRDecimator(object):
+    """
+    Low pass filters and downsamples multichannel data that arrives in blocks (such as the 100 sample BrainAmp
+    packets), carrying the filter state from one block to the next.  Decimating a stream block by block gives the
+    same output as decimating the whole recording at once.
+
+    Only the samples we keep are computed (one dot product with the filter per output sample), which is the saving
+    a polyphase decimator gives over filtering at the full rate and then throwing samples away.
+
+    Filtering delays the signal by self.delay input samples ((numtaps - 1) / 2).
+    """
+
+    def __init__(self, factor, numtaps=None, cutoff=0.8):
+        """
+        :param factor: Downsampling factor - we keep one sample out of every factor samples.
+        :param numtaps: Length of the low pass FIR filter.  Longer filters have a sharper cutoff, but take longer to
+                        compute and delay the signal more.  Defaults to 30 * factor + 1.
+        :param cutoff: Cutoff frequency as a fraction of the new Nyquist frequency.  Defaults to 0.8
+                       (200 Hz when going from 5000 Hz to 500 Hz).
+        """
+        self.factor = int(factor)
+        self.numtaps = numtaps if numtaps is not None else 30 * self.factor + 1
+        if self.factor == 1:
+            self.taps = np.ones(1)
+        else:
+            self.taps = scisig.firwin(self.numtaps, cutoff / self.factor)
+        self.numtaps = len(self.taps)
+        # Reversed, so a dot product with the last numtaps input samples gives the next output sample.
+        self.reversed_taps = self.taps[::-1].copy()
+        self.delay = (self.numtaps - 1) / 2.0
+        self.history = None
+        # Index, into the next block, of the next sample we keep.
+        self.next_offset = 0
+
+    def reset(self):
+        """
+        Forgets the filter state.  The next block is treated as the start of a new recording.
+        """
+        self.history = None
+        self.next_offset = 0
+
+    def process(self, block):
+        """
+        Filters and downsamples the next block of data.
+        :param block: np array of shape (sample, channel).  It is not modified (and can be reused once we return).
+        :return: np array of shape (downsampled sample, channel).  Successive blocks of length factor * n return
+                 n samples each.
+        """
+        block = np.asarray(block, dtype=float)
+        if self.history is None:
+            # Act as though the signal had been constant before the first sample, so large DC offsets do not
+            # cause a start up transient.
+            self.history = np.repeat(block[:1], self.numtaps - 1, axis=0)
+        extended = np.concatenate([self.history, block], axis=0)
+        output_offsets = range(self.next_offset, len(block), self.factor)
+        output = np.empty((len(output_offsets), block.shape[1]))
+        for ii, offset in enumerate(output_offsets):
+            output[ii] = np.dot(self.reversed_taps, extended[offset:offset + self.numtaps])
+        self.next_offset += len(output_offsets) * self.factor - len(block)
+        self.history = extended[len(extended) - self.numtaps + 1:].copy()
+        return output
+
+
+# Filter designs (second order sections), keyed by (filter type, band, fs, order).  Designing a filter is much slower
+# than applying it to a block, so each design is only computed once.
+_sos_design_cache = dict()
+
+
+def design_butter_sos(band, fs, order=4, btype='bandpass'):
+    """
+    Designs (or gets from our cache) a Butterworth filter as second order sections.
+    :param band: Cutoff frequency (hz) for 'highpass' and 'lowpass', or (low, high) for 'bandpass' and 'bandstop'
+    :param fs: Sampling rate (hz)
+    :param order: Order of filter to use (default = 4)
+    :param btype: 'bandpass', 'highpass', 'lowpass' or 'bandstop'
+    :return: sos np array of shape (sections, 6).  Do not modify it, as it is shared.
+    """
+    band = tuple(band) if np.iterable(band) else band
+    key = (btype, band, fs, order)
+    if key not in _sos_design_cache:
+        nyq = 0.5 * fs
+        normalized = [f / nyq for f in band] if np.iterable(band) else band / nyq
+        _sos_design_cache[key] = scisig.butter(order, normalized, btype=btype, output='sos')
+    return _sos_design_cache[key]
+
+
+def design_notch_sos(freq, fs, quality=30.0):
+    """
+    Designs (or gets from our cache) a notch filter as second order sections.
+    :param freq: Frequency to remove (hz), such as 60 for line noise
+    :param fs: Sampling rate (hz)
+    :param quality: Quality factor - the notch is freq / quality hz wide.  Defaults to 30
+    :return: sos np array of shape (1, 6).  Do not modify it, as it is shared.
+    """
+    key = ('notch', freq, fs, quality)
+    if key not in _sos_design_cache:
+        b, a = scisig.iirnotch(freq / (0.5 * fs), quality)
+        _sos_design_cache[key] = scisig.tf2sos(b, a)
+    return _sos_design_cache[key]
+
+
+class OnlineFilterBank(object):
+    """
+    Filters live data block by block, keeping the filter state (zi) of each channel between blocks, so consecutive
+    blocks are filtered as one continuous signal (no transients at block boundaries).
+
+    Stages are chained and applied in the order they are added:
+
+        filter_bank = OnlineFilterBank(fs=500).add_notch(60).add_highpass(0.5).add_bandpass(8, 30)
+        while True:
+            block = out_buffer_queue.get()  # shape (sample, channel)
+            filter_bank.process(block, in_place=True)
+    """
+
+    def __init__(self, fs):
+        """
+        :param fs: Sampling rate (hz) of the data to filter.
+        """
+        self.fs = fs
+        self.stage_names = []
+        self.sos = np.zeros((0, 6))
+        # Shape (sections, 2, channel).  Set from the first block.
+        self.zi = None
+
+    def _add_stage(self, name, sos):
+        if self.zi is not None:
+            raise RuntimeError('Stages must be added before the first block is processed')
+        self.stage_names.append(name)
+        self.sos = np.concatenate([self.sos, sos], axis=0)
+        return self
+
+    def add_notch(self, freq=60, quality=30.0):
+        """
+        Adds a notch filter stage.  Returns self, so stages can be chained.
+        """
+        return self._add_stage('notch %g hz' % freq, design_notch_sos(freq, self.fs, quality))
+
+    def add_highpass(self, cutoff, order=4):
+        """
+        Adds a Butterworth high pass stage.  Returns self, so stages can be chained.
+        """
+        return self._add_stage('highpass %g hz' % cutoff, design_butter_sos(cutoff, self.fs, order, 'highpass'))
+
+    def add_lowpass(self, cutoff, order=4):
+        """
+        Adds a Butterworth low pass stage.  Returns self, so stages can be chained.
+        """
+        return self._add_stage('lowpass %g hz' % cutoff, design_butter_sos(cutoff, self.fs, order, 'lowpass'))
+
+    def add_bandpass(self, low, high, order=4):
+        """
+        Adds a Butterworth band pass stage.  Returns self, so stages can be chained.
+        """
+        return self._add_stage('bandpass %g-%g hz' % (low, high),
+                               design_butter_sos((low, high), self.fs, order, 'bandpass'))
+
+    def reset(self):
+        """
+        Forgets the filter state.  The next block is treated as the start of a new recording.
+        """
+        self.zi = None
+
+    def process(self, block, in_place=False):
+        """
+        Filters the next block of data.
+        :param block: np array of shape (sample, channel)
+        :param in_place: If True, the filtered data is written back into block (which must be a float np array).
+        :return: The filtered block, of shape (sample, channel)
+        """
+        if len(self.stage_names) == 0:
+            return block
+        data = np.asarray(block)
+        if self.zi is None:
+            # Start from the steady state for the first sample, so DC offsets do not cause a start up transient.
+            self.zi = scisig.sosfilt_zi(self.sos)[:, :, np.newaxis] * data[0].astype(float)[np.newaxis, np.newaxis, :]
+        filtered, self.zi = scisig.sosfilt(self.sos, data, axis=0, zi=self.zi)
+        if in_place:
+            block[...] = filtered
+            return block
+        return filtered
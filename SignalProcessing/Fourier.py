@@ -3,10 +3,10 @@ Functions related to the fourier transform.
 """
 
 import scipy.signal as scisig
-import bisect
 import matplotlib.pyplot as plt
 import numpy as np
 import CCDLUtil.DataManagement.DataParser as CCDLDataParser
+import CCDLUtil.DataManagement.SortedIndex as CCDLSortedIndex
 
 
 def get_channel_fft(single_channel_signal, fs, nperseg, noverlap, filter_sig=False, filter_above=40, filter_below=1):
@@ -14,8 +14,9 @@ def get_channel_fft(single_channel_signal, fs, nperseg, noverlap, filter_sig=Fal
     """
     freqs, density = scisig.welch(single_channel_signal, fs=fs, nperseg=nperseg, noverlap=noverlap)
     if filter_sig:
-        low_index = bisect.bisect_left(freqs, filter_below)
-        high_index = bisect.bisect_right(freqs, filter_above)
+        # welch frequencies are sorted by construction.
+        low_index, high_index = CCDLSortedIndex.SortedIndex(freqs, check=False).get_range(
+            filter_below, filter_above, inclusive_high=True)
         freqs = freqs[low_index:high_index]
         density = density[low_index:high_index]
     return freqs, density
@@ -46,14 +47,14 @@ def get_fft_all_channels(data, fs, nperseg, noverlap):
 def band_power(freqs, density, inclusive_range):
     """
     Calculates the band power for the passed frequency spectrum
-    :param freqs: List of frequencies
+    :param freqs: List of frequencies, or a DataManagement.SortedIndex.SortedIndex of them (so that repeated calls
+                  check they are sorted once, and reuse the bins of bands they have already seen).
     :param density: Densities of the corresponding frequencies
     :param inclusive_range: Inclusive range to calculate the band power over
     :return: Unnormalized Band power over the given range - shape -> (epoch, channel)
     """
     low, high = inclusive_range
-    low_index = bisect.bisect_left(freqs, low)
-    high_index = bisect.bisect_right(freqs, high)
+    low_index, high_index = CCDLSortedIndex.as_sorted_index(freqs).get_range(low, high, inclusive_high=True)
     # density -> shape (epoch, density)
     # high index is noninclusive when indexing a np array, add 1 to account for this.
     # Square the density
@@ -72,6 +73,7 @@ def get_typical_channel_band_power(freqs, density):
     :return: delta, theta, alpha, low_beta, high_beta
     """
     # Get the band powers of delta, theta, alpha, low_beta, high_beta
+    freqs = CCDLSortedIndex.as_sorted_index(freqs)
     # delta is a np array of shape [epoch, channel]
     delta = band_power(freqs, density, (1, 4))
     theta = band_power(freqs, density, (4, 8))
@@ -85,7 +87,7 @@ def get_typical_channel_band_power(freqs, density):
 def extract_band_features(freqs, density, inclusive_exclusive_bands, channels=None):
     """
     Extracts the power from a given band from the channels.
-    :param freqs: Frequencies of the density matrix
+    :param freqs: Frequencies of the density matrix (or a DataManagement.SortedIndex.SortedIndex of them)
     :param density: Shape - (epoch, spectral density, channel)
     :param inclusive_exclusive_bands: Tuple -- band to extract the power for. example: (15, 18) extracts frequencies greater than or equal to 15 and less than
             18 hertz
@@ -94,6 +96,7 @@ def extract_band_features(freqs, density, inclusive_exclusive_bands, channels=No
     """
 
     features = None
+    freqs = CCDLSortedIndex.as_sorted_index(freqs)
     for band in inclusive_exclusive_bands:
         try:
 
@@ -104,4 +107,176 @@ def extract_band_features(freqs, density, inclusive_exclusive_bands, channels=No
             temp_density = temp_density[:, :, channels]
         band_density = np.sum(temp_density, axis=1)
         features = CCDLDataParser.stack_data_values(existing=features, value_to_stack=band_density, axis=1)
-    return features
\ No newline at end of file
+    return features
+
+class IncrementalWelch(object):
+    """
+    Welch power spectral density of the most recent window of a live signal, updated as packets arrive.
+
+    Each segment's power spectrum is computed once, when its last sample arrives, and kept in a ring holding a window's
+    worth of segments.  Adding a segment only costs that segment's FFT (rather than recomputing every segment in the
+    window).  Once the window is full, get_density matches scipy.signal.welch (hann window, constant detrend, density
+    scaling) on the last window_size samples whenever the window ends on a segment boundary.
+    """
+
+    def __init__(self, fs, nperseg, noverlap, window_size, window='hann'):
+        """
+        :param fs: sampling rate
+        :param nperseg: nperseg for welch
+        :param noverlap: noverlap for welch.  nperseg - noverlap is how often (in samples) the estimate is updated.
+        :param window_size: Number of samples in the window the density is estimated over.
+        :param window: Window applied to each segment. Defaults to 'hann' (as in scipy.signal.welch)
+        """
+        if window_size < nperseg:
+            raise ValueError("window_size (%d) must be at least nperseg (%d)" % (window_size, nperseg))
+        self.fs = fs
+        self.nperseg = nperseg
+        self.step = nperseg - noverlap
+        self.num_segments = (window_size - nperseg) // self.step + 1
+        self.window = scisig.get_window(window, nperseg)
+        self.scale = 1.0 / (fs * np.sum(self.window ** 2))
+        self.freqs = np.fft.rfftfreq(nperseg, 1.0 / fs)
+        # Samples not yet consumed - the next segment starts at pending[0].
+        self.pending = None
+        # Shape (segment, frequency, channel)
+        self.segment_psds = None
+        self.psd_sum = None
+        self.ring_index = 0
+        self.num_filled = 0
+
+    def add(self, block):
+        """
+        Adds a packet of samples.
+        :param block: np array of shape (sample, channel)
+        :return: Number of new segments added to the estimate.
+        """
+        block = np.asarray(block, dtype=float)
+        if self.pending is None:
+            self.pending = block[:0]
+            self.segment_psds = np.zeros((self.num_segments, len(self.freqs), block.shape[1]))
+            self.psd_sum = np.zeros((len(self.freqs), block.shape[1]))
+        self.pending = np.concatenate([self.pending, block], axis=0)
+        num_new = 0
+        while len(self.pending) >= self.nperseg:
+            self._add_segment(self.pending[:self.nperseg])
+            self.pending = self.pending[self.step:]
+            num_new += 1
+        return num_new
+
+    def _add_segment(self, segment):
+        segment = (segment - np.mean(segment, axis=0)) * self.window[:, np.newaxis]
+        psd = np.abs(np.fft.rfft(segment, axis=0)) ** 2 * self.scale
+        # One sided - double everything but DC (and Nyquist, for an even nperseg).
+        if self.nperseg % 2:
+            psd[1:] *= 2
+        else:
+            psd[1:-1] *= 2
+        self.psd_sum += psd - self.segment_psds[self.ring_index]
+        self.segment_psds[self.ring_index] = psd
+        self.ring_index = (self.ring_index + 1) % self.num_segments
+        self.num_filled = min(self.num_filled + 1, self.num_segments)
+        if self.ring_index == 0:
+            # Once per trip around the ring, recompute the sum so rounding errors do not accumulate.
+            self.psd_sum = np.sum(self.segment_psds, axis=0)
+
+    def is_ready(self):
+        """
+        True once a full window of segments has been added.
+        """
+        return self.num_filled == self.num_segments
+
+    def get_density(self):
+        """
+        :return: freqs, np array of densities - shape (density, channel).  Averages the segments added so far if the
+                 window is not yet full.
+        """
+        if self.num_filled == 0:
+            raise ValueError("No complete segments yet - need at least %d samples" % self.nperseg)
+        return self.freqs, self.psd_sum / self.num_filled
+
+
+class SlidingBinPower(object):
+    """
+    Tracks the power at a handful of frequencies (such as the SSVEP stimulation frequencies) over the most recent
+    window of a live signal, updated with every packet.
+
+    Like the Goertzel algorithm, only the DFT terms for the requested frequencies are computed: each packet adds the
+    terms for its samples and removes the terms for the samples that left the window, so an update costs
+    O(samples in the packet) rather than O(window).  Frequencies do not need to fall on an FFT bin.  A hann window is
+    applied by also tracking the two neighbouring bins (frequency -/+ fs / window_size) and combining them.
+    """
+
+    def __init__(self, fs, freqs, window_size, hann=True):
+        """
+        :param fs: sampling rate
+        :param freqs: List of frequencies (hz) to track
+        :param window_size: Number of samples in the window the power is estimated over.
+        :param hann: If True (default), a hann window is applied.  Otherwise a rectangular window is used.
+        """
+        self.fs = fs
+        self.freqs = np.asarray(freqs, dtype=float)
+        self.window_size = window_size
+        self.hann = hann
+        bin_width = float(fs) / window_size
+        tracked = [self.freqs - bin_width, self.freqs, self.freqs + bin_width] if hann else [self.freqs]
+        # Angular frequency (radians per sample) of every tracked DFT term.
+        self.omegas = 2 * np.pi * np.concatenate(tracked) / fs
+        window_power = 3.0 * window_size / 8 if hann else float(window_size)
+        self.scale = 2.0 / (fs * window_power)
+        # Last window_size samples, indexed by sample number % window_size.
+        self.history = None
+        # DFT terms, shape (tracked frequency, channel), with phase relative to sample number 0.
+        self.terms = None
+        self.num_samples = 0
+
+    def _dft(self, sample_numbers, samples):
+        return np.dot(np.exp(-1j * np.outer(self.omegas, sample_numbers)), samples)
+
+    def add(self, block):
+        """
+        Adds a packet of samples.
+        :param block: np array of shape (sample, channel)
+        """
+        block = np.asarray(block, dtype=float)
+        if self.history is None:
+            self.history = np.zeros((self.window_size, block.shape[1]))
+            self.terms = np.zeros((len(self.omegas), block.shape[1]), dtype=complex)
+        for start in xrange(0, len(block), self.window_size):
+            self._add_chunk(block[start:start + self.window_size])
+
+    def _add_chunk(self, chunk):
+        sample_numbers = np.arange(self.num_samples, self.num_samples + len(chunk))
+        ring_indexes = sample_numbers % self.window_size
+        self.terms += self._dft(sample_numbers, chunk)
+        expired = sample_numbers - self.window_size
+        if expired[-1] >= 0:
+            keep = expired >= 0
+            self.terms -= self._dft(expired[keep], self.history[ring_indexes[keep]])
+        self.history[ring_indexes] = chunk
+        previous_windows = self.num_samples // self.window_size
+        self.num_samples += len(chunk)
+        if self.num_samples // self.window_size != previous_windows:
+            # Once per window, recompute the terms from the history so rounding errors do not accumulate.
+            sample_numbers = np.arange(max(self.num_samples - self.window_size, 0), self.num_samples)
+            self.terms = self._dft(sample_numbers, self.history[sample_numbers % self.window_size])
+
+    def is_ready(self):
+        """
+        True once a full window of samples has been added.
+        """
+        return self.num_samples >= self.window_size
+
+    def get_power(self):
+        """
+        :return: np array of power spectral densities at our freqs - shape (frequency, channel)
+        """
+        num_freqs = len(self.freqs)
+        if not self.hann:
+            return np.abs(self.terms) ** 2 * self.scale
+        # The hann window (0.5 - 0.5 cos) in terms of the DFT at the neighbouring bins, for the window starting at
+        # sample number window_start.
+        window_start = max(self.num_samples - self.window_size, 0)
+        shift = np.exp(-2j * np.pi * (window_start % self.window_size) / self.window_size)
+        lower, center, upper = self.terms[:num_freqs], self.terms[num_freqs:2 * num_freqs], self.terms[2 * num_freqs:]
+        windowed = 0.5 * center - 0.25 * shift * lower - 0.25 * np.conj(shift) * upper
+        return np.abs(windowed) ** 2 * self.scale
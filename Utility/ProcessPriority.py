@@ -0,0 +1,81 @@
+"""
+Pins the calling process to CPUs and raises its scheduling priority, where the operating system allows it.
+
+Used by EEGInterface.AcquisitionHost to keep the acquisition process from being delayed by the rest of the experiment.
+Nothing here raises if a setting is not permitted (raising priority usually needs root on Linux, or administrator
+rights for the realtime class on Windows) - a warning is printed and the rest are still applied.
+"""
+
+import os
+import ctypes
+import ctypes.util
+import CCDLUtil.Utility.SystemInformation as CCDLSystemInformation
+
+# Linux sched_setscheduler policy
+SCHED_FIFO = 1
+# Windows priority classes
+HIGH_PRIORITY_CLASS = 0x80
+REALTIME_PRIORITY_CLASS = 0x100
+
+
+def elevate_process(cpus=None, realtime=False, realtime_priority=50, nice=None):
+    """
+    Applies CPU pinning and priority settings to the calling process.
+
+    :param cpus: Optional -- List of CPU numbers to run on.  Defaults to None (any CPU).
+    :param realtime: If True, SCHED_FIFO on Linux (at realtime_priority) or the realtime priority class on Windows
+                     (the high priority class is tried if that fails).  Defaults to False.
+    :param realtime_priority: Linux SCHED_FIFO priority, 1 to 99.  Defaults to 50.
+    :param nice: Optional -- Linux nice value to set (negative values raise priority).  Defaults to None.
+    :return: Dictionary of what was applied: {'cpus': list or None, 'realtime': bool, 'nice': int or None}
+    """
+    applied = {'cpus': None, 'realtime': False, 'nice': None}
+    if cpus is not None:
+        cpus = sorted(set(cpus))
+        if _set_affinity(cpus):
+            applied['cpus'] = cpus
+        else:
+            print "Warning: could not pin the process to cpus %s." % str(cpus)
+    if nice is not None:
+        try:
+            os.nice(nice - os.nice(0))
+            applied['nice'] = os.nice(0)
+        except (OSError, AttributeError):
+            print "Warning: could not set the nice value to %d (lowering it usually needs root)." % nice
+    if realtime:
+        applied['realtime'] = _set_realtime(realtime_priority)
+        if not applied['realtime']:
+            print "Warning: could not give the process realtime priority (this usually needs root or administrator rights)."
+    return applied
+
+
+def _get_libc():
+    return ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+
+def _set_affinity(cpus):
+    if CCDLSystemInformation.is_linux():
+        # cpu_set_t is a bit mask, 1024 bits long.
+        bits_per_word = ctypes.sizeof(ctypes.c_ulong) * 8
+        mask = (ctypes.c_ulong * (1024 / bits_per_word))()
+        for cpu in cpus:
+            mask[cpu / bits_per_word] |= 1 << (cpu % bits_per_word)
+        return _get_libc().sched_setaffinity(0, ctypes.sizeof(mask), ctypes.byref(mask)) == 0
+    elif CCDLSystemInformation.is_windows():
+        kernel32 = ctypes.windll.kernel32
+        mask = sum([1 << cpu for cpu in cpus])
+        return kernel32.SetProcessAffinityMask(kernel32.GetCurrentProcess(), ctypes.c_size_t(mask)) != 0
+    return False
+
+
+def _set_realtime(realtime_priority):
+    if CCDLSystemInformation.is_linux():
+        # struct sched_param holds a single int.
+        param = ctypes.c_int(realtime_priority)
+        return _get_libc().sched_setscheduler(0, SCHED_FIFO, ctypes.byref(param)) == 0
+    elif CCDLSystemInformation.is_windows():
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.GetCurrentProcess()
+        return kernel32.SetPriorityClass(handle, REALTIME_PRIORITY_CLASS) != 0 or \
+            kernel32.SetPriorityClass(handle, HIGH_PRIORITY_CLASS) != 0
+    return False